@@ -14,6 +14,73 @@ class Config:
     ACCESS_TOKEN_EXPIRE_MINUTES = 10
     # FHIR Server
     FHIR_BASE_URL: str = os.getenv("FHIR_BASE_URL", "https://hapi.fhir.org/baseR5")
+    FHIR_CONNECT_TIMEOUT: float = float(os.getenv("FHIR_CONNECT_TIMEOUT", "5"))
+    FHIR_READ_TIMEOUT: float = float(os.getenv("FHIR_READ_TIMEOUT", "30"))
+    FHIR_MAX_CONNECTIONS: int = int(os.getenv("FHIR_MAX_CONNECTIONS", "100"))
+    FHIR_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("FHIR_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    FHIR_KEEPALIVE_EXPIRY: float = float(os.getenv("FHIR_KEEPALIVE_EXPIRY", "30"))
+    FHIR_MAX_CONNECTIONS_PER_HOST: int = int(os.getenv("FHIR_MAX_CONNECTIONS_PER_HOST", "10"))
+    FHIR_HTTP2: bool = os.getenv("FHIR_HTTP2", "true").lower() == "true"
+    FHIR_PAGE_SIZE: int = int(os.getenv("FHIR_PAGE_SIZE", "50"))
+    FHIR_MAX_PAGES: int = int(os.getenv("FHIR_MAX_PAGES", "20"))
+    FHIR_MAX_RESOURCES: int = int(os.getenv("FHIR_MAX_RESOURCES", "10000"))
+    FHIR_PAGE_CONCURRENCY: int = int(os.getenv("FHIR_PAGE_CONCURRENCY", "4"))
+    # Ids per `_id=` / `subject=` list, and the largest cohort used to constrain other sub-queries
+    FHIR_ID_CHUNK_SIZE: int = int(os.getenv("FHIR_ID_CHUNK_SIZE", "100"))
+    COHORT_CONSTRAIN_MAX_IDS: int = int(os.getenv("COHORT_CONSTRAIN_MAX_IDS", "500"))
+    # Several GETs go out as one `type: batch` Bundle: 'auto' (servers declaring batch, once the
+    # measured RTT is at least FHIR_BATCH_MIN_RTT_MS), 'always' or 'never'
+    FHIR_BATCH_MODE: str = os.getenv("FHIR_BATCH_MODE", "auto")
+    FHIR_BATCH_MIN_RTT_MS: float = float(os.getenv("FHIR_BATCH_MIN_RTT_MS", "50"))
+    FHIR_BATCH_MAX_ENTRIES: int = int(os.getenv("FHIR_BATCH_MAX_ENTRIES", "50"))
+    # 'elements' (_elements), 'summary' (_summary=data, for servers without _elements) or 'none';
+    # nothing falls back between them, so set 'summary' for a server that ignores _elements
+    FHIR_PROJECTION: str = os.getenv("FHIR_PROJECTION", "elements")
+    FHIR_STREAM_BUNDLES: bool = os.getenv("FHIR_STREAM_BUNDLES", "true").lower() == "true"
+    FHIR_CACHE_ENABLED: bool = os.getenv("FHIR_CACHE_ENABLED", "true").lower() == "true"
+    FHIR_CACHE_MAX_BYTES: int = int(os.getenv("FHIR_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    FHIR_CACHE_DEFAULT_TTL: float = float(os.getenv("FHIR_CACHE_DEFAULT_TTL", "60"))
+    # Seconds per resource type (or operation), e.g. "metadata:3600,Patient:600"
+    FHIR_CACHE_TTLS: str = os.getenv("FHIR_CACHE_TTLS", "metadata:3600,Patient:600,Condition:300")
+
+    # NLP
+    SPACY_MODEL: str = os.getenv("SPACY_MODEL", "en_core_web_sm")
+    NLP_BATCH_SIZE: int = int(os.getenv("NLP_BATCH_SIZE", "64"))
+    NLP_N_PROCESS: int = int(os.getenv("NLP_N_PROCESS", "1"))
+    # Most parser processes a /query/batch request may ask nlp.pipe for
+    NLP_MAX_N_PROCESS: int = int(os.getenv("NLP_MAX_N_PROCESS", "4"))
+    # 'inline', 'thread' or 'process'
+    NLP_EXECUTOR_MODE: str = os.getenv("NLP_EXECUTOR_MODE", "thread")
+    NLP_WORKERS: int = int(os.getenv("NLP_WORKERS", "2"))
+    NLP_MAX_QUEUE: int = int(os.getenv("NLP_MAX_QUEUE", "32"))
+    NLP_RETRY_AFTER: int = int(os.getenv("NLP_RETRY_AFTER", "1"))
+    # Tab-separated term/system/code/display lexicon (or a prebuilt terminology index) and
+    # where the compiled index and matcher are cached
+    CONDITION_LEXICON: str = os.getenv("CONDITION_LEXICON", os.path.join(basedir, "nlp", "data", "conditions.tsv"))
+    # Must be a directory only this user can write: the cached matcher is unpickled from it
+    CONDITION_MATCHER_CACHE_DIR: str = os.getenv(
+        "CONDITION_MATCHER_CACHE_DIR",
+        os.path.join(os.getenv("XDG_CACHE_HOME") or os.path.expanduser(os.path.join("~", ".cache")), "fhir-nlp"))
+    # Real words that are only suggested as a correction, never searched corrected
+    CONDITION_COMMON_WORDS: str = os.getenv(
+        "CONDITION_COMMON_WORDS", os.path.join(basedir, "nlp", "data", "common_words.txt"))
+    # Edit distance for correcting misspelled condition words (0 disables correction)
+    CONDITION_SPELLING_MAX_DISTANCE: int = int(os.getenv("CONDITION_SPELLING_MAX_DISTANCE", "2"))
+
+    # Parsed plans memoized by normalized query text, and query results by plan hash
+    PLAN_CACHE_MAX_ENTRIES: int = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "1024"))
+    RESULT_CACHE_MAX_ENTRIES: int = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+    RESULT_CACHE_TTL: float = float(os.getenv("RESULT_CACHE_TTL", "60"))
+
+    # /query result pages, served from result sets held by handle
+    QUERY_PAGE_SIZE: int = int(os.getenv("QUERY_PAGE_SIZE", "100"))
+    QUERY_PAGE_MAX_SIZE: int = int(os.getenv("QUERY_PAGE_MAX_SIZE", "1000"))
+    RESULT_SET_MAX_ENTRIES: int = int(os.getenv("RESULT_SET_MAX_ENTRIES", "64"))
+    RESULT_SET_TTL: float = float(os.getenv("RESULT_SET_TTL", "600"))
+
+    # Batch queries
+    BATCH_MAX_QUERIES: int = int(os.getenv("BATCH_MAX_QUERIES", "100"))
+    BATCH_QUERY_CONCURRENCY: int = int(os.getenv("BATCH_QUERY_CONCURRENCY", "4"))
 
     SECRET_KEY: str = 'ONE'
     ALGORITHM: str = "HS256"
@@ -1,5 +1,5 @@
 from typing import Annotated
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -9,6 +9,10 @@ from app.schemas.auth import TokenData
 from app.database.db_engine import get_session # Your DB session dependency
 from app.models.user import UserModel
 from app.services.user_services import get_user_by_username
+from app.nlp.fhir_nlp_service import FHIRQueryProcessor
+from app.nlp.model_registry import get_model
+from app.nlp.executor import NLPExecutor
+from app.services.result_store import ResultStore
 from app.logger import logger
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -58,3 +62,30 @@ async def get_current_active_user(
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
+
+
+def get_fhir_processor(request: Request) -> FHIRQueryProcessor:
+    """Return the worker-wide FHIRQueryProcessor built in the app lifespan"""
+    processor = getattr(request.app.state, "fhir_processor", None)
+    if processor is None:
+        # Lifespan did not run (e.g. TestClient used without a context manager)
+        processor = FHIRQueryProcessor(nlp=get_model())
+        request.app.state.fhir_processor = processor
+    return processor
+
+
+def get_nlp_executor(request: Request, processor: FHIRQueryProcessor = Depends(get_fhir_processor)) -> NLPExecutor:
+    """Return the worker-wide NLP executor built in the app lifespan"""
+    executor = getattr(request.app.state, "nlp_executor", None)
+    if executor is None or executor.processor is not processor:
+        executor = NLPExecutor(processor, mode="inline")
+    return executor
+
+
+def get_result_store(request: Request) -> ResultStore:
+    """Return the worker-wide store of pageable query results"""
+    store = getattr(request.app.state, "result_store", None)
+    if store is None:
+        store = ResultStore()
+        request.app.state.result_store = store
+    return store
@@ -1,16 +1,43 @@
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes import h_check_router, auth_router, user_router
 import uvicorn
-from app.database.db_engine import get_session, create_db_and_tables
+from app.database.db_engine import create_db_and_tables
+from app.nlp.fhir_nlp_service import FHIRQueryProcessor
+from app.nlp.model_registry import get_model
+from app.nlp.executor import NLPExecutor
+from app.config import Config
+from app.services.fhir_client import FHIRClient
+from app.services.fhir_cache import FHIRResponseCache
+from app.services.result_store import ResultStore
 from .logger import logger
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await create_db_and_tables()
+
+    # One spaCy pipeline, HTTP pool and processor per worker, shared by every request
+    app.state.fhir_client = FHIRClient(cache=FHIRResponseCache() if Config.FHIR_CACHE_ENABLED else None)
+    app.state.fhir_processor = FHIRQueryProcessor(nlp=get_model(), fhir_client=app.state.fhir_client)
+    await app.state.fhir_processor.load_capabilities()
+    warm_up_time = app.state.fhir_processor.warm_up()
+    logger.info(f'NLP processor warmed up in {warm_up_time}ms')
+    app.state.nlp_executor = NLPExecutor(app.state.fhir_processor)
+    app.state.result_store = ResultStore()
+
+    yield
+
+    app.state.nlp_executor.shutdown()
+    await app.state.fhir_client.aclose()
+
+
 def create_app() -> FastAPI:
-    app: FastAPI = FastAPI(db_lifespan=get_session)
+    app: FastAPI = FastAPI(lifespan=lifespan)
     logger.info(f'Application started -----------')
 
 
@@ -34,10 +61,6 @@ def create_app() -> FastAPI:
     return app
 
 app = create_app()
-# Startup event
-@app.on_event("startup")
-async def on_startup():
-    await create_db_and_tables()
 
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8000)
@@ -0,0 +1,63 @@
+import threading
+from collections import defaultdict
+from typing import Any, Dict
+
+
+class Metrics:
+    """In-process metrics registry: counters, gauges and timing summaries"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.gauges: Dict[str, float] = {}
+        self.timings: Dict[str, Dict[str, float]] = {}
+
+    def incr(self, name: str, value: int = 1):
+        """Increment a counter"""
+        with self._lock:
+            self.counters[name] += value
+
+    def set_gauge(self, name: str, value: float):
+        """Set a gauge to its latest value"""
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        """Record a timing/size observation"""
+        with self._lock:
+            timing = self.timings.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0})
+            timing['count'] += 1
+            timing['total'] += value
+            timing['last'] = value
+            timing['max'] = max(timing['max'], value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a copy of every metric, suitable for a JSON response"""
+        with self._lock:
+            timings = {
+                name: {**timing, 'avg': timing['total'] / timing['count'] if timing['count'] else 0.0}
+                for name, timing in self.timings.items()
+            }
+            # Every `<layer>_hits` / `<layer>_misses` counter pair is a cache layer
+            hit_rates = {}
+            for name, hits in self.counters.items():
+                if name.endswith('_hits'):
+                    layer = name[:-len('_hits')]
+                    lookups = hits + self.counters.get(f'{layer}_misses', 0)
+                    hit_rates[layer] = hits / lookups if lookups else 0.0
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'timings': timings,
+                'hit_rates': hit_rates
+            }
+
+    def reset(self):
+        """Clear every metric (used by tests)"""
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timings.clear()
+
+
+metrics = Metrics()
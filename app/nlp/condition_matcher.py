@@ -0,0 +1,268 @@
+import hashlib
+import os
+import pickle
+import stat
+import tempfile
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from app.config import Config
+from app.logger import logger
+from app.metrics import metrics
+from app.nlp.spelling import SymSpell
+from app.nlp.terminology_index import TerminologyIndex, build_index, is_index, read_source, words
+
+# Bumped whenever the pickled layout changes so stale caches are rebuilt
+CACHE_FORMAT = 3
+
+# Shorter words are too often ordinary English a couple of edits from a term
+MIN_CORRECTION_LENGTH = 4
+
+_matchers: Dict[str, "ConditionMatcher"] = {}
+
+
+class ConditionMatcher:
+    """Aho-Corasick automaton over lexicon words.
+
+    Terms are matched word by word, so a scan costs one transition per
+    input word (plus one per match) however many terms the lexicon holds,
+    and multi-word terms such as "type 2 diabetes" never match inside
+    longer words. Overlapping matches resolve leftmost-longest. Codings are
+    looked up in `terms` (normally a memory-mapped TerminologyIndex), which
+    is not part of the pickled automaton.
+
+    Words outside the lexicon can be corrected first with a symmetric-delete
+    speller over the lexicon's own words (see `match_with_corrections`).
+    `real_words` (normally read from CONDITION_COMMON_WORDS) are only ever
+    suggested a correction; like `terms`, they are not pickled.
+    """
+
+    def __init__(self, terms: Mapping[str, List[Dict[str, str]]], digest: str = '',
+                 max_distance: Optional[int] = None, real_words: Iterable[str] = ()):
+        self.terms = terms
+        self.digest = digest
+        self.real_words = frozenset(real_words)
+        max_distance = Config.CONDITION_SPELLING_MAX_DISTANCE if max_distance is None else max_distance
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # state -> [(term length in words, term)] for every term ending there
+        self._out: List[List[Tuple[int, str]]] = [[]]
+        self._build()
+        self.speller = SymSpell((word for term in terms for word in term.split(' ')), max_distance)
+
+    def _build(self):
+        for term in self.terms:
+            state = 0
+            term_words = term.split(' ')
+            for word in term_words:
+                next_state = self._goto[state].get(word)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][word] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = next_state
+            self._out[state].append((len(term_words), term))
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and word not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(word, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def find(self, tokens: Iterable[str]) -> List[Tuple[int, int, str]]:
+        """Return non-overlapping (start, end, term) matches, leftmost-longest first"""
+        matches = []
+        state = 0
+        for position, word in enumerate(tokens):
+            while state and word not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(word, 0)
+            for length, term in self._out[state]:
+                matches.append((position - length + 1, position + 1, term))
+
+        matches.sort(key=lambda match: (match[0], match[0] - match[1]))
+        selected = []
+        covered = 0
+        for start, end, term in matches:
+            if start >= covered:
+                selected.append((start, end, term))
+                covered = end
+        return selected
+
+    def match(self, tokens: Iterable[str]) -> List[Dict[str, str]]:
+        """Return the distinct codings of every term found in `tokens`"""
+        return self._codings(self.find(tokens))
+
+    def match_with_corrections(self, tokens: Iterable[str]) -> Tuple[List[Dict[str, str]], List[Dict[str, Any]]]:
+        """Like `match`, but misspelled words are corrected against the lexicon first"""
+        found, corrections = self.find_with_corrections(tokens)
+        return self._codings(found), corrections
+
+    def find_with_corrections(self, tokens: Iterable[str]) -> Tuple[List[Tuple[int, int, str]], List[Dict[str, Any]]]:
+        """Like `find`, but misspelled words are corrected against the lexicon first.
+
+        Only alphabetic words of MIN_CORRECTION_LENGTH or more that are not
+        lexicon words are corrected (within one edit up to five letters, two
+        beyond). Corrections are reported only when the corrected word ends
+        up inside a matched term. A real word ("stones", "cold") is kept as
+        typed for matching; its correction is reported with `applied` False,
+        as a suggestion only.
+        """
+        original = list(tokens)
+        tokens = list(original)
+        suggested = list(original)
+        corrected = {}
+        for position, token in enumerate(original):
+            if len(token) < MIN_CORRECTION_LENGTH or not token.isalpha() or token in self.speller:
+                continue
+            suggestion = self.speller.lookup(token, 1 if len(token) <= 5 else 2)
+            if suggestion:
+                corrected[position] = suggestion
+                suggested[position] = suggestion[0]
+                if token not in self.real_words:
+                    tokens[position] = suggestion[0]
+
+        found = self.find(tokens)
+        corrections = []
+        for matches, applied in ((found, True), (self.find(suggested) if corrected else [], False)):
+            for start, end, _ in matches:
+                for position in range(start, end):
+                    if position in corrected and (original[position] not in self.real_words) == applied:
+                        word, distance = corrected[position]
+                        corrections.append({'original': original[position], 'corrected': word,
+                                            'distance': distance, 'applied': applied})
+        return found, corrections
+
+    def _codings(self, found: List[Tuple[int, int, str]]) -> List[Dict[str, str]]:
+        codings = []
+        for _, _, term in found:
+            for coding in self.terms[term]:
+                if coding not in codings:
+                    codings.append(coding)
+        return codings
+
+    def __getstate__(self):
+        state = {key: value for key, value in self.__dict__.items() if key not in ('terms', 'real_words')}
+        return {'format': CACHE_FORMAT, **state}
+
+    def __setstate__(self, state):
+        if state.pop('format', None) != CACHE_FORMAT:
+            raise ValueError("Condition matcher cache was written by an incompatible version")
+        self.__dict__.update(state)
+        self.terms = None
+        self.real_words = frozenset()
+
+
+def read_word_list(path: str) -> Set[str]:
+    """Words of a one-word-per-line list, skipping blank lines and `#` comments"""
+    with open(path, encoding='utf-8') as f:
+        return {line.strip().lower() for line in f if line.strip() and not line.startswith('#')}
+
+
+def lexicon_digest(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def cache_path_for(path: str, digest: str, suffix: str, cache_dir: Optional[str] = None) -> str:
+    cache_dir = cache_dir or Config.CONDITION_MATCHER_CACHE_DIR
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f"{name}-{digest[:16]}{suffix}")
+
+
+def private_cache_dir(cache_dir: str) -> Optional[str]:
+    """`cache_dir`, created with mode 0700, if it is a directory owned by this user that nobody else can write.
+
+    The matcher is unpickled from it, so a directory someone else planted
+    or can write to is never used.
+    """
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        info = os.lstat(cache_dir)
+    except OSError as e:
+        logger.warning(f"Could not create condition matcher cache dir {cache_dir}: {e}")
+        return None
+    owned = not hasattr(os, 'getuid') or info.st_uid == os.getuid()
+    if not stat.S_ISDIR(info.st_mode) or not owned or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        logger.warning(f"Not using condition matcher cache dir {cache_dir}: "
+                       f"it must be a directory owned by this user and writable by no one else")
+        return None
+    return cache_dir
+
+
+def open_index(path: str, digest: str, cache_dir: Optional[str] = None) -> TerminologyIndex:
+    """Map `path` if it is a compiled index, otherwise compile the source once into the cache dir"""
+    if is_index(path):
+        return TerminologyIndex(path)
+
+    index_path = cache_path_for(path, digest, '.idx', cache_dir)
+    if not os.path.exists(index_path):
+        os.makedirs(os.path.dirname(index_path), mode=0o700, exist_ok=True)
+        terms, codings = build_index(read_source(path), index_path)
+        logger.info(f"Compiled terminology index {index_path} ({terms} terms, {codings} codings)")
+    return TerminologyIndex(index_path)
+
+
+def load_matcher(path: Optional[str] = None, cache_dir: Optional[str] = None) -> ConditionMatcher:
+    """Load the compiled matcher for a lexicon or index, compiling and caching it on a miss.
+
+    Cache files are named after the source's content digest, so editing the
+    lexicon invalidates them; an unreadable automaton cache is simply rebuilt.
+    Without a private cache dir (see private_cache_dir) the matcher is built
+    without reading or writing a cache.
+    """
+    path = path or Config.CONDITION_LEXICON
+    start = time.perf_counter()
+    digest = lexicon_digest(path)
+    cache_dir = private_cache_dir(cache_dir or Config.CONDITION_MATCHER_CACHE_DIR)
+    index = open_index(path, digest, cache_dir or tempfile.mkdtemp(prefix='fhir-nlp-'))
+    cache_path = cache_path_for(path, digest, '.pickle', cache_dir) if cache_dir else None
+
+    matcher = None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                matcher = pickle.load(f)
+            metrics.incr('condition_matcher_cache_hits')
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable condition matcher cache {cache_path}: {e}")
+
+    if matcher is None or matcher.digest != digest:
+        metrics.incr('condition_matcher_cache_misses')
+        matcher = ConditionMatcher(index, digest)
+        if cache_path:
+            try:
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(matcher, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, cache_path)
+            except OSError as e:
+                logger.warning(f"Could not cache condition matcher at {cache_path}: {e}")
+    matcher.terms = index
+    matcher.real_words = frozenset(read_word_list(Config.CONDITION_COMMON_WORDS))
+
+    load_time = (time.perf_counter() - start) * 1000
+    metrics.observe('condition_matcher_load_ms', load_time)
+    logger.info(f"Loaded condition lexicon {path} ({len(index)} terms) in {load_time:.1f}ms")
+    return matcher
+
+
+def get_matcher(path: Optional[str] = None) -> ConditionMatcher:
+    """Return the process-wide matcher for `path`, loading it on first use"""
+    path = path or Config.CONDITION_LEXICON
+    if path not in _matchers:
+        _matchers[path] = load_matcher(path)
+    return _matchers[path]
+
+
+def clear_matchers():
+    """Drop every cached matcher"""
+    _matchers.clear()
@@ -0,0 +1,119 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional, Set
+
+from app.config import Config
+from app.logger import logger
+from app.metrics import metrics
+
+EXECUTOR_MODES = ('inline', 'thread', 'process')
+
+# Per-process processor for the process pool, built by _init_worker
+_worker_processor = None
+
+
+class NLPQueueFull(Exception):
+    """Raised when the NLP stage already has its maximum number of pending jobs"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("NLP queue is full, retry later")
+        self.retry_after = retry_after
+
+
+def _init_worker(model_name: str, capabilities: Optional[Dict[str, Set[str]]]):
+    """Process pool initializer: load the spaCy model once per worker process"""
+    global _worker_processor
+    from app.nlp.fhir_nlp_service import FHIRQueryProcessor
+    from app.nlp.model_registry import load_model
+
+    _worker_processor = FHIRQueryProcessor(nlp=load_model(model_name))
+    _worker_processor.planner.capabilities = capabilities
+
+
+def _run_in_worker(method: str, submitted_at: float, *args, **kwargs):
+    """Run a processor method in a worker process, returning (result, queue wait seconds)"""
+    queue_wait = time.time() - submitted_at
+    return getattr(_worker_processor, method)(*args, **kwargs), queue_wait
+
+
+class NLPExecutor:
+    """Runs the CPU-bound NLP stage off the event loop.
+
+    Modes: `inline` (on the loop), `thread` (thread pool sharing the loaded
+    processor) or `process` (process pool, model preloaded per process).
+    At most `workers + max_queue` jobs may be pending; further submissions
+    raise NLPQueueFull so callers can shed load instead of queueing forever.
+    """
+
+    def __init__(self, processor, mode: Optional[str] = None, workers: Optional[int] = None,
+                 max_queue: Optional[int] = None):
+        self.processor = processor
+        self.mode = mode or Config.NLP_EXECUTOR_MODE
+        if self.mode not in EXECUTOR_MODES:
+            raise ValueError(f"Unknown NLP executor mode {self.mode!r}, expected one of {EXECUTOR_MODES}")
+        self.workers = workers or Config.NLP_WORKERS
+        self.max_queue = max_queue if max_queue is not None else Config.NLP_MAX_QUEUE
+        self.pending = 0
+        self._pool: Optional[Executor] = None
+
+        if self.mode == 'thread':
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='nlp')
+        elif self.mode == 'process':
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(Config.SPACY_MODEL, processor.planner.capabilities)
+            )
+        logger.info(f"NLP executor: mode={self.mode}, workers={self.workers}, max_queue={self.max_queue}")
+
+    async def _submit(self, method: str, *args, **kwargs):
+        if self.mode == 'inline':
+            return getattr(self.processor, method)(*args, **kwargs)
+
+        if self.pending >= self.workers + self.max_queue:
+            metrics.incr('nlp_queue_rejected')
+            raise NLPQueueFull(Config.NLP_RETRY_AFTER)
+
+        self.pending += 1
+        metrics.set_gauge('nlp_queue_depth', self.pending)
+        loop = asyncio.get_running_loop()
+        try:
+            if self.mode == 'process':
+                result, queue_wait = await loop.run_in_executor(
+                    self._pool, partial(_run_in_worker, method, time.time(), *args, **kwargs)
+                )
+            else:
+                submitted_at = time.perf_counter()
+                result, queue_wait = await loop.run_in_executor(
+                    self._pool, partial(self._run_in_thread, method, submitted_at, *args, **kwargs)
+                )
+            metrics.observe('nlp_queue_wait_ms', queue_wait * 1000)
+            return result
+        finally:
+            self.pending -= 1
+            metrics.set_gauge('nlp_queue_depth', self.pending)
+
+    def _run_in_thread(self, method: str, submitted_at: float, *args, **kwargs):
+        queue_wait = time.perf_counter() - submitted_at
+        return getattr(self.processor, method)(*args, **kwargs), queue_wait
+
+    async def build_fhir_query(self, text: str) -> Dict[str, Any]:
+        # Memoized plans are a dict lookup: answer them on the loop instead of queueing
+        cached = self.processor.cached_plan(text)
+        if cached is not None:
+            return cached
+        # Parse without a second lookup, so a miss is only counted once
+        fhir_query = await self._submit('parse_fhir_query', text)
+        self.processor.remember_plan(text, fhir_query)
+        return fhir_query
+
+    async def build_fhir_queries(self, texts: List[str], batch_size: Optional[int] = None,
+                                 n_process: Optional[int] = None) -> List[Dict[str, Any]]:
+        return await self._submit('build_fhir_queries', texts, batch_size=batch_size, n_process=n_process)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
@@ -1,40 +1,62 @@
 import re
+import copy
+import hashlib
 import json
-import requests
-from datetime import datetime
-from typing import Dict, List, Any, Optional
-import spacy
+import time
+from datetime import date
+from typing import Dict, List, Any, Optional, AsyncIterable
+import numpy as np
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+from app.config import Config
+from app.logger import logger
+from app.metrics import metrics
 from app.models.user import QueryLog
+from app.nlp.condition_matcher import ConditionMatcher, get_matcher, words
+from app.nlp.model_registry import load_model
+from app.nlp.query_planner import FilterPlanner, parse_capabilities, supports_batch
+from app.nlp.query_scanner import QueryScanner, age_filter
+from app.services.cohort import CohortQuery
+from app.services.fhir_client import FHIRClient
+from app.services.fhir_paging import SearchPager
+from app.services.memo_cache import MemoCache
+from app.services.cohort_aggregates import cohort_aggregates
+from app.services.cohort_frame import CohortFrame, CohortFrameBuilder
+from app.services.patient_resolver import PatientResolver
+from app.services.result_store import ResultSet
+
+# Words between two condition terms that make them alternatives, or exclude the next one
+OR_WORDS = {'or', 'either'}
+NEGATION_WORDS = {'without', 'not', 'no', 'excluding', 'except', 'exclude', 'minus', 'never'}
+# How many words before a term a negation may stand ("no history of asthma")
+NEGATION_WINDOW = 3
 
 
 class FHIRQueryProcessor:
-    def __init__(self, db: AsyncSession = None):
-        try:
-            self.nlp = spacy.load("en_core_web_sm")
-        except OSError:
-            raise Exception("Please install spaCy model: python -m spacy download en_core_web_sm")
+    """Stateless NLP-to-FHIR processor, safe to share across requests.
+
+    Pass a preloaded pipeline as `nlp` and a pooled `fhir_client` to reuse
+    the process-wide resources; per-request state (e.g. the DB session) is
+    passed to each call.
+    """
+
+    WARM_UP_QUERY = "Show me all diabetic patients over 50"
 
-        self.fhir_base_url = "https://hapi.fhir.org/baseR5"
+    def __init__(self, db: AsyncSession = None, nlp=None, fhir_client: Optional[FHIRClient] = None,
+                 condition_matcher: Optional[ConditionMatcher] = None):
+        self.nlp = nlp if nlp is not None else load_model()
+        self.fhir_client = fhir_client
+
+        self.fhir_base_url = Config.FHIR_BASE_URL
         self.db = db
+        self.planner = FilterPlanner()
+        self.plan_cache = MemoCache('plan_cache', Config.PLAN_CACHE_MAX_ENTRIES)
+        self.result_cache = MemoCache('result_cache', Config.RESULT_CACHE_MAX_ENTRIES, ttl=Config.RESULT_CACHE_TTL)
 
-        self.condition_mappings = {
-            'diabetes': [
-                {'system': 'http://snomed.info/sct', 'code': '73211009', 'display': 'Diabetes mellitus'},
-                {'system': 'http://hl7.org/fhir/sid/icd-10', 'code': 'E10-E14', 'display': 'Diabetes mellitus'}
-            ],
-            'diabetic': [
-                {'system': 'http://snomed.info/sct', 'code': '73211009', 'display': 'Diabetes mellitus'}
-            ],
-            'hypertension': [
-                {'system': 'http://snomed.info/sct', 'code': '38341003', 'display': 'Hypertensive disorder'}
-            ],
-            'asthma': [
-                {'system': 'http://snomed.info/sct', 'code': '195967001', 'display': 'Asthma'}
-            ]
-        }
+        # Phrase-level matcher compiled from the terminology lexicon; term -> codings
+        self.condition_matcher = condition_matcher if condition_matcher is not None else get_matcher()
+        self.condition_mappings = self.condition_matcher.terms
 
         self.age_patterns = [
             (r'over\s+(\d+)', 'gt'),
@@ -47,11 +69,52 @@ class FHIRQueryProcessor:
             (r'(\d+)\s+and under', 'le')
         ]
 
+        self.range_patterns = [
+            r'between\s+(\d+)\s+and\s+(\d+)',
+            r'(?:aged?|ages)\s+(\d+)\s*(?:-|to)\s*(\d+)'
+        ]
+
+        self.intent_keywords = {
+            'count_patients': ['count', 'how many'],
+            'search_patients': ['list', 'show', 'display', 'get']
+        }
+
+        # Age, range and intent patterns compiled into one single-pass scanner
+        self.scanner = QueryScanner(self.age_patterns, self.range_patterns, self.intent_keywords)
+
+        self.gender_patterns = [
+            (r'\b(?:female|females|women|woman|girls?)\b', 'female'),
+            (r'\b(?:male|males|men|man|boys?)\b', 'male')
+        ]
+
+    async def load_capabilities(self):
+        """Fetch the server's CapabilityStatement so the planner knows which filters it can push down
+        and the client knows whether searches can be combined into batch Bundles"""
+        try:
+            client = self.get_fhir_client()
+            statement = await client.get_json(f"{self.fhir_base_url}/metadata")
+            self.planner.capabilities = parse_capabilities(statement)
+            client.set_batch_support(self.fhir_base_url, supports_batch(statement))
+            # Plans memoized so far were made without knowing what the server supports
+            self.plan_cache.clear()
+        except Exception as e:
+            logger.warning(f"CapabilityStatement unavailable, assuming all search parameters are supported: {e}")
+
+    def warm_up(self) -> int:
+        """Run one query through the pipeline so the first request pays no lazy-init cost"""
+        start = time.perf_counter()
+        self.build_fhir_query(self.WARM_UP_QUERY)
+        warm_up_time = int((time.perf_counter() - start) * 1000)
+        metrics.observe('nlp_warm_up_ms', warm_up_time)
+        return warm_up_time
+
     async def log_query(self, user_id: str, natural_language_query: str,
                         fhir_query: str, fhir_response: Dict,
-                        processed_results: Dict, execution_time: int):
+                        processed_results: Dict, execution_time: int,
+                        db: Optional[AsyncSession] = None):
         """Log query to database"""
-        if self.db:
+        db = db or self.db
+        if db:
             query_log = QueryLog(
                 user_id=user_id,
                 natural_language_query=natural_language_query,
@@ -61,214 +124,448 @@ class FHIRQueryProcessor:
                 execution_time=execution_time,
                 patient_count=processed_results.get('total_patients', 0)
             )
-            self.db.add(query_log)
-            await self.db.commit()
+            db.add(query_log)
+            await db.commit()
 
     def extract_age_filters(self, text: str) -> List[Dict[str, Any]]:
         """Extract age-related filters from text"""
-        age_filters = []
-
-        for pattern, operator in self.age_patterns:
-            matches = re.finditer(pattern, text.lower())
-            for match in matches:
-                age_value = int(match.group(1))
-                birth_year = datetime.now().year - age_value
-                age_filters.append({
-                    'parameter': 'birthdate',
-                    'operator': operator,
-                    'value': age_value,
-                    'search_param': f'birthdate={operator}{birth_year}-01-01'
-                })
-
-        return age_filters
-
-    def extract_conditions(self, text: str) -> List[Dict[str, Any]]:
-        """Extract medical conditions from text"""
-        conditions = []
+        return self.scanner.scan(text)['age_filters']
 
-        try:
-            doc = self.nlp(text.lower())
+    def extract_gender(self, text: str) -> Optional[Dict[str, Any]]:
+        """Extract a gender filter from text"""
+        text_lower = text.lower()
+
+        for pattern, gender in self.gender_patterns:
+            if re.search(pattern, text_lower):
+                return self.gender_filter(gender)
+
+        return None
+
+    @staticmethod
+    def gender_filter(gender: str) -> Dict[str, Any]:
+        return {
+            'parameter': 'gender',
+            'value': gender,
+            'search_param': f'gender={gender}'
+        }
+
+    @staticmethod
+    def condition_filter(coding: Dict[str, str]) -> Dict[str, Any]:
+        return {**coding, 'search_param': f'code={coding["system"]}|{coding["code"]}'}
+
+    def extract_conditions(self, text: str, doc=None,
+                           corrections: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """Extract medical conditions from text, reusing `doc` if it was already parsed.
 
-            # Check if doc is iterable (handle mock objects in tests)
+        Misspelled condition words are corrected against the lexicon; pass a
+        list as `corrections` to collect what was corrected (or, for real
+        words, only suggested).
+        """
+        try:
+            if doc is None:
+                doc = self.nlp(text.lower())
+            # Mock docs in tests (or a failed parse) are not iterable; fall back to the raw text
             if hasattr(doc, '__iter__'):
-                for token in doc:
-                    if hasattr(token, 'text') and token.text in self.condition_mappings:
-                        for coding in self.condition_mappings[token.text]:
-                            conditions.append({
-                                'system': coding['system'],
-                                'code': coding['code'],
-                                'display': coding['display'],
-                                'search_param': f'code={coding["system"]}|{coding["code"]}'
-                            })
+                tokens = [word for token in doc if hasattr(token, 'text') for word in words(token.text)]
             else:
-                # Fallback: use simple string matching for tests or when spaCy fails
-                text_lower = text.lower()
-                for condition_key, codings in self.condition_mappings.items():
-                    if condition_key in text_lower:
-                        for coding in codings:
-                            conditions.append({
-                                'system': coding['system'],
-                                'code': coding['code'],
-                                'display': coding['display'],
-                                'search_param': f'code={coding["system"]}|{coding["code"]}'
-                            })
-
+                tokens = words(text)
         except Exception as e:
-            # Log the error and fall back to simple matching
-            print(f"Error in NLP processing: {e}")
-            # Use simple string matching as fallback
-            text_lower = text.lower()
-            for condition_key, codings in self.condition_mappings.items():
-                if condition_key in text_lower:
-                    for coding in codings:
-                        conditions.append({
-                            'system': coding['system'],
-                            'code': coding['code'],
-                            'display': coding['display'],
-                            'search_param': f'code={coding["system"]}|{coding["code"]}'
-                        })
-
+            logger.warning(f"Error in NLP processing, matching conditions on raw text: {e}")
+            tokens = words(text)
+
+        found, found_corrections = self.condition_matcher.find_with_corrections(tokens)
+        if found_corrections:
+            applied = sum(correction['applied'] for correction in found_corrections)
+            if applied:
+                metrics.incr('condition_spelling_corrections', applied)
+            if corrections is not None:
+                corrections.extend(found_corrections)
+
+        # The words between two terms decide how they combine: "or" joins the
+        # previous group, anything else starts a new ANDed group, and a
+        # negation ("without", "but not", ...) right before the term excludes
+        # the group; one ahead of an age ("not older than 50 with ...") does not
+        conditions = []
+        group, negated, previous_end = -1, False, 0
+        for start, end, term in found:
+            gap = tokens[previous_end:start]
+            if group < 0 or not set(gap) & OR_WORDS:
+                group += 1
+                window = gap[-NEGATION_WINDOW:]
+                numbers = [index for index, word in enumerate(window) if word.isdigit()]
+                if numbers:
+                    window = window[numbers[-1] + 1:]
+                negated = bool(set(window) & NEGATION_WORDS)
+            for coding in self.condition_matcher.terms[term]:
+                condition = {**self.condition_filter(coding), 'group': group, 'negated': negated}
+                if condition not in conditions:
+                    conditions.append(condition)
+            previous_end = end
         return conditions
 
+    @staticmethod
+    def cohort_groups(conditions: List[Dict[str, Any]]) -> Optional[Dict[str, List[List[str]]]]:
+        """AND/OR/NOT structure of the conditions, or None when they form a single ORed group.
+
+        Returns {'all_of': [codes, ...], 'none_of': [codes, ...]}: a patient
+        must have some code of every `all_of` group and no code of any
+        `none_of` group. Codes are sorted `system|code` tokens.
+        """
+        groups: Dict[int, Dict[str, Any]] = {}
+        for condition in conditions:
+            group = groups.setdefault(condition.get('group', 0), {'negated': condition.get('negated', False), 'codes': set()})
+            group['codes'].add(condition['search_param'].split('=', 1)[1])
+
+        if len(groups) < 2 and not any(group['negated'] for group in groups.values()):
+            return None
+        return {
+            'all_of': [list(codes) for codes in sorted({tuple(sorted(g['codes'])) for g in groups.values() if not g['negated']})],
+            'none_of': [list(codes) for codes in sorted({tuple(sorted(g['codes'])) for g in groups.values() if g['negated']})]
+        }
+
+    @staticmethod
+    def apply_corrections(text: str, corrections: List[Dict[str, Any]]) -> Optional[str]:
+        """Rewrite `text` with corrected words, for a "did you mean" prompt"""
+        if not corrections:
+            return None
+        for correction in corrections:
+            text = re.sub(rf"\b{re.escape(correction['original'])}\b", correction['corrected'], text, flags=re.IGNORECASE)
+        return text
+
     def extract_intent(self, text: str) -> str:
         """Extract the main intent from the query"""
-        text_lower = text.lower()
+        return self.scanner.scan(text)['intent']
 
-        if any(word in text_lower for word in ['count', 'how many']):
-            return 'count_patients'
-        elif any(word in text_lower for word in ['list', 'show', 'display', 'get']):
-            return 'search_patients'
-        else:
-            return 'search_patients'
+    def build_fhir_queries(self, texts: List[str], batch_size: Optional[int] = None,
+                           n_process: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Convert many natural language queries, parsing them together with nlp.pipe"""
+        results: List[Optional[Dict[str, Any]]] = [self.cached_plan(text) for text in texts]
+        misses = [i for i, result in enumerate(results) if result is None]
+        if not misses:
+            return results
 
-    def build_fhir_query(self, text: str) -> Dict[str, Any]:
+        try:
+            docs = list(self.nlp.pipe(
+                (texts[i].lower() for i in misses),
+                batch_size=batch_size or Config.NLP_BATCH_SIZE,
+                n_process=n_process or Config.NLP_N_PROCESS
+            ))
+        except Exception as e:
+            # Parse one at a time instead (e.g. pipeline without pipe support)
+            logger.warning(f"nlp.pipe failed, parsing queries individually: {e}")
+            docs = [None] * len(misses)
+
+        for i, doc in zip(misses, docs):
+            results[i] = self.parse_fhir_query(texts[i], doc=doc)
+            self.remember_plan(texts[i], results[i])
+        return results
+
+    @staticmethod
+    def normalize_query(text: str) -> str:
+        """Case, spacing and trailing punctuation never change the parse, so they never change the key"""
+        return ' '.join(text.lower().split()).rstrip('?.! ')
+
+    def _plan_key(self, text: str):
+        # Age filters are relative to today, so a plan is only reused on the day it was made
+        return self.normalize_query(text), date.today().isoformat()
+
+    def cached_plan(self, text: str) -> Optional[Dict[str, Any]]:
+        """Return the memoized query built from text that normalizes like `text`, if any"""
+        plan = self.plan_cache.get(self._plan_key(text))
+        if plan is None:
+            return None
+        plan = copy.deepcopy(plan)
+        plan['original_query'] = text
+        plan['did_you_mean'] = self.apply_corrections(text, plan['corrections'])
+        return plan
+
+    def remember_plan(self, text: str, fhir_query: Dict[str, Any]):
+        self.plan_cache.put(self._plan_key(text), copy.deepcopy(fhir_query))
+
+    def build_fhir_query(self, text: str, doc=None) -> Dict[str, Any]:
+        """Convert natural language to FHIR query, reusing the plan of an equivalent earlier query"""
+        fhir_query = self.cached_plan(text)
+        if fhir_query is None:
+            fhir_query = self.parse_fhir_query(text, doc=doc)
+            self.remember_plan(text, fhir_query)
+        return fhir_query
+
+    def parse_fhir_query(self, text: str, doc=None) -> Dict[str, Any]:
         """Convert natural language to FHIR query"""
-        intent = self.extract_intent(text)
-        age_filters = self.extract_age_filters(text)
-        conditions = self.extract_conditions(text)
+        # One scan yields intent and age filters against a single reference date
+        terms = self.scanner.scan(text)
+        intent = terms['intent']
+        age_filters = terms['age_filters']
+        corrections: List[Dict[str, Any]] = []
+        conditions = self.extract_conditions(text, doc=doc, corrections=corrections)
+        gender = self.extract_gender(text)
 
-        search_params = []
-        resource_type = "Condition"
+        cohort = self.cohort_groups(conditions)
+        positive = [condition for condition in conditions if not condition.get('negated')]
 
-        # Add condition filters
-        if conditions:
-            search_params.append(conditions[0]['search_param'])
+        return {
+            'original_query': text,
+            **self.plan_fhir_query(intent, positive, age_filters, gender, cohort),
+            'corrections': corrections,
+            'did_you_mean': self.apply_corrections(text, corrections)
+        }
+
+    def build_structured_query(self, intent: str, conditions: List[Dict[str, str]],
+                               age_filters: List[Dict[str, Any]], gender: Optional[str] = None) -> Dict[str, Any]:
+        """Build a query from explicit filters, with no NLP involved.
+
+        `conditions` are codings (system, code, optional display),
+        `age_filters` are {'operator': 'gt'|'ge'|'lt'|'le', 'value': years}
+        and `gender` is an administrative gender code.
+        """
+        today = date.today()
+        return {
+            'original_query': None,
+            **self.plan_fhir_query(
+                intent,
+                [self.condition_filter({**coding, 'display': coding.get('display') or coding['code']})
+                 for coding in conditions],
+                [age_filter(f['operator'], f['value'], today) for f in age_filters],
+                self.gender_filter(gender) if gender else None
+            ),
+            'corrections': [],
+            'did_you_mean': None
+        }
+
+    def plan_fhir_query(self, intent: str, conditions: List[Dict[str, Any]], age_filters: List[Dict[str, Any]],
+                        gender: Optional[Dict[str, Any]], cohort: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Plan the FHIR search for extracted (or explicitly given) filters.
+
+        `conditions` are the wanted (non-negated) conditions. With a `cohort`
+        (see cohort_groups) the search is executed as one sub-query per group
+        and `fhir_url` only describes the union of the wanted conditions.
+        """
+        # Demographic-only questions search Patient directly; anything with a
+        # condition searches Condition and chains demographics through subject
+        resource_type = "Condition" if conditions or not (age_filters or gender or cohort) else "Patient"
+
+        # Push every filter the server supports into the search
+        search_params = self.planner.plan(resource_type, conditions, age_filters, gender)
 
         # Include patient resources
-        search_params.append("_include=Condition:subject")
-        search_params.append("_include=Condition:patient")
+        included_types = []
+        if resource_type == "Condition":
+            search_params.append("_include=Condition:subject")
+            search_params.append("_include=Condition:patient")
+            included_types.append("Patient")
+
+        # Only ask for the elements the processor reads
+        search_params.extend(self.planner.projection_params(resource_type, included_types))
+
+        # Parameter order and repeats never change the search; sorting makes paraphrases produce one URL
+        search_params = sorted(set(search_params))
+        plan = self.canonical_plan(intent, resource_type, conditions, age_filters, gender, search_params)
+        plan['cohort'] = cohort
 
         # Construct FHIR URL
         query_string = "&".join(search_params)
         fhir_url = f"{self.fhir_base_url}/{resource_type}?{query_string}" if search_params else f"{self.fhir_base_url}/{resource_type}"
 
         return {
-            'original_query': text,
             'intent': intent,
             'fhir_url': fhir_url,
             'resource_type': resource_type,
             'filters': {
                 'age_filters': age_filters,
-                'conditions': conditions
+                'conditions': conditions,
+                'gender': gender
             },
+            'search_parameters': search_params,
+            'cohort': cohort,
+            'plan': plan,
+            'plan_hash': self.plan_hash(plan)
+        }
+
+    @staticmethod
+    def canonical_plan(intent: str, resource_type: str, conditions: List[Dict[str, Any]],
+                       age_filters: List[Dict[str, Any]], gender: Optional[Dict[str, Any]],
+                       search_params: List[str]) -> Dict[str, Any]:
+        """Order-free description of what a query asks for.
+
+        Codes are sorted and de-duplicated, and ages are expressed as the
+        birthdate bound they translate to, so "over 50" and "51 and over"
+        normalize alike.
+        """
+        return {
+            'intent': intent,
+            'resource_type': resource_type,
+            'codes': sorted({condition['search_param'].split('=', 1)[1] for condition in conditions}),
+            'birthdate': sorted({age_filter['search_param'] for age_filter in age_filters}),
+            'gender': gender['value'] if gender else None,
             'search_parameters': search_params
         }
 
+    @staticmethod
+    def plan_hash(plan: Dict[str, Any]) -> str:
+        """Stable hash of a canonical plan, used as the key of every cache layer above the FHIR client"""
+        encoded = json.dumps(plan, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()[:32]
+
+    def get_fhir_client(self) -> FHIRClient:
+        """Return the shared FHIR client, creating one on first use"""
+        if self.fhir_client is None:
+            self.fhir_client = FHIRClient()
+        return self.fhir_client
+
     async def execute_fhir_query(self, fhir_url: str) -> Dict[str, Any]:
         """Execute the FHIR query against the real FHIR server"""
-        try:
-            response = requests.get(fhir_url, headers={'Accept': 'application/fhir+json'})
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"FHIR server error: {str(e)}")
-
-    async def process_fhir_response(self, fhir_response: Dict[str, Any], query_filters: Dict) -> Dict[str, Any]:
-        """Process the actual FHIR response and extract patient data"""
-        patients = {}
-
-        if fhir_response.get('resourceType') == 'Bundle' and 'entry' in fhir_response:
-            for entry in fhir_response['entry']:
-                resource = entry.get('resource', {})
-                resource_type = resource.get('resourceType')
-
-                if resource_type == 'Condition':
-                    subject_ref = resource.get('subject', {}).get('reference', '')
-                    patient_id = subject_ref.replace('Patient/', '') if 'Patient/' in subject_ref else None
-
-                    if patient_id:
-                        code_text = "Unknown condition"
-                        coding = resource.get('code', {}).get('coding', [])
-                        if coding:
-                            code_text = coding[0].get('display', 'Unknown condition')
-
-                        if patient_id not in patients:
-                            patients[patient_id] = {
-                                'id': patient_id,
-                                'conditions': []
-                            }
-
-                        patients[patient_id]['conditions'].append(code_text)
-
-                elif resource_type == 'Patient':
-                    patient_id = resource.get('id')
-
-
-                    # Extract patient details
-                    name = "Unknown"
-                    names = resource.get('name', [])
-                    if names:
-                        given = names[0].get('given', [''])[0]
-                        family = names[0].get('family', '')
-                        name = f"{given} {family}".strip()
-
-                    birth_date = resource.get('birthDate', '')
-                    gender = resource.get('gender', 'unknown')
-
-                    # Calculate age from birthdate
-                    age = None
-                    if birth_date:
-                        try:
-                            birth_year = int(birth_date[:4])
-                            current_year = datetime.now().year
-                            age = current_year - birth_year
-                        except (ValueError, TypeError):
-                            age = None
-
-                    patient_data = {
-                        'id': patient_id,
-                        'name': name,
-                        'birthDate': birth_date,
-                        'age': age,
-                        'gender': gender,
-                        'conditions': patients.get(patient_id, {}).get('conditions', [])
-                    }
-
-                    if patient_id not in patients:
-                        patients[patient_id] = patient_data
-                    else:
-                        patients[patient_id].update(patient_data)
-
-
-        # Convert to list and filter by age if needed
-        patient_list = []
-        for patient in patients.values():
-            # Apply age filters if present
-            age_filters = query_filters.get('age_filters', [])
-            include_patient = True
-
-            for age_filter in age_filters:
-                if patient.get('age') is not None:
-                    if age_filter['operator'] == 'gt' and not (patient['age'] > age_filter['value']):
-                        include_patient = False
-                    elif age_filter['operator'] == 'lt' and not (patient['age'] < age_filter['value']):
-                        include_patient = False
-
-            if include_patient:
-                patient_list.append(patient)
+        return await self.get_fhir_client().get_json(fhir_url)
+
+    def search_pages(self, fhir_url: str, max_pages: Optional[int] = None,
+                     max_resources: Optional[int] = None, streaming: Optional[bool] = None) -> SearchPager:
+        """Page through every result of a FHIR search, within the given budget"""
+        return SearchPager(self.get_fhir_client(), fhir_url, max_pages=max_pages,
+                           max_resources=max_resources, streaming=streaming)
+
+    async def execute_query(self, fhir_query: Dict[str, Any], aggregates: bool = False,
+                            materialize: bool = True, paged: bool = False) -> Dict[str, Any]:
+        """Execute a built query and return the processed results.
+
+        With `aggregates`, the results carry cohort_aggregates of the
+        matched patients; without `materialize` they carry no patient rows.
+        `paged` results carry no rows either, but their result set has the
+        demographics its pages are built from.
+        Results are memoized by plan hash (and these options), so
+        paraphrases of a recent query are answered without touching the
+        FHIR server (see MemoCache on sharing them).
+        """
+        plan_hash = fhir_query.get('plan_hash')
+        cache_key = None
+        if plan_hash:
+            rows = '-paged' if paged else '' if materialize else '-rows'
+            cache_key = plan_hash + ('+aggregates' if aggregates else '') + rows
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        if fhir_query.get('cohort'):
+            # AND/NOT across condition groups: one sub-query per group, combined as id sets
+            results = await CohortQuery(self, fhir_query, aggregates=aggregates, materialize=materialize,
+                                        paged=paged).run()
+        elif fhir_query.get('intent') == 'count_patients':
+            # Count on the server instead of downloading the cohort
+            results = await self.count_patients(fhir_query, aggregates=aggregates)
+        else:
+            # Execute against real FHIR server, merging each page as it arrives
+            results = await self.process_fhir_pages(self.search_pages(fhir_query['fhir_url']), fhir_query['filters'],
+                                                    aggregates=aggregates, materialize=materialize and not paged)
+
+        if cache_key:
+            self.result_cache.put(cache_key, results)
+        return results
+
+    async def count_patients(self, fhir_query: Dict[str, Any], aggregates: bool = False) -> Dict[str, Any]:
+        """Count matching patients without downloading the cohort.
+
+        Uses a `_summary=count` Patient search when every filter can be
+        evaluated by the server (and no aggregates are wanted); otherwise
+        counts distinct patients over a streamed search.
+        """
+        filters = fhir_query['filters']
+        count_params = None
+        if not aggregates:
+            count_params = self.planner.plan_patient_count(
+                filters.get('conditions', []), filters.get('age_filters', []), filters.get('gender')
+            )
 
+        if count_params is not None:
+            count_url = f"{self.fhir_base_url}/Patient?{'&'.join(count_params)}"
+            bundle = await self.get_fhir_client().get_json(count_url)
+            if bundle.get('total') is not None:
+                metrics.incr('fhir_count_server')
+                return {
+                    'total_patients': bundle['total'],
+                    'patients': [],
+                    'count_method': 'server',
+                    'count_url': count_url
+                }
+
+        metrics.incr('fhir_count_streaming')
+        results = await self.process_fhir_pages(self.search_pages(fhir_query['fhir_url'], streaming=True), filters,
+                                                resolve_patients=aggregates or self.has_local_filters(filters),
+                                                aggregates=aggregates, materialize=False)
+        counted = {
+            'total_patients': results['total_patients'],
+            'patients': [],
+            'count_method': 'streaming',
+            'paging': results.get('paging')
+        }
+        if aggregates:
+            counted['aggregates'] = results['aggregates']
+        return counted
+
+    @staticmethod
+    def has_local_filters(query_filters: Dict) -> bool:
+        """Whether any demographic filter was left for CohortFrame.mask to evaluate"""
+        gender = query_filters.get('gender')
+        return (any(not f.get('pushed_down') for f in query_filters.get('age_filters', []))
+                or bool(gender and not gender.get('pushed_down')))
+
+    @staticmethod
+    def frame_results(frame: CohortFrame, rows: np.ndarray, aggregates: bool = False,
+                      materialize: bool = True) -> Dict[str, Any]:
+        """Results for the matched `rows` of a frame, building dicts only when rows are returned.
+
+        `result_set` keeps the rows for paging; it is dropped when shaping the response.
+        """
+        results = {
+            'total_patients': len(rows),
+            'patients': frame.to_dicts(rows) if materialize else [],
+            'result_set': ResultSet(frame, rows)
+        }
+        if aggregates:
+            results['aggregates'] = cohort_aggregates(frame, rows)
+        return results
+
+    async def process_fhir_response(self, fhir_response: Dict[str, Any], query_filters: Dict,
+                                    resolve_patients: bool = True) -> Dict[str, Any]:
+        """Process the actual FHIR response and extract patient data.
+
+        Patients the bundle only references are fetched by `_id` before
+        filtering, unless `resolve_patients` is False.
+        """
+        builder = CohortFrameBuilder()
+        builder.add_bundle(fhir_response)
+        if resolve_patients:
+            await PatientResolver(self).resolve(builder)
+
+        frame = builder.build()
         return {
-            'total_patients': len(patient_list),
-            'patients': patient_list,
+            **self.frame_results(frame, frame.filter(query_filters)),
             'raw_fhir_response': fhir_response
-        }
\ No newline at end of file
+        }
+
+    async def process_fhir_pages(self, pages: AsyncIterable[Dict[str, Any]], query_filters: Dict,
+                                 resolve_patients: bool = True, aggregates: bool = False,
+                                 materialize: bool = True) -> Dict[str, Any]:
+        """Process a paged search, merging each page as it arrives.
+
+        Pages are merged into a columnar frame and only the first page is
+        kept, so memory is bounded by the cohort rather than by the raw
+        pages. Subjects whose Patient was not included are fetched by `_id`
+        before filtering, unless `resolve_patients` is False. Without
+        `materialize` no patient rows are returned; `aggregates` adds
+        cohort_aggregates.
+        """
+        builder = CohortFrameBuilder()
+        first_page = None
+        async for page in pages:
+            if first_page is None:
+                first_page = page
+            builder.add_bundle(page)
+
+        if resolve_patients:
+            await PatientResolver(self).resolve(builder)
+        frame = builder.build()
+        results = {
+            **self.frame_results(frame, frame.filter(query_filters), aggregates=aggregates, materialize=materialize),
+            'raw_fhir_response': first_page or {}
+        }
+        if isinstance(pages, SearchPager):
+            results['paging'] = pages.stats()
+        return results
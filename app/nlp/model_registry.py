@@ -0,0 +1,42 @@
+import time
+from typing import Dict, Iterable, Optional
+import spacy
+
+from app.config import Config
+from app.logger import logger
+from app.metrics import metrics
+
+# The processor only reads token text, so the dependency parser, NER and
+# lemmatizer are dead weight on every call.
+DISABLED_COMPONENTS = ("parser", "ner", "lemmatizer")
+
+_models: Dict[str, "spacy.language.Language"] = {}
+
+
+def load_model(name: Optional[str] = None, disable: Iterable[str] = DISABLED_COMPONENTS):
+    """Load a slimmed spaCy pipeline and record how long it took"""
+    name = name or Config.SPACY_MODEL
+    start = time.perf_counter()
+    try:
+        nlp = spacy.load(name, disable=list(disable))
+    except OSError:
+        raise Exception(f"Please install spaCy model: python -m spacy download {name}")
+
+    load_time = (time.perf_counter() - start) * 1000
+    metrics.observe('nlp_model_load_ms', load_time)
+    metrics.set_gauge(f'nlp_model_load_ms.{name}', load_time)
+    logger.info(f"Loaded spaCy model {name} in {load_time:.1f}ms (disabled: {', '.join(disable)})")
+    return nlp
+
+
+def get_model(name: Optional[str] = None):
+    """Return the process-wide pipeline for `name`, loading it on first use"""
+    name = name or Config.SPACY_MODEL
+    if name not in _models:
+        _models[name] = load_model(name)
+    return _models[name]
+
+
+def clear_models():
+    """Drop every cached pipeline"""
+    _models.clear()
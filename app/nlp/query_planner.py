@@ -0,0 +1,158 @@
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from app.config import Config
+from app.services.fhir_stream import CONSUMED_FIELDS
+
+# Age comparison -> (birthdate prefix, extra year) such that
+# `age <op> N`  <=>  `birthdate <prefix> today - (N + extra) years`
+AGE_TO_BIRTHDATE = {
+    'gt': ('le', 1),
+    'ge': ('le', 0),
+    'lt': ('gt', 0),
+    'le': ('gt', 1),
+}
+
+# Chained parameters used when searching Conditions by patient demographics
+PATIENT_CHAIN = 'subject:Patient'
+
+
+def years_before(today: date, years: int) -> date:
+    """`today` shifted back by whole years (Feb 29 falls back to Feb 28)"""
+    try:
+        return today.replace(year=today.year - years)
+    except ValueError:
+        return today.replace(year=today.year - years, day=28)
+
+
+def birthdate_search_param(operator: str, age: int, today: Optional[date] = None) -> str:
+    """Translate an age comparison into a Patient `birthdate` search parameter"""
+    prefix, extra = AGE_TO_BIRTHDATE[operator]
+    bound = years_before(today or date.today(), age + extra)
+    return f'birthdate={prefix}{bound.isoformat()}'
+
+
+def parse_capabilities(statement: Dict[str, Any]) -> Dict[str, Set[str]]:
+    """Map resource type -> supported search parameter names from a CapabilityStatement"""
+    capabilities = {}
+    for rest in statement.get('rest', []) or []:
+        if rest.get('mode', 'server') != 'server':
+            continue
+        for resource in rest.get('resource', []) or []:
+            params = {param.get('name') for param in resource.get('searchParam', []) or []}
+            capabilities.setdefault(resource.get('type'), set()).update(params)
+    return capabilities
+
+
+def supports_batch(statement: Dict[str, Any]) -> bool:
+    """Whether a CapabilityStatement declares the system-level `batch` interaction"""
+    for rest in statement.get('rest', []) or []:
+        if rest.get('mode', 'server') != 'server':
+            continue
+        if any(interaction.get('code') == 'batch' for interaction in rest.get('interaction', []) or []):
+            return True
+    return False
+
+
+class FilterPlanner:
+    """Decide which extracted filters the FHIR server evaluates.
+
+    Every filter is translated to a search parameter; filters whose
+    parameters the server's CapabilityStatement does not list are marked
+    `pushed_down: False` so the processor applies them client-side instead.
+    Without a CapabilityStatement every parameter is assumed supported.
+    """
+
+    def __init__(self, capabilities: Optional[Dict[str, Set[str]]] = None, projection: Optional[str] = None):
+        self.capabilities = capabilities
+        self.projection = projection or Config.FHIR_PROJECTION
+
+    def supports(self, resource_type: str, param: str) -> bool:
+        # Servers rarely enumerate the common `_` parameters per resource
+        if self.capabilities is None or param.startswith('_'):
+            return True
+        return param in self.capabilities.get(resource_type, set())
+
+    def supports_patient_param(self, resource_type: str, param: str) -> bool:
+        """Whether `param` on Patient is reachable from `resource_type`"""
+        if resource_type == 'Patient':
+            return self.supports('Patient', param)
+        return self.supports(resource_type, 'subject') and self.supports('Patient', param)
+
+    def patient_param(self, resource_type: str, search_param: str) -> str:
+        """Qualify a Patient search parameter for the searched resource type"""
+        return search_param if resource_type == 'Patient' else f'{PATIENT_CHAIN}.{search_param}'
+
+    @staticmethod
+    def code_token(conditions: List[Dict[str, Any]]) -> str:
+        """ORed, de-duplicated and sorted `system|code` list for a token search"""
+        return ','.join(sorted({condition['search_param'].split('=', 1)[1] for condition in conditions}))
+
+    def plan(self, resource_type: str, conditions: List[Dict[str, Any]],
+             age_filters: List[Dict[str, Any]], gender: Optional[Dict[str, Any]] = None) -> List[str]:
+        """Return the search parameters for every filter the server can evaluate"""
+        search_params = []
+
+        # Codes are ORed into a single comma-separated token parameter
+        if conditions:
+            search_params.append(f"code={self.code_token(conditions)}")
+
+        for age_filter in age_filters:
+            age_filter['pushed_down'] = self.supports_patient_param(resource_type, 'birthdate')
+            if age_filter['pushed_down']:
+                search_params.append(self.patient_param(resource_type, age_filter['search_param']))
+
+        if gender:
+            gender['pushed_down'] = self.supports_patient_param(resource_type, 'gender')
+            if gender['pushed_down']:
+                search_params.append(self.patient_param(resource_type, gender['search_param']))
+
+        return search_params
+
+    @staticmethod
+    def elements_for(resource_types: Iterable[str]) -> List[str]:
+        """Elements the processor consumes from any of `resource_types`.
+
+        Derived from CONSUMED_FIELDS, so new fields read by the processor are
+        requested automatically. `id` is mandatory and always returned.
+        """
+        elements = set()
+        for resource_type in resource_types:
+            elements.update(CONSUMED_FIELDS.get(resource_type, ()))
+        elements.discard('id')
+        return sorted(elements)
+
+    def projection_params(self, resource_type: str, included_types: Iterable[str] = ()) -> List[str]:
+        """Parameters that trim returned resources to what the processor reads.
+
+        `_elements` is listed unqualified and covers the included resource
+        types too, since servers apply it to `_include`d resources as well.
+        `_summary=data` (drops narrative) is for servers without `_elements`
+        support (FHIR_PROJECTION=summary); the two are never combined.
+        """
+        if self.projection == 'elements':
+            return [f"_elements={','.join(self.elements_for([resource_type, *included_types]))}"]
+        if self.projection == 'summary':
+            return ['_summary=data']
+        return []
+
+    def plan_patient_count(self, conditions: List[Dict[str, Any]], age_filters: List[Dict[str, Any]],
+                           gender: Optional[Dict[str, Any]] = None) -> Optional[List[str]]:
+        """Search parameters that count distinct matching Patients on the server.
+
+        Conditions are reverse-chained with `_has` so each patient is counted
+        once. Returns None if any filter cannot be evaluated server-side.
+        """
+        if age_filters and not self.supports('Patient', 'birthdate'):
+            return None
+        if gender and not self.supports('Patient', 'gender'):
+            return None
+
+        search_params = []
+        if conditions:
+            search_params.append(f"_has:Condition:subject:code={self.code_token(conditions)}")
+        search_params.extend(age_filter['search_param'] for age_filter in age_filters)
+        if gender:
+            search_params.append(gender['search_param'])
+        search_params.append('_summary=count')
+        return search_params
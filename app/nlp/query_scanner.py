@@ -0,0 +1,71 @@
+import re
+from datetime import date
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.nlp.query_planner import birthdate_search_param
+
+NUMBER = r'(\d+)'
+
+
+def age_filter(operator: str, age_value: int, today: Optional[date] = None) -> Dict[str, Any]:
+    """The filter dict for `age <operator> age_value`"""
+    return {
+        'parameter': 'birthdate',
+        'operator': operator,
+        'value': age_value,
+        'search_param': birthdate_search_param(operator, age_value, today or date.today())
+    }
+
+
+class QueryScanner:
+    """Finds age comparisons, age ranges and intent keywords in one regex pass.
+
+    Every source pattern becomes one branch of a single compiled alternation,
+    with a named group that maps the match back to its operator (or intent),
+    so the text is scanned once however many patterns there are.
+    """
+
+    def __init__(self, age_patterns: Sequence[Tuple[str, str]], range_patterns: Sequence[str],
+                 intent_keywords: Dict[str, Sequence[str]], default_intent: str = 'search_patients'):
+        self.default_intent = default_intent
+        # group name -> ('age', operator) | ('range', None) | ('intent', intent)
+        self._groups: Dict[str, Tuple[str, Optional[str]]] = {}
+        branches = []
+
+        for i, (pattern, operator) in enumerate(age_patterns):
+            name = f'age{i}'
+            branches.append(pattern.replace(NUMBER, f'(?P<{name}>\\d+)', 1))
+            self._groups[name] = ('age', operator)
+
+        for i, pattern in enumerate(range_patterns):
+            low, high = f'low{i}', f'high{i}'
+            branches.append(pattern.replace(NUMBER, f'(?P<{low}>\\d+)', 1).replace(NUMBER, f'(?P<{high}>\\d+)', 1))
+            # The upper bound closes last, so it is the match's lastgroup
+            self._groups[high] = ('range', low)
+
+        # Intents listed first take precedence when several are present
+        self._intent_rank = {intent: rank for rank, intent in enumerate(intent_keywords)}
+        for intent, words in intent_keywords.items():
+            name = f'intent{len(self._groups)}'
+            branches.append(f"(?P<{name}>\\b(?:{'|'.join(re.escape(word) for word in words)})\\b)")
+            self._groups[name] = ('intent', intent)
+
+        self.pattern = re.compile('|'.join(f'(?:{branch})' for branch in branches))
+
+    def scan(self, text: str, today: Optional[date] = None) -> Dict[str, Any]:
+        """Return the intent and age filters found in `text`"""
+        today = today or date.today()
+        age_filters: List[Dict[str, Any]] = []
+        intent = None
+
+        for match in self.pattern.finditer(text.lower()):
+            kind, payload = self._groups[match.lastgroup]
+            if kind == 'age':
+                age_filters.append(age_filter(payload, int(match.group(match.lastgroup)), today))
+            elif kind == 'range':
+                age_filters.append(age_filter('ge', int(match.group(payload)), today))
+                age_filters.append(age_filter('le', int(match.group(match.lastgroup)), today))
+            elif intent is None or self._intent_rank[payload] < self._intent_rank[intent]:
+                intent = payload
+
+        return {'intent': intent or self.default_intent, 'age_filters': age_filters}
@@ -0,0 +1,74 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance (adjacent transpositions count once), capped at limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous_previous: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous_previous, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+def deletes(word: str, distance: int) -> Set[str]:
+    """Every string reachable from `word` by removing up to `distance` characters"""
+    found = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {candidate[:i] + candidate[i + 1:] for candidate in frontier for i in range(len(candidate))}
+        found |= frontier
+    return found
+
+
+class SymSpell:
+    """Symmetric-delete spelling correction over a fixed vocabulary.
+
+    Every vocabulary word is indexed under the strings left after deleting
+    up to `max_distance` characters from its first `prefix_length`
+    characters. A lookup generates the same deletes for the input (a
+    bounded number for bounded input length) and verifies only the words
+    sharing one, so its cost does not grow with the vocabulary.
+    """
+
+    def __init__(self, vocabulary: Iterable[str], max_distance: int = 2, prefix_length: int = 7):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.counts = Counter(vocabulary)
+        self._deletes: Dict[str, List[str]] = {}
+        for word in self.counts:
+            for variant in deletes(word[:prefix_length], max_distance):
+                self._deletes.setdefault(variant, []).append(word)
+
+    def __contains__(self, word: str) -> bool:
+        return word in self.counts
+
+    def lookup(self, word: str, max_distance: Optional[int] = None) -> Optional[Tuple[str, int]]:
+        """Return (closest word, distance), preferring the more frequent word on ties, or None"""
+        if word in self.counts:
+            return word, 0
+        limit = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+
+        best = None
+        seen = set()
+        for variant in deletes(word[:self.prefix_length], limit):
+            for candidate in self._deletes.get(variant, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = edit_distance(word, candidate, limit)
+                if distance <= limit:
+                    rank = (distance, -self.counts[candidate], candidate)
+                    if best is None or rank < best:
+                        best = rank
+        return (best[2], best[0]) if best else None
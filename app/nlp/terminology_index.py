@@ -0,0 +1,243 @@
+"""Compact read-only terminology index shared by worker processes.
+
+Layout (little-endian, all offsets relative to the string blob):
+
+    header   magic "FTIX", u16 version, u16 reserved, u32 terms, u32 codings, u32 blob size
+    terms    per term, sorted by UTF-8 bytes: u32 offset, u32 length, u32 first coding, u32 coding count
+    codings  per coding: u32 offset/length pairs for system, code and display
+    blob     every distinct string, concatenated once
+
+The file is memory-mapped read-only, so every worker process shares the
+same page-cache copy instead of holding its own dicts of codings.
+
+Build one from a code system export:
+
+    python -m app.nlp.terminology_index snomed.csv icd10.ndjson -o conditions.idx
+"""
+import argparse
+import csv
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+MAGIC = b'FTIX'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIII')
+TERM = struct.Struct('<4I')
+CODING = struct.Struct('<6I')
+
+Coding = Tuple[str, str, str]
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def normalize_term(term: str) -> str:
+    return ' '.join(words(term))
+
+
+def words(text: str) -> List[str]:
+    """Normalize text (or a single token) to the lowercase words the lexicon is keyed on"""
+    return WORD_PATTERN.findall(text.lower())
+
+
+def read_lexicon(path: str) -> Dict[str, List[Dict[str, str]]]:
+    """Read a tab-separated `term, system, code, display` lexicon into term -> codings.
+
+    Blank lines and lines starting with '#' are skipped; a term listed on
+    several lines maps to every coding it was listed with.
+    """
+    terms: Dict[str, List[Dict[str, str]]] = {}
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.rstrip('\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len(fields) != 4:
+                raise ValueError(f"{path}:{line_number}: expected 4 tab-separated fields, got {len(fields)}")
+            term, system, code, display = (field.strip() for field in fields)
+            key = normalize_term(term)
+            if not key:
+                continue
+            coding = {'system': system, 'code': code, 'display': display}
+            if coding not in terms.setdefault(key, []):
+                terms[key].append(coding)
+    return terms
+
+
+def is_index(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _synonyms(value) -> List[str]:
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [synonym for synonym in value.split('|') if synonym.strip()]
+    return [item['value'] if isinstance(item, dict) else item for item in value]
+
+
+def _record_terms(record: Dict, default_system: Optional[str]) -> Iterator[Tuple[str, Coding]]:
+    """Yield (term, coding) for a code system row: its display, term and synonyms all name the concept"""
+    system = record.get('system') or default_system
+    code, display = record.get('code'), record.get('display')
+    if not system or not code or not display:
+        raise ValueError(f"Row needs system, code and display: {record}")
+    names = [display, record.get('term')]
+    names += _synonyms(record.get('synonyms')) + _synonyms(record.get('designation'))
+    for name in names:
+        if name:
+            yield name, (system, str(code), display)
+
+
+def read_source(path: str, default_system: Optional[str] = None) -> Iterator[Tuple[str, Coding]]:
+    """Yield (term, coding) pairs from a .tsv lexicon, a CSV export or an NDJSON export"""
+    if path.endswith('.tsv'):
+        for term, codings in read_lexicon(path).items():
+            for coding in codings:
+                yield term, (coding['system'], coding['code'], coding['display'])
+    elif path.endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as f:
+            for record in csv.DictReader(f):
+                yield from _record_terms(record, default_system)
+    elif path.endswith(('.ndjson', '.jsonl')):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield from _record_terms(json.loads(line), default_system)
+    else:
+        raise ValueError(f"Unsupported terminology source {path!r}, expected .tsv, .csv or .ndjson")
+
+
+def build_index(pairs: Iterable[Tuple[str, Coding]], out_path: str) -> Tuple[int, int]:
+    """Write an index for (term, coding) pairs, returning (terms, codings) written.
+
+    Codings keep their source order per term and duplicates are dropped.
+    The file is written next to `out_path` and renamed into place, so
+    readers never map a half-written index.
+    """
+    by_term: Dict[bytes, List[Coding]] = {}
+    for term, coding in pairs:
+        key = normalize_term(term).encode('utf-8')
+        if key and coding not in by_term.setdefault(key, []):
+            by_term[key].append(coding)
+
+    blob = bytearray()
+    string_offsets: Dict[bytes, int] = {}
+
+    def intern(value: bytes) -> Tuple[int, int]:
+        if value not in string_offsets:
+            string_offsets[value] = len(blob)
+            blob.extend(value)
+        return string_offsets[value], len(value)
+
+    term_rows, coding_rows = [], []
+    for key in sorted(by_term):
+        codings = by_term[key]
+        term_rows.append(TERM.pack(*intern(key), len(coding_rows), len(codings)))
+        for system, code, display in codings:
+            coding_rows.append(CODING.pack(*intern(system.encode('utf-8')), *intern(code.encode('utf-8')),
+                                           *intern(display.encode('utf-8'))))
+
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(term_rows), len(coding_rows), len(blob)))
+        f.writelines(term_rows)
+        f.writelines(coding_rows)
+        f.write(blob)
+    os.replace(tmp_path, out_path)
+    return len(term_rows), len(coding_rows)
+
+
+class TerminologyIndex(Mapping):
+    """Read-only term -> codings mapping over a memory-mapped index file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self._n_terms, self._n_codings, _ = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f"{path} is not a version {VERSION} terminology index")
+        self._terms_at = HEADER.size
+        self._codings_at = self._terms_at + self._n_terms * TERM.size
+        self._blob_at = self._codings_at + self._n_codings * CODING.size
+
+    def _string(self, offset: int, length: int) -> bytes:
+        start = self._blob_at + offset
+        return self._mm[start:start + length]
+
+    def _term(self, i: int) -> Tuple[bytes, int, int]:
+        offset, length, first, count = TERM.unpack_from(self._mm, self._terms_at + i * TERM.size)
+        return self._string(offset, length), first, count
+
+    def _find(self, term: str) -> Optional[Tuple[int, int]]:
+        key = term.encode('utf-8')
+        low, high = 0, self._n_terms
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._n_terms:
+            found, first, count = self._term(low)
+            if found == key:
+                return first, count
+        return None
+
+    def __getitem__(self, term: str) -> List[Dict[str, str]]:
+        found = self._find(term) if isinstance(term, str) else None
+        if found is None:
+            raise KeyError(term)
+        first, count = found
+        codings = []
+        for i in range(first, first + count):
+            fields = CODING.unpack_from(self._mm, self._codings_at + i * CODING.size)
+            system, code, display = (self._string(fields[j], fields[j + 1]).decode('utf-8') for j in (0, 2, 4))
+            codings.append({'system': system, 'code': code, 'display': display})
+        return codings
+
+    def __contains__(self, term) -> bool:
+        return isinstance(term, str) and self._find(term) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self._n_terms):
+            yield self._term(i)[0].decode('utf-8')
+
+    def __len__(self) -> int:
+        return self._n_terms
+
+    def close(self):
+        self._mm.close()
+
+    def __getstate__(self):
+        # Pickles (e.g. for a process pool) carry the path and re-map on the other side
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Compile a terminology index from code system exports")
+    parser.add_argument('sources', nargs='+', help=".tsv lexicon, or .csv/.ndjson with code, display, "
+                                                   "system and optional term/synonyms/designation")
+    parser.add_argument('-o', '--output', required=True, help="index file to write")
+    parser.add_argument('--system', help="code system URL for rows that do not carry one")
+    args = parser.parse_args(argv)
+
+    pairs = (pair for source in args.sources for pair in read_source(source, args.system))
+    terms, codings = build_index(pairs, args.output)
+    print(f"Wrote {args.output}: {terms} terms, {codings} codings, {os.path.getsize(args.output):,} bytes")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,11 +1,23 @@
 import re
+import time
+import asyncio
 from datetime import datetime
-from typing import List, Annotated
+from typing import List, Annotated, Optional
 from app.logger import logger
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Query
+from fastapi.responses import StreamingResponse
 from app.database.db_engine import get_session
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.nlp.fhir_nlp_service import FHIRQueryProcessor
+from app.dependencies import get_fhir_processor, get_nlp_executor, get_result_store
+from app.nlp.executor import NLPExecutor, NLPQueueFull
+from app.metrics import metrics
+from app.config import Config
+from app.schemas.query import BatchQueryRequest, StructuredQueryRequest
+from app.services.response_shaping import ResponseShape, ResponseShapeError, json_response
+from app.services.query_stream import QueryStream, stream_media_type
+from app.services.cohort_aggregates import cohort_aggregates
+from app.services.result_store import InvalidCursor, ResultSet, ResultStore
 
 main = APIRouter()
 
@@ -18,46 +30,246 @@ async def root():
     
 """
 
+def nlp_busy(e: NLPQueueFull) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+def response_shape(
+        fields: Optional[str] = Query(None, description="Patient attributes to return, plus `aggregates`"),
+        aggregates: bool = Query(False),
+        include_raw: bool = Query(False, description="Echo the upstream FHIR Bundle"),
+        encoding: str = Query('objects', description="`objects`, or `compact` column/row arrays"),
+) -> ResponseShape:
+    """Response shaping options shared by the query routes.
+
+    `fields=aggregates` returns the cohort aggregates without patient rows.
+    """
+    try:
+        return ResponseShape.parse(fields, aggregates, include_raw, encoding)
+    except ResponseShapeError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+def page_limit(limit: int = Query(Config.QUERY_PAGE_SIZE, ge=1, le=Config.QUERY_PAGE_MAX_SIZE)) -> int:
+    return limit
+
+def first_page(processed_results: dict, store: ResultStore, shape: ResponseShape, limit: int) -> dict:
+    """Replace the patient rows by their first page and a handle to fetch the rest"""
+    result_set = processed_results.get('result_set')
+    if result_set is None or not shape.materialize:
+        return processed_results
+    patients, next_cursor = result_set.page(limit=limit)
+    return {**processed_results, 'patients': patients, 'handle': store.put(result_set), 'next_cursor': next_cursor}
+
 @main.post("/query")
 async def process_query(
         query_data: dict,
+        shape: ResponseShape = Depends(response_shape),
+        limit: int = Depends(page_limit),
         db: AsyncSession = Depends(get_session),
+        processor: FHIRQueryProcessor = Depends(get_fhir_processor),
+        nlp_executor: NLPExecutor = Depends(get_nlp_executor),
+        result_store: ResultStore = Depends(get_result_store),
 ):
     from datetime import datetime
     start_time = datetime.now()
 
     try:
-        # Initialize processor with database session
-        processor = FHIRQueryProcessor(db)
+        # Build FHIR query off the event loop
+        fhir_query = await nlp_executor.build_fhir_query(query_data['query'])
 
-        # Build FHIR query
-        fhir_query = processor.build_fhir_query(query_data['query'])
-
-        # Execute against real FHIR server
-        fhir_response = await processor.execute_fhir_query(fhir_query['fhir_url'])
-
-        # Process the response
-        processed_results = await processor.process_fhir_response(fhir_response, fhir_query['filters'])
+        # Execute against real FHIR server; rows are materialized a page at a time
+        processed_results = await processor.execute_query(fhir_query, **shape.execute_options(paged=True))
+        processed_results = first_page(processed_results, result_store, shape, limit)
 
         execution_time = int((datetime.now() - start_time).total_seconds() * 1000)
 
         # # Log the query
         logger.info(f'natural_language_query={query_data["query"]}, '
                     f"fhir_query={fhir_query['fhir_url']}, "
-                    f"fhir_response={fhir_response}, "
-                    f"processed_results={processed_results}, "
+                    f"paging={processed_results.get('paging')}, "
+                    f"total_patients={processed_results['total_patients']}, "
                     f"execution_time={execution_time}"
                     )
 
-        return {
+        return json_response({
             "original_query": query_data['query'],
+            "did_you_mean": fhir_query.get('did_you_mean'),
             "fhir_query": fhir_query,
-            "processed_results": processed_results,
+            "processed_results": shape.apply(processed_results),
             "execution_time": execution_time,
-        }
+        })
+    except NLPQueueFull as e:
+        raise nlp_busy(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def stored_result_set(handle: str, store: ResultStore) -> ResultSet:
+    result_set = store.get(handle)
+    if result_set is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown or expired result handle")
+    return result_set
+
+@main.get("/query/{handle}/results")
+async def query_results_page(
+        handle: str,
+        cursor: Optional[str] = Query(None, description="`next_cursor` of the previous page"),
+        shape: ResponseShape = Depends(response_shape),
+        limit: int = Depends(page_limit),
+        result_store: ResultStore = Depends(get_result_store),
+):
+    """A page of a /query result set, served from memory without re-running the search"""
+    result_set = stored_result_set(handle, result_store)
+    try:
+        patients, next_cursor = result_set.page(cursor, limit)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    return json_response(shape.apply({
+        'handle': handle,
+        'total_patients': len(result_set),
+        'patients': patients,
+        'next_cursor': next_cursor,
+    }))
+
+@main.get("/query/{handle}/aggregates")
+async def query_aggregates(handle: str, result_store: ResultStore = Depends(get_result_store)):
+    """cohort_aggregates of a whole /query result set, without re-running the search"""
+    result_set = stored_result_set(handle, result_store)
+    return json_response({
+        'handle': handle,
+        'total_patients': len(result_set),
+        'aggregates': cohort_aggregates(result_set.frame, result_set.rows),
+    })
+
+@main.post("/query/stream")
+async def stream_query(
+        query_data: dict,
+        request: Request,
+        fields: Optional[str] = Query(None, description="Patient attributes to stream"),
+        processor: FHIRQueryProcessor = Depends(get_fhir_processor),
+        nlp_executor: NLPExecutor = Depends(get_nlp_executor),
+):
+    """/query as a stream of events, patients sent as each upstream page is processed.
+
+    NDJSON by default, Server-Sent Events for `Accept: text/event-stream`.
+    """
+    start = time.perf_counter()
+    try:
+        shape = ResponseShape.parse(fields)
+    except ResponseShapeError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    if shape.aggregates:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="aggregates are not streamed, use POST /query")
+    if 'query' not in query_data:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="query is required")
+
+    try:
+        fhir_query = await nlp_executor.build_fhir_query(query_data['query'])
+    except NLPQueueFull as e:
+        raise nlp_busy(e)
+
+    stream = QueryStream(processor, fhir_query, shape, header={
+        "original_query": query_data['query'],
+        "did_you_mean": fhir_query.get('did_you_mean'),
+        "parse_ms": int((time.perf_counter() - start) * 1000),
+    }, started=start, is_disconnected=request.is_disconnected)
+    media_type = stream_media_type(request.headers.get('accept'))
+    # No proxy buffering, so every page reaches the client as it is sent
+    return StreamingResponse(stream.encode(media_type), media_type=media_type,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@main.post("/query/structured")
+async def process_structured_query(
+        query: StructuredQueryRequest,
+        shape: ResponseShape = Depends(response_shape),
+        processor: FHIRQueryProcessor = Depends(get_fhir_processor),
+):
+    start = time.perf_counter()
+
+    # No NLP: the filters go straight to planning, sharing the plan-hash and upstream caches
+    fhir_query = processor.build_structured_query(
+        query.intent,
+        [condition.model_dump() for condition in query.conditions],
+        [age_filter.model_dump() for age_filter in query.age_filters],
+        query.gender
+    )
+
+    try:
+        processed_results = await processor.execute_query(fhir_query, **shape.execute_options())
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    execution_time = int((time.perf_counter() - start) * 1000)
+    logger.info(f"structured_query={fhir_query['fhir_url']}, "
+                f"total_patients={processed_results.get('total_patients')}, "
+                f"execution_time={execution_time}")
+
+    return json_response({
+        "fhir_query": fhir_query,
+        "processed_results": shape.apply(processed_results),
+        "execution_time": execution_time,
+    })
+
+@main.post("/query/batch")
+async def process_query_batch(
+        batch: BatchQueryRequest,
+        shape: ResponseShape = Depends(response_shape),
+        processor: FHIRQueryProcessor = Depends(get_fhir_processor),
+        nlp_executor: NLPExecutor = Depends(get_nlp_executor),
+):
+    start = time.perf_counter()
+
+    # Parse every query in one nlp.pipe pass, off the event loop
+    try:
+        fhir_queries = await nlp_executor.build_fhir_queries(
+            batch.queries, batch_size=batch.batch_size, n_process=batch.n_process
+        )
+    except NLPQueueFull as e:
+        raise nlp_busy(e)
+    parse_time = time.perf_counter()
+
+    # Queries with the same canonical plan share one execution
+    keys = [fhir_query['plan_hash'] for fhir_query in fhir_queries]
+    distinct = {}
+    for key, fhir_query in zip(keys, fhir_queries):
+        distinct.setdefault(key, fhir_query)
+
+    slots = asyncio.Semaphore(Config.BATCH_QUERY_CONCURRENCY)
+
+    async def run(fhir_query):
+        async with slots:
+            try:
+                return await processor.execute_query(fhir_query, **shape.execute_options())
+            except Exception as e:
+                return {'error': str(e)}
+
+    outcomes = dict(zip(distinct, await asyncio.gather(*(run(q) for q in distinct.values()))))
+    end = time.perf_counter()
+
+    results = []
+    for text, fhir_query, key in zip(batch.queries, fhir_queries, keys):
+        outcome = outcomes[key]
+        result = {"original_query": text, "fhir_query": fhir_query}
+        if 'error' in outcome:
+            result["error"] = outcome['error']
+        else:
+            result["processed_results"] = shape.apply(outcome)
+        results.append(result)
+
+    return json_response({
+        "results": results,
+        "distinct_searches": len(distinct),
+        "timing": {
+            "parse_ms": int((parse_time - start) * 1000),
+            "execute_ms": int((end - parse_time) * 1000),
+            "total_ms": int((end - start) * 1000)
+        }
+    })
+
 @main.get("/suggestions")
 async def get_suggestions():
     return {
@@ -70,6 +282,10 @@ async def get_suggestions():
         ]
     }
 
+@main.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
+
 @main.get("/health")
 async def health_check(db: AsyncSession = Depends(get_session)):
     from app.database.db_engine import test_db_connection
@@ -0,0 +1,28 @@
+from pydantic import BaseModel, Field, constr
+from typing import List, Literal, Optional
+from app.config import Config
+
+
+class BatchQueryRequest(BaseModel):
+    queries: List[constr(min_length=1)] = Field(min_length=1, max_length=Config.BATCH_MAX_QUERIES)
+    batch_size: Optional[int] = Field(default=None, ge=1)
+    n_process: Optional[int] = Field(default=None, ge=1, le=Config.NLP_MAX_N_PROCESS)
+
+
+class StructuredCondition(BaseModel):
+    system: constr(min_length=1)
+    code: constr(min_length=1)
+    display: Optional[str] = None
+
+
+class StructuredAgeFilter(BaseModel):
+    operator: Literal['gt', 'ge', 'lt', 'le']
+    value: int = Field(ge=0, le=150)
+
+
+class StructuredQueryRequest(BaseModel):
+    """The filters `build_fhir_query` would extract, given explicitly"""
+    intent: Literal['search_patients', 'count_patients'] = 'search_patients'
+    conditions: List[StructuredCondition] = Field(default_factory=list)
+    age_filters: List[StructuredAgeFilter] = Field(default_factory=list)
+    gender: Optional[Literal['male', 'female', 'other', 'unknown']] = None
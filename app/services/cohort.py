@@ -0,0 +1,204 @@
+import asyncio
+import math
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.config import Config
+from app.metrics import metrics
+from app.services.cohort_frame import CohortFrameBuilder
+from app.services.patient_resolver import PatientResolver
+
+EMPTY = np.empty(0, dtype=np.int64)
+
+
+def page_patient_ids(page: Dict[str, Any]) -> List[str]:
+    """Patient ids a searchset page refers to: Condition subjects and Patient resources"""
+    ids = []
+    for entry in page.get('entry', []) or []:
+        resource = entry.get('resource', {})
+        if resource.get('resourceType') == 'Patient' and resource.get('id'):
+            ids.append(resource['id'])
+        elif resource.get('resourceType') == 'Condition':
+            reference = resource.get('subject', {}).get('reference', '')
+            if reference.startswith('Patient/'):
+                ids.append(reference[len('Patient/'):])
+    return ids
+
+
+class PatientIds:
+    """Interns patient ids to dense integers so cohorts are sorted int arrays.
+
+    Set algebra then runs on numpy arrays (intersect1d/union1d/setdiff1d)
+    instead of Python sets of strings.
+    """
+
+    def __init__(self):
+        self._index: Dict[str, int] = {}
+        self._ids: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def intern(self, patient_ids: Iterable[str]) -> np.ndarray:
+        """Sorted, de-duplicated array of the integers for `patient_ids`"""
+        numbers = []
+        for patient_id in patient_ids:
+            number = self._index.get(patient_id)
+            if number is None:
+                number = self._index[patient_id] = len(self._ids)
+                self._ids.append(patient_id)
+            numbers.append(number)
+        return np.unique(np.array(numbers, dtype=np.int64))
+
+    def resolve(self, numbers: np.ndarray) -> List[str]:
+        return [self._ids[number] for number in numbers.tolist()]
+
+
+class CohortQuery:
+    """Executes a multi-condition query as set algebra over per-group sub-queries.
+
+    Every condition group (see FHIRQueryProcessor.cohort_groups) becomes
+    one Condition search. Group sizes are estimated together with
+    `_summary=count` (in one batch Bundle where the server takes batches);
+    the smallest wanted group is fetched first and, when it is small enough,
+    every other group is searched only within its patients
+    (`subject=Patient/...`). The remaining groups then run
+    concurrently and are intersected (wanted) or subtracted (excluded).
+    Demographics are fetched for the final cohort only.
+    """
+
+    def __init__(self, processor, fhir_query: Dict[str, Any], aggregates: bool = False, materialize: bool = True,
+                 paged: bool = False):
+        self.processor = processor
+        self.aggregates = aggregates
+        counting = fhir_query.get('intent') == 'count_patients'
+        self.materialize = materialize and not paged and not counting
+        # Paged rows are built from the result set later, so it needs demographics all the same
+        self.paged = paged and not counting
+        self.planner = processor.planner
+        self.fhir_query = fhir_query
+        self.filters = fhir_query['filters']
+        self.ids = PatientIds()
+        self.builder = CohortFrameBuilder()
+        self.truncated = False
+
+    def _url(self, resource_type: str, params: List[str]) -> str:
+        return f"{self.processor.fhir_base_url}/{resource_type}?{'&'.join(sorted(set(params)))}"
+
+    def _group_params(self, codes: List[str], wanted: bool) -> List[str]:
+        conditions = [{'search_param': f'code={code}'} for code in codes]
+        if wanted:
+            # Demographics narrow every wanted group; an excluded group must stay unnarrowed
+            return self.planner.plan('Condition', conditions, self.filters['age_filters'], self.filters['gender'])
+        return self.planner.plan('Condition', conditions, [])
+
+    async def _estimate(self, groups: List[Dict[str, Any]]) -> List[float]:
+        """Count-only searches for every group, sent together; unknown sizes are inf"""
+        urls = [self._url('Condition', group['params'] + ['_summary=count']) for group in groups]
+        bundles = await self.processor.get_fhir_client().get_many(urls, return_exceptions=True)
+        estimates = []
+        for bundle in bundles:
+            total = None if isinstance(bundle, Exception) else bundle.get('total')
+            estimates.append(math.inf if total is None else total)
+        return estimates
+
+    async def _fetch(self, resource_type: str, params: List[str], merge: bool,
+                     within: Optional[np.ndarray] = None) -> np.ndarray:
+        """Patient ids matched by a search, optionally restricted to the patients `within`"""
+        params = params + self.planner.projection_params(resource_type, [])
+        if within is None:
+            urls = [self._url(resource_type, params)]
+        else:
+            patient_ids = self.ids.resolve(within)
+            chunk = Config.FHIR_ID_CHUNK_SIZE
+            urls = [
+                self._url(resource_type, params + [f"subject={','.join('Patient/' + i for i in patient_ids[start:start + chunk])}"])
+                for start in range(0, len(patient_ids), chunk)
+            ]
+
+        slots = asyncio.Semaphore(Config.FHIR_PAGE_CONCURRENCY)
+
+        async def fetch(url: str) -> List[str]:
+            async with slots:
+                metrics.incr('cohort_subqueries')
+                pager = self.processor.search_pages(url, streaming=True)
+                found = []
+                async for page in pager:
+                    found.extend(page_patient_ids(page))
+                    if merge:
+                        self.builder.add_bundle(page)
+                self.truncated = self.truncated or pager.truncated
+                return found
+
+        results = await asyncio.gather(*(fetch(url) for url in urls))
+        return self.ids.intern(patient_id for found in results for patient_id in found)
+
+    def _needs_demographics(self) -> bool:
+        return self.materialize or self.paged or self.aggregates or self.processor.has_local_filters(self.filters)
+
+    async def run(self) -> Dict[str, Any]:
+        cohort = self.fhir_query['cohort']
+        metrics.incr('cohort_queries')
+        groups = [{'codes': codes, 'wanted': True} for codes in cohort['all_of']]
+        groups += [{'codes': codes, 'wanted': False} for codes in cohort['none_of']]
+        for group in groups:
+            group['params'] = self._group_params(group['codes'], group['wanted'])
+
+        # Cardinality estimates decide the order; they are cheap count-only searches
+        estimates = await self._estimate(groups)
+        for group, estimate in zip(groups, estimates):
+            group['estimate'] = None if estimate == math.inf else estimate
+        wanted = sorted((g for g in groups if g['wanted']), key=lambda g: (g['estimate'] is None, g['estimate'] or 0))
+        excluded = [g for g in groups if not g['wanted']]
+
+        if wanted:
+            first = wanted.pop(0)
+            cohort_ids = await self._fetch('Condition', first['params'], merge=True)
+            first['fetched'] = len(cohort_ids)
+            have_demographics = False
+        else:
+            # Only exclusions: start from every patient matching the demographics
+            patient_params = self.planner.plan('Patient', [], self.filters['age_filters'], self.filters['gender'])
+            cohort_ids = await self._fetch('Patient', patient_params, merge=True)
+            have_demographics = True
+
+        # The first cohort constrains the rest when it is small enough to list
+        rest = wanted + excluded
+        if rest and len(cohort_ids):
+            within = cohort_ids if len(cohort_ids) <= Config.COHORT_CONSTRAIN_MAX_IDS else None
+            results = await asyncio.gather(*(
+                self._fetch('Condition', group['params'], merge=group['wanted'], within=within) for group in rest
+            ))
+            for group, group_ids in zip(rest, results):
+                group['fetched'] = len(group_ids)
+                group['constrained'] = within is not None
+                if group['wanted']:
+                    cohort_ids = np.intersect1d(cohort_ids, group_ids, assume_unique=True)
+                else:
+                    cohort_ids = np.setdiff1d(cohort_ids, group_ids, assume_unique=True)
+
+        final_ids = self.ids.resolve(cohort_ids)
+        if self._needs_demographics() and not have_demographics:
+            await PatientResolver(self.processor).resolve(self.builder, final_ids)
+        for patient_id in final_ids:
+            self.builder.row(patient_id)
+        frame = self.builder.build()
+        rows = frame.filter(self.filters, rows=frame.rows_for(final_ids))
+
+        results = {
+            **self.processor.frame_results(frame, rows, aggregates=self.aggregates, materialize=self.materialize),
+            'raw_fhir_response': {},
+            'cohort': {
+                'subqueries': [
+                    {key: group.get(key) for key in ('codes', 'wanted', 'estimate', 'fetched', 'constrained')}
+                    for group in groups
+                ],
+                'truncated': self.truncated
+            }
+        }
+        if self.fhir_query.get('intent') == 'count_patients':
+            # Counts have no rows to page, as with the non-cohort count paths
+            del results['result_set']
+            results['count_method'] = 'cohort'
+        return results
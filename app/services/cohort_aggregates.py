@@ -0,0 +1,114 @@
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.services.cohort_frame import GENDERS, CohortFrame
+
+AGE_BUCKET_YEARS = 10
+# Ages from here on share one open-ended bucket
+AGE_BUCKET_OPEN_FROM = 90
+AGE_PERCENTILES = (10, 25, 50, 75, 90)
+TOP_CONDITIONS = 10
+# Co-occurrence is counted among this many most frequent conditions
+CO_OCCURRENCE_LABELS = 50
+# Patients per dense indicator block when counting co-occurrence
+CO_OCCURRENCE_BLOCK = 65536
+
+
+def age_buckets(ages: np.ndarray) -> List[Dict[str, Any]]:
+    bucket_count = AGE_BUCKET_OPEN_FROM // AGE_BUCKET_YEARS + 1
+    buckets = np.clip(ages.astype(np.int64) // AGE_BUCKET_YEARS, 0, bucket_count - 1)
+    counts = np.bincount(buckets, minlength=bucket_count).tolist()
+    labels = [f"{start}-{start + AGE_BUCKET_YEARS - 1}" for start in range(0, AGE_BUCKET_OPEN_FROM, AGE_BUCKET_YEARS)]
+    labels.append(f"{AGE_BUCKET_OPEN_FROM}+")
+    return [{'range': label, 'count': count} for label, count in zip(labels, counts)]
+
+
+def patient_conditions(frame: CohortFrame, rows: np.ndarray):
+    """(patient, condition label) pairs of `rows`, each at most once, sorted by patient"""
+    starts = frame.condition_offsets[rows]
+    lengths = frame.condition_offsets[rows + 1] - starts
+    total = int(lengths.sum())
+    # Positions of every selected row's labels in the CSR arrays, without a Python loop
+    row_starts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    labels = frame.condition_labels[row_starts + np.arange(total)].astype(np.int64)
+    patients = np.repeat(np.arange(len(rows), dtype=np.int64), lengths)
+    vocabulary_size = max(len(frame.vocabulary), 1)
+    pairs = np.unique(patients * vocabulary_size + labels)
+    return pairs // vocabulary_size, pairs % vocabulary_size
+
+
+def co_occurrence(patients: np.ndarray, labels: np.ndarray, patient_count: int,
+                  common: np.ndarray, vocabulary_size: int) -> np.ndarray:
+    """Patients having both of each pair of the `common` labels, as a square matrix"""
+    column = np.full(vocabulary_size, -1, dtype=np.int64)
+    column[common] = np.arange(len(common))
+    keep = column[labels] >= 0
+    patients, columns = patients[keep], column[labels[keep]]
+
+    counts = np.zeros((len(common), len(common)), dtype=np.float64)
+    bounds = np.searchsorted(patients, np.arange(0, patient_count + CO_OCCURRENCE_BLOCK, CO_OCCURRENCE_BLOCK))
+    for block, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        if start == end:
+            continue
+        first_patient = block * CO_OCCURRENCE_BLOCK
+        indicator = np.zeros((min(CO_OCCURRENCE_BLOCK, patient_count - first_patient), len(common)), dtype=np.float32)
+        indicator[patients[start:end] - first_patient, columns[start:end]] = 1
+        counts += indicator.T @ indicator
+    return counts
+
+
+def cohort_aggregates(frame: CohortFrame, rows: np.ndarray, today: Optional[date] = None,
+                      top: int = TOP_CONDITIONS) -> Dict[str, Any]:
+    """Chart-ready summary of the `rows` of a cohort frame, computed on its columns.
+
+    Ages are bucketed by AGE_BUCKET_YEARS with percentiles over the known
+    ages; gender counts include `missing` for patients whose Patient was
+    never loaded; conditions and co-occurring pairs count patients, each
+    patient once per condition.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    ages = frame.ages(today, rows)
+    known = ages[~np.isnan(ages)]
+
+    percentiles = None
+    if len(known):
+        percentiles = {f"p{p}": float(value) for p, value in zip(AGE_PERCENTILES, np.percentile(known, AGE_PERCENTILES))}
+
+    gender_counts = np.bincount(frame.genders[rows].astype(np.int64) + 1, minlength=len(GENDERS) + 1).tolist()
+    gender = {'missing': gender_counts[0], **dict(zip(GENDERS, gender_counts[1:]))}
+
+    patients, labels = patient_conditions(frame, rows)
+    condition_counts = np.bincount(labels, minlength=len(frame.vocabulary))
+    ranked = np.argsort(-condition_counts, kind='stable')
+    ranked = ranked[condition_counts[ranked] > 0]
+
+    common = ranked[:CO_OCCURRENCE_LABELS]
+    pairs = co_occurrence(patients, labels, len(rows), common, len(frame.vocabulary))
+    first, second = np.triu_indices(len(common), k=1)
+    together = pairs[first, second]
+    order = np.argsort(-together, kind='stable')[:top]
+    order = order[together[order] > 0]
+
+    return {
+        'patients': len(rows),
+        'age': {
+            'buckets': age_buckets(known),
+            'unknown': int(len(ages) - len(known)),
+            'mean': round(float(known.mean()), 1) if len(known) else None,
+            'percentiles': percentiles
+        },
+        'gender': gender,
+        'conditions': [
+            {'condition': frame.vocabulary[label], 'patients': int(condition_counts[label])}
+            for label in ranked[:top].tolist()
+        ],
+        'co_occurring': [
+            {
+                'conditions': [frame.vocabulary[common[first[i]]], frame.vocabulary[common[second[i]]]],
+                'patients': int(together[i])
+            }
+            for i in order.tolist()
+        ]
+    }
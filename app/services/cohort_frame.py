@@ -0,0 +1,229 @@
+import math
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+GENDERS = ('unknown', 'male', 'female', 'other')
+GENDER_CODES = {gender: code for code, gender in enumerate(GENDERS)}
+# Gender code of a row only referenced by Conditions: its Patient was never merged
+NO_PATIENT = -1
+NO_BIRTH_DATE = np.iinfo(np.int32).min
+EPOCH = date(1970, 1, 1)
+AGE_COMPARISONS = {
+    'gt': np.greater,
+    'ge': np.greater_equal,
+    'lt': np.less,
+    'le': np.less_equal,
+}
+
+
+def birth_day(birth_date: Optional[str]) -> int:
+    """Days since 1970-01-01 for a FHIR date; partial dates (YYYY, YYYY-MM) count from their first day"""
+    if not birth_date:
+        return NO_BIRTH_DATE
+    try:
+        year = int(birth_date[:4])
+    except (ValueError, TypeError):
+        return NO_BIRTH_DATE
+    try:
+        month = int(birth_date[5:7]) if len(birth_date) >= 7 else 1
+        day = int(birth_date[8:10]) if len(birth_date) >= 10 else 1
+        return (date(year, month, day) - EPOCH).days
+    except ValueError:
+        return (date(year, 1, 1) - EPOCH).days
+
+
+def birth_days(birth_dates: List[Optional[str]]) -> np.ndarray:
+    """birth_day of every date as an int32 array, parsed by numpy unless a date is malformed"""
+    try:
+        days = np.array(birth_dates, dtype='datetime64[D]').astype(np.int64)
+    except ValueError:
+        return np.array([birth_day(d) for d in birth_dates], dtype=np.int32)
+    days[days == np.iinfo(np.int64).min] = NO_BIRTH_DATE  # NaT
+    return days.astype(np.int32)
+
+
+class CohortFrameBuilder:
+    """Accumulates searchset pages into columns, one row per patient.
+
+    Rows are numbered in the order patients are first seen. Condition labels
+    are interned into a vocabulary and kept as (row, label index) pairs, so
+    merging a page allocates no per-patient dicts.
+    """
+
+    def __init__(self):
+        self.rows: Dict[str, int] = {}
+        self.ids: List[str] = []
+        self.names: List[Optional[str]] = []
+        self.birth_dates: List[Optional[str]] = []
+        self.genders: List[int] = []
+        self.condition_rows: List[int] = []
+        self.condition_labels: List[int] = []
+        self.vocabulary: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def row(self, patient_id: str) -> int:
+        row = self.rows.get(patient_id)
+        if row is None:
+            row = self.rows[patient_id] = len(self.ids)
+            self.ids.append(patient_id)
+            self.names.append(None)
+            self.birth_dates.append(None)
+            self.genders.append(NO_PATIENT)
+        return row
+
+    def add_condition(self, patient_id: str, label: str):
+        label_index = self.vocabulary.get(label)
+        if label_index is None:
+            label_index = self.vocabulary[label] = len(self.vocabulary)
+        self.condition_rows.append(self.row(patient_id))
+        self.condition_labels.append(label_index)
+
+    def add_patient(self, patient_id: str, name: str, birth_date: str, gender: str):
+        row = self.row(patient_id)
+        self.names[row] = name
+        self.birth_dates[row] = birth_date
+        self.genders[row] = GENDER_CODES.get(gender, GENDER_CODES['unknown'])
+
+    def add_bundle(self, bundle: Dict[str, Any], patients_only: bool = False):
+        """Merge the Condition and Patient entries of one Bundle.
+
+        With `patients_only`, only Patients that already have a row are
+        merged, as when filling in subjects fetched by `_id`.
+        """
+        if bundle.get('resourceType') != 'Bundle':
+            return
+        for entry in bundle.get('entry', []) or []:
+            resource = entry.get('resource', {})
+            resource_type = resource.get('resourceType')
+
+            if resource_type == 'Condition' and not patients_only:
+                subject_ref = resource.get('subject', {}).get('reference', '')
+                if 'Patient/' in subject_ref:
+                    coding = resource.get('code', {}).get('coding', [])
+                    label = coding[0].get('display', 'Unknown condition') if coding else 'Unknown condition'
+                    self.add_condition(subject_ref.replace('Patient/', ''), label)
+
+            elif resource_type == 'Patient' and resource.get('id'):
+                if patients_only and resource['id'] not in self.rows:
+                    continue
+                name = 'Unknown'
+                names = resource.get('name', [])
+                if names:
+                    given = names[0].get('given', [''])[0]
+                    family = names[0].get('family', '')
+                    name = f"{given} {family}".strip()
+                self.add_patient(resource['id'], name, resource.get('birthDate', ''), resource.get('gender', 'unknown'))
+
+    def missing_ids(self, patient_ids: Optional[Iterable[str]] = None) -> List[str]:
+        """Ids (of `patient_ids`, or every row) whose Patient resource was never merged"""
+        rows = range(len(self.ids)) if patient_ids is None else (self.row(i) for i in patient_ids)
+        return [self.ids[row] for row in rows if self.genders[row] == NO_PATIENT]
+
+    def build(self) -> 'CohortFrame':
+        rows = np.array(self.condition_rows, dtype=np.int64)
+        labels = np.array(self.condition_labels, dtype=np.int32)
+        # Group condition labels by row (CSR), keeping their arrival order within a row
+        order = np.argsort(rows, kind='stable')
+        offsets = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.ids)), out=offsets[1:])
+        return CohortFrame(
+            ids=self.ids,
+            names=self.names,
+            birth_dates=self.birth_dates,
+            birth_days=birth_days(self.birth_dates),
+            genders=np.array(self.genders, dtype=np.int8),
+            condition_offsets=offsets,
+            condition_labels=labels[order],
+            vocabulary=list(self.vocabulary)
+        )
+
+
+class CohortFrame:
+    """Columnar, array-backed table of a processed cohort.
+
+    Filters are evaluated as vectorized masks over the whole table; patient
+    dicts are only materialized (to_dicts) for the rows actually returned.
+    Ages follow the processor's convention of current year minus birth year.
+    """
+
+    def __init__(self, ids: List[str], names: List[Optional[str]], birth_dates: List[Optional[str]],
+                 birth_days: np.ndarray, genders: np.ndarray, condition_offsets: np.ndarray,
+                 condition_labels: np.ndarray, vocabulary: List[str]):
+        self.ids = ids
+        self.names = names
+        self.birth_dates = birth_dates
+        self.birth_days = birth_days
+        self.genders = genders
+        self.condition_offsets = condition_offsets
+        self.condition_labels = condition_labels
+        self.vocabulary = vocabulary
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def ages(self, today: Optional[date] = None, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Age of every row (or of `rows`) as a float array, NaN where the birth date is unknown"""
+        today = today or date.today()
+        birth_days = self.birth_days if rows is None else self.birth_days[rows]
+        birth_years = birth_days.astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970
+        return np.where(birth_days == NO_BIRTH_DATE, np.nan, today.year - birth_years)
+
+    def mask(self, query_filters: Dict, today: Optional[date] = None) -> np.ndarray:
+        """Rows passing the filters the server did not evaluate.
+
+        Rows with no known age pass age filters, and rows whose Patient was
+        never merged pass the gender filter, as nothing contradicts them.
+        """
+        keep = np.ones(len(self), dtype=bool)
+        age_filters = [f for f in query_filters.get('age_filters', []) if not f.get('pushed_down')]
+        if age_filters:
+            ages = self.ages(today)
+            unknown = np.isnan(ages)
+            with np.errstate(invalid='ignore'):
+                for age_filter in age_filters:
+                    compare = AGE_COMPARISONS.get(age_filter['operator'])
+                    if compare is not None:
+                        keep &= unknown | compare(ages, age_filter['value'])
+
+        gender = query_filters.get('gender')
+        if gender and not gender.get('pushed_down'):
+            code = GENDER_CODES.get(gender['value'], GENDER_CODES['unknown'])
+            keep &= (self.genders == NO_PATIENT) | (self.genders == code)
+        return keep
+
+    def filter(self, query_filters: Dict, rows: Optional[np.ndarray] = None,
+               today: Optional[date] = None) -> np.ndarray:
+        """Indices of the rows (of `rows`, or every row) that pass `query_filters`"""
+        keep = self.mask(query_filters, today)
+        return np.flatnonzero(keep) if rows is None else rows[keep[rows]]
+
+    def rows_for(self, patient_ids: Iterable[str]) -> np.ndarray:
+        index = {patient_id: row for row, patient_id in enumerate(self.ids)}
+        return np.array([index[patient_id] for patient_id in patient_ids], dtype=np.int64)
+
+    def conditions(self, row: int) -> List[str]:
+        start, end = self.condition_offsets[row], self.condition_offsets[row + 1]
+        return [self.vocabulary[label] for label in self.condition_labels[start:end].tolist()]
+
+    def to_dicts(self, rows: Iterable[int], today: Optional[date] = None) -> List[Dict[str, Any]]:
+        """Patient dicts for `rows`, in the shape the API returns"""
+        rows = np.asarray(rows, dtype=np.int64)
+        ages = self.ages(today, rows).tolist()
+        patients = []
+        for row, age in zip(rows.tolist(), ages):
+            if self.genders[row] == NO_PATIENT:
+                patients.append({'id': self.ids[row], 'conditions': self.conditions(row)})
+                continue
+            patients.append({
+                'id': self.ids[row],
+                'name': self.names[row],
+                'birthDate': self.birth_dates[row],
+                'age': None if math.isnan(age) else int(age),
+                'gender': GENDERS[self.genders[row]],
+                'conditions': self.conditions(row)
+            })
+        return patients
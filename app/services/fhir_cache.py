@@ -0,0 +1,127 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from app.config import Config
+from app.metrics import metrics
+from app.services.fhir_paging import SAFE_QUERY_CHARS
+
+
+def canonical_url(url: str) -> str:
+    """Normalize a FHIR URL so equivalent searches share one cache key"""
+    parts = urlsplit(url)
+    params = sorted(parse_qsl(parts.query, keep_blank_values=True))
+    return urlunsplit((
+        parts.scheme.lower(),
+        parts.netloc.lower(),
+        parts.path.rstrip('/'),
+        urlencode(params, safe=SAFE_QUERY_CHARS),
+        ''
+    ))
+
+
+def parse_ttls(spec: str) -> Dict[str, float]:
+    """Parse 'Patient:600,Condition:300' into {'Patient': 600.0, 'Condition': 300.0}"""
+    ttls = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        resource_type, _, seconds = item.partition(':')
+        ttls[resource_type.strip()] = float(seconds)
+    return ttls
+
+
+@dataclass
+class CacheEntry:
+    body: Any
+    size: int
+    expires_at: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Headers that turn a refetch of this entry into a cheap 304 if it is unchanged"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class FHIRResponseCache:
+    """LRU cache of decoded FHIR responses, bounded by total body bytes.
+
+    Entries expire after a per-resource-type TTL. Expired entries are kept
+    (until evicted) so their ETag/Last-Modified can revalidate them with a
+    conditional GET. Bodies are shared between callers, as in MemoCache.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, ttls: Optional[Dict[str, float]] = None,
+                 default_ttl: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        self.max_bytes = max_bytes if max_bytes is not None else Config.FHIR_CACHE_MAX_BYTES
+        self.ttls = ttls if ttls is not None else parse_ttls(Config.FHIR_CACHE_TTLS)
+        self.default_ttl = default_ttl if default_ttl is not None else Config.FHIR_CACHE_DEFAULT_TTL
+        self.clock = clock
+        self.total_bytes = 0
+        self._entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def ttl_for(self, key: str) -> float:
+        """TTL for the resource type (or operation such as `metadata`) a URL targets"""
+        resource_type = urlsplit(key).path.rsplit('/', 1)[-1]
+        return self.ttls.get(resource_type, self.default_ttl)
+
+    def lookup(self, key: str) -> Optional[CacheEntry]:
+        """Return the entry for `key`, fresh or expired, marking it recently used"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return entry.expires_at > self.clock()
+
+    def store(self, key: str, body: Any, size: int, headers: Optional[Dict[str, str]] = None):
+        """Cache a response body, evicting least recently used entries to stay within max_bytes"""
+        headers = headers or {}
+        if 'no-store' in headers.get('cache-control', '') or size > self.max_bytes:
+            return
+
+        self.discard(key)
+        self._entries[key] = CacheEntry(
+            body=body,
+            size=size,
+            expires_at=self.clock() + self.ttl_for(key),
+            etag=headers.get('etag'),
+            last_modified=headers.get('last-modified')
+        )
+        self.total_bytes += size
+
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= evicted.size
+            metrics.incr('fhir_cache_evictions')
+        metrics.set_gauge('fhir_cache_bytes', self.total_bytes)
+        metrics.set_gauge('fhir_cache_entries', len(self._entries))
+
+    def refresh(self, key: str, headers: Optional[Dict[str, str]] = None):
+        """Extend an entry's lifetime after the server confirmed it unchanged (304)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        headers = headers or {}
+        entry.expires_at = self.clock() + self.ttl_for(key)
+        entry.etag = headers.get('etag', entry.etag)
+        entry.last_modified = headers.get('last-modified', entry.last_modified)
+
+    def discard(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
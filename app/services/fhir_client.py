@@ -0,0 +1,329 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+import httpx
+
+from app.config import Config
+from app.logger import logger
+from app.metrics import metrics
+from app.services.fhir_cache import CacheEntry, FHIRResponseCache, canonical_url
+from app.services.fhir_stream import BundleStreamParser
+
+try:
+    import h2  # noqa: F401 -- HTTP/2 is only negotiated when the h2 package is installed
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+FHIR_JSON_HEADERS = {'Accept': 'application/fhir+json'}
+# Weight of the newest sample in the per-host RTT moving average
+RTT_SMOOTHING = 0.2
+# Answers to a batch POST meaning the server does not take batches at its base URL
+BATCH_UNSUPPORTED_STATUSES = {404, 405, 501}
+
+
+class FHIRServerError(Exception):
+    """Raised when the upstream FHIR server fails or cannot be reached"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(f"FHIR server error: {message}")
+        self.status_code = status_code
+
+
+def split_base(url: str, bases: Iterable[str] = ()) -> Tuple[str, str]:
+    """Split a search URL into the server base and the `Type?query` a batch entry carries.
+
+    A URL under one of the known `bases` splits there, which keeps
+    base-relative links such as HAPI's `base?_getpages=...` on their server;
+    any other URL splits before its last path segment.
+    """
+    for base in bases:
+        if url == base or url.startswith((f"{base}/", f"{base}?")):
+            return base, url[len(base):].lstrip('/')
+    path, _, query = url.partition('?')
+    base, _, resource_type = path.rpartition('/')
+    return base, resource_type + (f"?{query}" if query else '')
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Build the pooled keep-alive client shared by every request on this worker"""
+    timeout = httpx.Timeout(Config.FHIR_READ_TIMEOUT, connect=Config.FHIR_CONNECT_TIMEOUT)
+    limits = httpx.Limits(
+        max_connections=Config.FHIR_MAX_CONNECTIONS,
+        max_keepalive_connections=Config.FHIR_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=Config.FHIR_KEEPALIVE_EXPIRY
+    )
+    http2 = Config.FHIR_HTTP2 and HTTP2_AVAILABLE
+    logger.info(f"FHIR HTTP client: http2={http2}, max_connections={Config.FHIR_MAX_CONNECTIONS}")
+    return httpx.AsyncClient(
+        timeout=timeout,
+        limits=limits,
+        http2=http2,
+        headers=FHIR_JSON_HEADERS,
+        follow_redirects=True
+    )
+
+
+class _Flight:
+    """An upstream request in progress and the number of callers awaiting it"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class FHIRClient:
+    """Async FHIR REST client over a shared connection pool, with an optional response cache.
+
+    Concurrent GETs for the same canonical URL share one upstream request
+    (single-flight); its result or failure is delivered to every caller.
+
+    get_many sends several searches either as parallel GETs or as one
+    `type: batch` Bundle POSTed to the server base, per server: batching
+    needs the CapabilityStatement to declare it (set_batch_support) and, in
+    'auto' mode, a measured RTT high enough that saving round trips beats
+    the server working through the entries one by one.
+    """
+
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None,
+                 max_connections_per_host: Optional[int] = None,
+                 cache: Optional[FHIRResponseCache] = None):
+        self.http = http_client or create_http_client()
+        self.cache = cache
+        self._in_flight: Dict[str, _Flight] = {}
+        self.max_connections_per_host = max_connections_per_host or Config.FHIR_MAX_CONNECTIONS_PER_HOST
+        self._host_slots: Dict[str, asyncio.Semaphore] = {}
+        self.batch_support: Dict[str, bool] = {}
+        self._rtt: Dict[str, float] = {}
+
+    def _host_slot(self, url: str) -> asyncio.Semaphore:
+        """Per-host semaphore so one slow server cannot take the whole pool"""
+        host = urlsplit(url).netloc
+        if host not in self._host_slots:
+            self._host_slots[host] = asyncio.Semaphore(self.max_connections_per_host)
+        return self._host_slots[host]
+
+    def set_batch_support(self, base_url: str, supported: bool):
+        self.batch_support[base_url.rstrip('/')] = supported
+
+    def _split_base(self, url: str) -> Tuple[str, str]:
+        """split_base against the configured server and every server whose batch support is known"""
+        return split_base(url, (Config.FHIR_BASE_URL.rstrip('/'), *self.batch_support))
+
+    def _record_rtt(self, url: str, seconds: float):
+        host = urlsplit(url).netloc
+        previous = self._rtt.get(host)
+        self._rtt[host] = seconds if previous is None else previous + RTT_SMOOTHING * (seconds - previous)
+
+    def rtt(self, url: str) -> Optional[float]:
+        """Smoothed time to response headers for the host of `url`, once measured"""
+        return self._rtt.get(urlsplit(url).netloc)
+
+    def should_batch(self, urls: List[str]) -> bool:
+        """Whether `urls` should go out as one batch Bundle rather than parallel GETs"""
+        mode = Config.FHIR_BATCH_MODE
+        if mode == 'never' or len(urls) < 2:
+            return False
+        bases = {self._split_base(url)[0] for url in urls}
+        if len(bases) != 1:
+            return False
+        supported = self.batch_support.get(bases.pop())
+        if mode == 'always':
+            return supported is not False
+        rtt = self.rtt(urls[0])
+        return bool(supported) and rtt is not None and rtt * 1000 >= Config.FHIR_BATCH_MIN_RTT_MS
+
+    async def get_many(self, urls: List[str], concurrency: Optional[int] = None,
+                       return_exceptions: bool = False) -> List[Any]:
+        """GET several FHIR searches, returning their bodies in order.
+
+        With `return_exceptions`, a failed search yields its FHIRServerError
+        in place of a body instead of failing the whole call.
+        """
+        if not self.should_batch(urls):
+            slots = asyncio.Semaphore(concurrency or len(urls) or 1)
+
+            async def fetch(url: str) -> Dict[str, Any]:
+                async with slots:
+                    return await self.get_json(url)
+
+            return list(await asyncio.gather(*(fetch(url) for url in urls), return_exceptions=return_exceptions))
+
+        results: List[Any] = [None] * len(urls)
+        pending = []
+        for index, url in enumerate(urls):
+            if self.cache is not None:
+                entry = self.cache.lookup(canonical_url(url))
+                if entry is not None and self.cache.is_fresh(entry):
+                    metrics.incr('fhir_cache_hits')
+                    results[index] = entry.body
+                    continue
+                metrics.incr('fhir_cache_misses' if entry is None else 'fhir_cache_stale')
+            pending.append(index)
+
+        size = Config.FHIR_BATCH_MAX_ENTRIES
+        chunks = [pending[start:start + size] for start in range(0, len(pending), size)]
+        bodies = await asyncio.gather(
+            *(self._post_batch([urls[index] for index in chunk], return_exceptions) for chunk in chunks),
+            return_exceptions=return_exceptions
+        )
+        for chunk, chunk_bodies in zip(chunks, bodies):
+            for position, index in enumerate(chunk):
+                results[index] = chunk_bodies if isinstance(chunk_bodies, Exception) else chunk_bodies[position]
+        return results
+
+    async def _post_batch(self, urls: List[str], return_exceptions: bool) -> List[Any]:
+        """POST one batch Bundle of GET entries and demultiplex its batch-response"""
+        base = self._split_base(urls[0])[0]
+        bundle = {
+            'resourceType': 'Bundle',
+            'type': 'batch',
+            'entry': [{'request': {'method': 'GET', 'url': self._split_base(url)[1]}} for url in urls]
+        }
+        async with self._host_slot(base):
+            try:
+                response = await self.http.post(base, content=json.dumps(bundle),
+                                                headers={'Content-Type': 'application/fhir+json'})
+                unsupported = response.status_code in BATCH_UNSUPPORTED_STATUSES
+                if not unsupported:
+                    response.raise_for_status()
+                    body = response.json()
+            except httpx.HTTPStatusError as e:
+                raise FHIRServerError(str(e), status_code=e.response.status_code)
+            except httpx.HTTPError as e:
+                raise FHIRServerError(str(e) or e.__class__.__name__)
+            except ValueError as e:
+                raise FHIRServerError(str(e))
+
+        if unsupported:
+            logger.warning(f"FHIR server at {base} rejected a batch ({response.status_code}); using parallel GETs")
+            self.batch_support[base] = False
+            metrics.incr('fhir_batch_fallbacks')
+            return await self.get_many(urls, return_exceptions=return_exceptions)
+
+        metrics.incr('fhir_batch_requests')
+        metrics.incr('fhir_batch_entries', len(urls))
+        return self._demultiplex(urls, body, response.num_bytes_downloaded, return_exceptions)
+
+    def _demultiplex(self, urls: List[str], body: Dict[str, Any], size: int, return_exceptions: bool) -> List[Any]:
+        """Bodies of a batch-response's entries, in request order, caching each one"""
+        entries = body.get('entry', []) or []
+        if body.get('resourceType') != 'Bundle' or len(entries) != len(urls):
+            raise FHIRServerError(f"batch-response has {len(entries)} entries for {len(urls)} requests")
+
+        results = []
+        for url, entry in zip(urls, entries):
+            outcome = entry.get('response', {}) or {}
+            status = outcome.get('status', '')
+            status_code = int(status.split()[0]) if status.split() and status.split()[0].isdigit() else None
+            if status_code is None or status_code >= 400:
+                error = FHIRServerError(f"batch entry {url}: {status or 'no status'}", status_code=status_code)
+                if not return_exceptions:
+                    raise error
+                results.append(error)
+                continue
+
+            resource = entry.get('resource') or {}
+            if self.cache is not None:
+                headers = {}
+                if outcome.get('etag'):
+                    headers['etag'] = outcome['etag']
+                if outcome.get('lastModified'):
+                    headers['last-modified'] = outcome['lastModified']
+                # The response size is shared out evenly; entries are not sized individually
+                self.cache.store(canonical_url(url), resource, size // len(urls), headers)
+            results.append(resource)
+        return results
+
+    async def get_json(self, url: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """GET a FHIR endpoint and decode the JSON body"""
+        if params:
+            url = str(httpx.URL(url, params=params))
+        return await self._get(url, streaming=False)
+
+    async def _get(self, url: str, streaming: bool) -> Dict[str, Any]:
+        """GET through the response cache, coalescing concurrent identical requests"""
+        # Projected (streamed) bodies are cached and coalesced apart from full ones
+        key = canonical_url(url) + ('#projected' if streaming else '')
+
+        entry = None
+        if self.cache is not None:
+            entry = self.cache.lookup(key)
+            if entry is not None and self.cache.is_fresh(entry):
+                metrics.incr('fhir_cache_hits')
+                return entry.body
+            metrics.incr('fhir_cache_misses' if entry is None else 'fhir_cache_stale')
+
+        flight = self._in_flight.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(self._fetch(url, key, entry, streaming)))
+            self._in_flight[key] = flight
+            flight.task.add_done_callback(lambda _, key=key, flight=flight: self._land(key, flight))
+        else:
+            metrics.incr('fhir_requests_coalesced')
+
+        flight.waiters += 1
+        try:
+            # shield: a cancelled caller stops waiting without cancelling the shared fetch
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Every caller gave up; nobody needs the response any more. Unlist the flight
+                # now, so a caller arriving before _land runs starts a new one instead of joining it
+                if self._in_flight.get(key) is flight:
+                    del self._in_flight[key]
+                flight.task.cancel()
+
+    def _land(self, key: str, flight: '_Flight'):
+        if self._in_flight.get(key) is flight:
+            del self._in_flight[key]
+        if not flight.task.cancelled():
+            # Mark the exception retrieved even if every waiter was cancelled
+            flight.task.exception()
+
+    async def _fetch(self, url: str, key: str, entry: Optional[CacheEntry], streaming: bool) -> Dict[str, Any]:
+        """One upstream GET, revalidating an expired cache entry conditionally"""
+        headers = entry.conditional_headers() if entry is not None else {}
+        async with self._host_slot(url):
+            try:
+                started = time.perf_counter()
+                async with self.http.stream('GET', url, headers=headers) as response:
+                    self._record_rtt(url, time.perf_counter() - started)
+                    if response.status_code == 304 and entry is not None:
+                        metrics.incr('fhir_cache_revalidations')
+                        self.cache.refresh(key, response.headers)
+                        return entry.body
+                    response.raise_for_status()
+                    if streaming:
+                        body = await self._read_projected_bundle(response)
+                    else:
+                        body = json.loads(await response.aread())
+            except httpx.HTTPStatusError as e:
+                raise FHIRServerError(str(e), status_code=e.response.status_code)
+            except httpx.HTTPError as e:
+                raise FHIRServerError(str(e) or e.__class__.__name__)
+            except ValueError as e:
+                raise FHIRServerError(str(e))
+
+        if self.cache is not None:
+            self.cache.store(key, body, response.num_bytes_downloaded, response.headers)
+        return body
+
+    @staticmethod
+    async def _read_projected_bundle(response: httpx.Response) -> Dict[str, Any]:
+        parser = BundleStreamParser()
+        entries = []
+        async for chunk in response.aiter_bytes():
+            entries.extend({'resource': resource} for resource in parser.feed(chunk))
+        entries.extend({'resource': resource} for resource in parser.close())
+        return {**parser.envelope, 'entry': entries}
+
+    async def get_bundle_streaming(self, url: str) -> Dict[str, Any]:
+        """Fetch a searchset Bundle holding only the projected fields of each entry"""
+        return await self._get(url, streaming=True)
+
+    async def aclose(self):
+        await self.http.aclose()
@@ -0,0 +1,146 @@
+import asyncio
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from app.config import Config
+from app.metrics import metrics
+
+# Characters FHIR search values use that we keep readable in rebuilt URLs
+SAFE_QUERY_CHARS = ':|,/'
+
+
+def get_query_param(url: str, name: str) -> Optional[str]:
+    """Return the first value of a query parameter, or None"""
+    for key, value in parse_qsl(urlsplit(url).query, keep_blank_values=True):
+        if key == name:
+            return value
+    return None
+
+
+def set_query_param(url: str, name: str, value: Any) -> str:
+    """Return `url` with `name` set to `value`, replacing any existing value"""
+    parts = urlsplit(url)
+    params = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k != name]
+    params.append((name, str(value)))
+    return urlunsplit(parts._replace(query=urlencode(params, safe=SAFE_QUERY_CHARS)))
+
+
+def get_link(bundle: Dict[str, Any], relation: str) -> Optional[str]:
+    """Return the Bundle.link url for a relation such as 'next'"""
+    for link in bundle.get('link', []) or []:
+        if link.get('relation') == relation:
+            return link.get('url')
+    return None
+
+
+class SearchPager:
+    """Async iterator over the pages of a FHIR searchset.
+
+    Follows Bundle.link[rel=next]. When the server pages by offset
+    (HAPI's `_getpagesoffset`) and reports `total`, the remaining pages are
+    fetched concurrently, or as batch Bundles where the client batches for
+    that server. Iteration stops at `max_pages` / `max_resources`, and
+    `truncated` records whether the budget cut the search short.
+
+    With `streaming` on, each page is decoded incrementally and holds only
+    the fields the processor consumes (see app.services.fhir_stream).
+    """
+
+    def __init__(self, client, url: str, page_size: Optional[int] = None,
+                 max_pages: Optional[int] = None, max_resources: Optional[int] = None,
+                 concurrency: Optional[int] = None, streaming: Optional[bool] = None):
+        self.client = client
+        self.streaming = Config.FHIR_STREAM_BUNDLES if streaming is None else streaming
+        self.page_size = page_size or Config.FHIR_PAGE_SIZE
+        self.url = url if get_query_param(url, '_count') else set_query_param(url, '_count', self.page_size)
+        self.max_pages = max_pages or Config.FHIR_MAX_PAGES
+        self.max_resources = max_resources or Config.FHIR_MAX_RESOURCES
+        self.concurrency = concurrency or Config.FHIR_PAGE_CONCURRENCY
+
+        self.pages_fetched = 0
+        self.resources_fetched = 0
+        self.total: Optional[int] = None
+        self.truncated = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'pages_fetched': self.pages_fetched,
+            'resources_fetched': self.resources_fetched,
+            'total': self.total,
+            'truncated': self.truncated
+        }
+
+    def _budget_left(self) -> bool:
+        return self.pages_fetched < self.max_pages and self.resources_fetched < self.max_resources
+
+    def _record(self, bundle: Dict[str, Any]):
+        self.pages_fetched += 1
+        self.resources_fetched += len(bundle.get('entry', []) or [])
+        metrics.incr('fhir_pages_fetched')
+
+    async def _fetch(self, url: str) -> Dict[str, Any]:
+        if self.streaming:
+            return await self.client.get_bundle_streaming(url)
+        return await self.client.get_json(url)
+
+    def _offset_page_urls(self, next_url: str) -> Optional[List[str]]:
+        """URLs of every remaining page, if the server pages by offset and reports a total"""
+        offset = get_query_param(next_url, '_getpagesoffset')
+        step = get_query_param(next_url, '_count') or self.page_size
+        if offset is None or self.total is None:
+            return None
+
+        offsets = range(int(offset), self.total, int(step))
+        pages_left = self.max_pages - self.pages_fetched
+        if len(offsets) > pages_left:
+            self.truncated = True
+        return [set_query_param(next_url, '_getpagesoffset', page_offset) for page_offset in offsets[:pages_left]]
+
+    async def _fetch_concurrently(self, urls: List[str]) -> AsyncIterator[Dict[str, Any]]:
+        """Fetch pages `concurrency` at a time, yielding each as soon as it lands"""
+        for start in range(0, len(urls), self.concurrency):
+            if not self._budget_left():
+                self.truncated = True
+                return
+            chunk = urls[start:start + self.concurrency]
+            if self.client.should_batch(chunk):
+                # One batch Bundle round trip instead of `concurrency` GETs
+                for page in await self.client.get_many(chunk):
+                    yield page
+                continue
+            tasks = [asyncio.ensure_future(self._fetch(url)) for url in chunk]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    yield await next_done
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    async def __aiter__(self) -> AsyncIterator[Dict[str, Any]]:
+        bundle = await self._fetch(self.url)
+        self.total = bundle.get('total')
+        self._record(bundle)
+        yield bundle
+
+        next_url = get_link(bundle, 'next')
+        # Drop our reference so only the consumer's merged state outlives the page
+        del bundle
+
+        offset_urls = self._offset_page_urls(next_url) if next_url else None
+        if offset_urls is not None:
+            # Closing the pager early cancels the page fetches in flight
+            async with aclosing(self._fetch_concurrently(offset_urls)) as pages:
+                async for page in pages:
+                    self._record(page)
+                    yield page
+            return
+
+        while next_url:
+            if not self._budget_left():
+                self.truncated = True
+                return
+            page = await self._fetch(next_url)
+            self._record(page)
+            next_url = get_link(page, 'next')
+            yield page
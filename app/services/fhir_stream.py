@@ -0,0 +1,153 @@
+import codecs
+import json
+from typing import Any, Dict, Iterator, List, Optional
+
+# Fields FHIRQueryProcessor reads, per resource type. Everything else in an
+# entry is dropped as soon as the entry is decoded.
+CONSUMED_FIELDS = {
+    'Condition': ('id', 'subject', 'code'),
+    'Patient': ('id', 'name', 'birthDate', 'gender'),
+}
+
+WHITESPACE = ' \t\n\r'
+
+# Drop consumed text from the buffer once this many characters have been parsed
+COMPACT_THRESHOLD = 64 * 1024
+
+
+def project_resource(resource: Dict[str, Any]) -> Dict[str, Any]:
+    """Reduce a resource to the fields the processor consumes"""
+    resource_type = resource.get('resourceType')
+    projected = {'resourceType': resource_type}
+
+    for field in CONSUMED_FIELDS.get(resource_type, ('id',)):
+        if field not in resource:
+            continue
+        value = resource[field]
+        if field == 'subject':
+            value = {'reference': value.get('reference', '')}
+        elif field == 'code':
+            coding = value.get('coding', [])
+            value = {'coding': [{'display': coding[0].get('display', 'Unknown condition')}]} if coding else {}
+        elif field == 'name':
+            value = [{'given': value[0].get('given', [''])[:1], 'family': value[0].get('family', '')}] if value else []
+        projected[field] = value
+
+    return projected
+
+
+class BundleStreamParser:
+    """Incremental parser for a FHIR Bundle arriving as a byte stream.
+
+    `feed` returns each `entry[].resource` (projected with `project_resource`)
+    as soon as the entry is complete, so only one entry is ever decoded at a
+    time. Top-level Bundle fields other than `entry` (total, link, type...)
+    are collected in `envelope`.
+    """
+
+    def __init__(self, project: bool = True):
+        self.project = project
+        self.envelope: Dict[str, Any] = {}
+        self.entry_count = 0
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._state = 'start'
+        self._key: Optional[str] = None
+
+    def feed(self, chunk: bytes) -> List[Dict[str, Any]]:
+        """Consume a chunk of bytes and return the resources it completed"""
+        self._buffer += self._text_decoder.decode(chunk)
+        return list(self._parse(final=False))
+
+    def close(self) -> List[Dict[str, Any]]:
+        """Signal end of stream; raises ValueError if the Bundle is incomplete"""
+        self._buffer += self._text_decoder.decode(b'', final=True)
+        resources = list(self._parse(final=True))
+        if self._state != 'done':
+            raise ValueError("Truncated FHIR Bundle stream")
+        return resources
+
+    def _skip(self, chars: str):
+        while self._pos < len(self._buffer) and self._buffer[self._pos] in chars:
+            self._pos += 1
+
+    def _decode_value(self, final: bool):
+        """Decode one JSON value at the cursor, or return (None, False) if it is incomplete"""
+        try:
+            value, end = self._decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            if final:
+                raise ValueError("Malformed FHIR Bundle stream")
+            return None, False
+        # A number touching the end of the buffer may still have digits to come
+        if end == len(self._buffer) and not final and isinstance(value, (int, float)):
+            return None, False
+        self._pos = end
+        return value, True
+
+    def _parse(self, final: bool) -> Iterator[Dict[str, Any]]:
+        while True:
+            self._skip(WHITESPACE)
+            if self._pos >= len(self._buffer):
+                break
+            char = self._buffer[self._pos]
+
+            if self._state == 'start':
+                if char != '{':
+                    raise ValueError("FHIR Bundle stream must be a JSON object")
+                self._pos += 1
+                self._state = 'key'
+
+            elif self._state == 'key':
+                if char == ',':
+                    self._pos += 1
+                elif char == '}':
+                    self._pos += 1
+                    self._state = 'done'
+                else:
+                    key, complete = self._decode_value(final)
+                    if not complete:
+                        break
+                    self._key = key
+                    self._state = 'colon'
+
+            elif self._state == 'colon':
+                if char != ':':
+                    raise ValueError("Malformed FHIR Bundle stream")
+                self._pos += 1
+                self._state = 'value'
+
+            elif self._state == 'value':
+                if self._key == 'entry' and char == '[':
+                    self._pos += 1
+                    self._state = 'entries'
+                else:
+                    value, complete = self._decode_value(final)
+                    if not complete:
+                        break
+                    self.envelope[self._key] = value
+                    self._state = 'key'
+
+            elif self._state == 'entries':
+                if char == ',':
+                    self._pos += 1
+                elif char == ']':
+                    self._pos += 1
+                    self._state = 'key'
+                else:
+                    entry, complete = self._decode_value(final)
+                    if not complete:
+                        break
+                    self.entry_count += 1
+                    resource = entry.get('resource', {}) if isinstance(entry, dict) else {}
+                    yield project_resource(resource) if self.project else resource
+
+            else:
+                # Trailing data after the closing brace
+                break
+
+        if self._pos > COMPACT_THRESHOLD:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
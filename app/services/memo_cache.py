@@ -0,0 +1,66 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+from app.metrics import metrics
+
+
+class MemoCache:
+    """Small entry-bounded LRU with an optional TTL and per-layer hit metrics.
+
+    `name` prefixes the `<name>_hits` / `<name>_misses` counters, so every
+    layer (parsed plans, query results, ...) reports its own hit rate.
+    Stored values are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, name: str, max_entries: int, ttl: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: "OrderedDict[Hashable, Tuple[Any, Optional[float]]]" = OrderedDict()
+        # Plans are cached from NLP worker threads as well as the event loop
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Whether `key` has a live entry, without touching recency or metrics"""
+        entry = self._entries.get(key)
+        return entry is not None and not self._expired(entry)
+
+    def _expired(self, entry: Tuple[Any, Optional[float]]) -> bool:
+        return entry[1] is not None and entry[1] <= self.clock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry):
+                if entry is not None:
+                    del self._entries[key]
+                metrics.incr(f'{self.name}_misses')
+                return None
+            self._entries.move_to_end(key)
+        metrics.incr(f'{self.name}_hits')
+        return entry[0]
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_entries <= 0:
+            return
+        expires_at = self.clock() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.incr(f'{self.name}_evictions')
+            size = len(self._entries)
+        metrics.set_gauge(f'{self.name}_entries', size)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        metrics.set_gauge(f'{self.name}_entries', 0)
@@ -0,0 +1,53 @@
+from typing import Iterable, List, Optional
+
+from app.config import Config
+from app.metrics import metrics
+from app.services.cohort_frame import CohortFrameBuilder
+
+
+class PatientResolver:
+    """Fetches the Patients a search did not include, by `_id` in chunks.
+
+    Servers may drop `_include`d subjects (include caps, page limits, or an
+    ignored `Condition:patient`), leaving merged patients without age or
+    gender. The missing ids are fetched as `Patient?_id=a,b,c` searches of
+    FHIR_ID_CHUNK_SIZE ids each, with `_count` set so every chunk is one
+    round trip, and at most FHIR_PAGE_CONCURRENCY chunks in flight (or all
+    chunks in one batch Bundle, when the client batches for this server).
+    """
+
+    def __init__(self, processor, chunk_size: Optional[int] = None, concurrency: Optional[int] = None):
+        self.processor = processor
+        self.chunk_size = chunk_size or Config.FHIR_ID_CHUNK_SIZE
+        self.concurrency = concurrency or Config.FHIR_PAGE_CONCURRENCY
+
+    def urls(self, patient_ids: List[str]) -> List[str]:
+        projection = self.processor.planner.projection_params('Patient', [])
+        urls = []
+        for start in range(0, len(patient_ids), self.chunk_size):
+            chunk = patient_ids[start:start + self.chunk_size]
+            params = [f"_id={','.join(chunk)}", f"_count={len(chunk)}", *projection]
+            urls.append(f"{self.processor.fhir_base_url}/Patient?{'&'.join(sorted(params))}")
+        return urls
+
+    async def resolve(self, builder: CohortFrameBuilder, patient_ids: Optional[Iterable[str]] = None) -> int:
+        """Merge the missing Patients (of `patient_ids`, or of every row) into `builder`.
+
+        Returns how many were found.
+        """
+        missing = builder.missing_ids(patient_ids)
+        if not missing:
+            return 0
+
+        urls = self.urls(missing)
+        metrics.incr('patient_resolver_requests', len(urls))
+        bundles = await self.processor.get_fhir_client().get_many(urls, concurrency=self.concurrency)
+        for bundle in bundles:
+            # A chunk never adds conditions or patients, only fills in known rows
+            builder.add_bundle(bundle, patients_only=True)
+
+        unresolved = len(builder.missing_ids(missing))
+        metrics.incr('patient_resolver_resolved', len(missing) - unresolved)
+        if unresolved:
+            metrics.incr('patient_resolver_unresolved', unresolved)
+        return len(missing) - unresolved
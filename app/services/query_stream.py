@@ -0,0 +1,167 @@
+import asyncio
+import time
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import Config
+from app.metrics import metrics
+from app.services.cohort_frame import CohortFrame, CohortFrameBuilder
+from app.services.patient_resolver import PatientResolver
+from app.services.response_shaping import ResponseShape, dumps
+
+NDJSON = 'application/x-ndjson'
+EVENT_STREAM = 'text/event-stream'
+
+Event = Tuple[str, Dict[str, Any]]
+
+
+def ndjson_events(events: List[Event]) -> bytes:
+    """One `{"event": ..., "data": ...}` line per event"""
+    return b''.join(dumps({'event': name, 'data': data}) + b'\n' for name, data in events)
+
+
+def sse_events(events: List[Event]) -> bytes:
+    """Server-Sent Events, the event name as `event:` and its JSON as `data:`"""
+    return b''.join(b'event: ' + name.encode('ascii') + b'\ndata: ' + dumps(data) + b'\n\n' for name, data in events)
+
+
+ENCODERS = {NDJSON: ndjson_events, EVENT_STREAM: sse_events}
+
+
+def stream_media_type(accept: Optional[str]) -> str:
+    """Server-Sent Events when the client accepts them, NDJSON otherwise"""
+    return EVENT_STREAM if accept and EVENT_STREAM in accept else NDJSON
+
+
+class QueryStream:
+    """Events of one query (header, patient, conditions, progress, summary/error), sent page by page"""
+
+    def __init__(self, processor, fhir_query: Dict[str, Any], shape: ResponseShape,
+                 header: Optional[Dict[str, Any]] = None, started: Optional[float] = None,
+                 is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None):
+        self.processor = processor
+        self.fhir_query = fhir_query
+        self.shape = shape
+        self.header = {**(header or {}), 'fhir_query': fhir_query}
+        self.started = time.perf_counter() if started is None else started
+        self.is_disconnected = is_disconnected
+        self.patients_sent = 0
+        self.first_result_ms: Optional[int] = None
+
+    def elapsed_ms(self) -> int:
+        return int((time.perf_counter() - self.started) * 1000)
+
+    async def disconnected(self) -> bool:
+        if self.is_disconnected is not None and await self.is_disconnected():
+            metrics.incr('query_streams_disconnected')
+            return True
+        return False
+
+    def patient_events(self, frame: CohortFrame, rows: np.ndarray) -> List[Event]:
+        if len(rows) and self.first_result_ms is None:
+            self.first_result_ms = self.elapsed_ms()
+        self.patients_sent += len(rows)
+        if not self.shape.materialize:
+            return []
+        patients = self.shape.apply({'patients': frame.to_dicts(rows)})['patients']
+        return [('patient', patient) for patient in patients]
+
+    def summary(self, **extra) -> Event:
+        return ('summary', {
+            'total_patients': self.patients_sent,
+            **extra,
+            'timing': {'first_result_ms': self.first_result_ms, 'total_ms': self.elapsed_ms()}
+        })
+
+    async def events(self) -> AsyncIterator[List[Event]]:
+        """Events in batches, one batch per upstream page"""
+        metrics.incr('query_streams')
+        yield [('header', self.header)]
+        try:
+            # Cohort ids are only known once every group is fetched, and counts have no rows
+            if self.fhir_query.get('cohort') or self.fhir_query.get('intent') == 'count_patients':
+                batches = self.result_set_events()
+            else:
+                batches = self.page_events()
+            async with aclosing(batches):
+                async for batch in batches:
+                    yield batch
+        except asyncio.CancelledError:
+            metrics.incr('query_streams_cancelled')
+            raise
+        except Exception as e:
+            metrics.incr('query_streams_failed')
+            yield [('error', {'detail': str(e), 'patients_sent': self.patients_sent})]
+
+    async def encode(self, media_type: str = NDJSON) -> AsyncIterator[bytes]:
+        """The stream as response body chunks, one per batch of events"""
+        encoder = ENCODERS[media_type]
+        async with aclosing(self.events()) as batches:
+            async for batch in batches:
+                yield encoder(batch)
+
+    async def page_events(self) -> AsyncIterator[List[Event]]:
+        # Filters only look at a patient's own Patient, so filtering each page alone matches the merged cohort
+        filters = self.fhir_query['filters']
+        resolver = PatientResolver(self.processor)
+        send_conditions = self.shape.materialize and (self.shape.fields is None or 'conditions' in self.shape.fields)
+        # Patients seen on an earlier page, and whether they matched
+        matched: Dict[str, bool] = {}
+
+        pager = self.processor.search_pages(self.fhir_query['fhir_url'])
+        async with aclosing(pager.__aiter__()) as pages:
+            async for page in pages:
+                builder = CohortFrameBuilder()
+                builder.add_bundle(page)
+                del page
+                new_ids = [patient_id for patient_id in builder.ids if patient_id not in matched]
+                await resolver.resolve(builder, new_ids)
+                frame = builder.build()
+
+                keep = frame.mask(filters)
+                new_rows, known_rows = [], []
+                for row, patient_id in enumerate(frame.ids):
+                    seen = matched.get(patient_id)
+                    if seen is None:
+                        matched[patient_id] = bool(keep[row])
+                        if keep[row]:
+                            new_rows.append(row)
+                    elif seen:
+                        known_rows.append(row)
+
+                events = self.patient_events(frame, np.array(new_rows, dtype=np.int64))
+                if send_conditions:
+                    events += [('conditions', {'id': frame.ids[row], 'conditions': frame.conditions(row)})
+                               for row in known_rows if frame.condition_offsets[row] < frame.condition_offsets[row + 1]]
+                events.append(('progress', {
+                    'pages': pager.pages_fetched,
+                    'resources': pager.resources_fetched,
+                    'total': pager.total,
+                    'patients': self.patients_sent,
+                    'elapsed_ms': self.elapsed_ms()
+                }))
+                # The next page is only pulled once the client has taken this one
+                yield events
+                if await self.disconnected():
+                    return
+
+        yield [self.summary(paging=pager.stats())]
+
+    async def result_set_events(self) -> AsyncIterator[List[Event]]:
+        results = await self.processor.execute_query(self.fhir_query, **self.shape.execute_options(paged=True))
+        result_set = results.get('result_set')
+        if result_set is None or self.fhir_query.get('intent') == 'count_patients':
+            self.patients_sent = results['total_patients']
+            yield [self.summary(**{key: results[key] for key in ('count_method', 'paging') if key in results})]
+            return
+
+        for start in range(0, len(result_set), Config.QUERY_PAGE_SIZE):
+            rows = result_set.rows[start:start + Config.QUERY_PAGE_SIZE]
+            yield self.patient_events(result_set.frame, rows) + [
+                ('progress', {'patients': self.patients_sent, 'elapsed_ms': self.elapsed_ms()})
+            ]
+            if await self.disconnected():
+                return
+        yield [self.summary()]
@@ -0,0 +1,92 @@
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from starlette.responses import Response
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Patient attributes `fields=` can select; `id` is always returned
+PATIENT_FIELDS = ('id', 'name', 'birthDate', 'age', 'gender', 'conditions')
+AGGREGATES_FIELD = 'aggregates'
+ENCODINGS = ('objects', 'compact')
+
+
+class ResponseShapeError(ValueError):
+    """Raised for `fields` / `encoding` values a response cannot be shaped by"""
+
+
+@dataclass(frozen=True)
+class ResponseShape:
+    """What a query response carries besides the count.
+
+    `fields` lists the patient attributes to return (None: all of them; empty:
+    no patient rows). `compact` encoding sends patients as one column list
+    plus an array of rows instead of an object per patient. The upstream
+    Bundle is only echoed with `include_raw`.
+    """
+    fields: Optional[Tuple[str, ...]] = None
+    aggregates: bool = False
+    include_raw: bool = False
+    encoding: str = 'objects'
+
+    @classmethod
+    def parse(cls, fields: Optional[str] = None, aggregates: bool = False, include_raw: bool = False,
+              encoding: str = 'objects') -> 'ResponseShape':
+        if encoding not in ENCODINGS:
+            raise ResponseShapeError(f"encoding must be one of {', '.join(ENCODINGS)}")
+        if fields is None:
+            return cls(None, aggregates, include_raw, encoding)
+
+        requested = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in requested if field not in PATIENT_FIELDS and field != AGGREGATES_FIELD]
+        if unknown:
+            raise ResponseShapeError(f"unknown fields: {', '.join(unknown)}")
+        patient_fields = [field for field in PATIENT_FIELDS if field in requested]
+        if patient_fields and 'id' not in patient_fields:
+            patient_fields.insert(0, 'id')
+        return cls(tuple(patient_fields), aggregates or AGGREGATES_FIELD in requested, include_raw, encoding)
+
+    @property
+    def materialize(self) -> bool:
+        return self.fields is None or len(self.fields) > 0
+
+    def execute_options(self, paged: bool = False) -> Dict[str, bool]:
+        """Keyword arguments for FHIRQueryProcessor.execute_query; `paged` rows are built from the result set later"""
+        if paged and self.materialize:
+            return {'aggregates': self.aggregates, 'materialize': False, 'paged': True}
+        return {'aggregates': self.aggregates, 'materialize': self.materialize}
+
+    def apply(self, processed_results: Dict[str, Any]) -> Dict[str, Any]:
+        """A shaped copy of `processed_results`, which may be a shared cached result"""
+        shaped = {key: value for key, value in processed_results.items()
+                  if key != 'result_set' and (self.include_raw or key != 'raw_fhir_response')}
+        patients = processed_results.get('patients', [])
+        columns = self.fields or PATIENT_FIELDS
+
+        if self.encoding == 'compact':
+            shaped['patients'] = {
+                'columns': list(columns),
+                'rows': [[patient.get(column) for column in columns] for patient in patients]
+            }
+        elif self.fields is not None:
+            shaped['patients'] = [
+                {column: patient[column] for column in columns if column in patient} for patient in patients
+            ]
+        return shaped
+
+
+def dumps(content: Any) -> bytes:
+    """Compact UTF-8 JSON of a JSON-native value (orjson when installed)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def json_response(content: Any) -> Response:
+    """Encode a JSON-native response body directly, skipping FastAPI's jsonable_encoder walk"""
+    return Response(dumps(content), media_type='application/json')
@@ -0,0 +1,76 @@
+import base64
+import binascii
+import secrets
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import Config
+from app.services.cohort_frame import CohortFrame
+from app.services.memo_cache import MemoCache
+
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor that was not issued for a result set"""
+
+
+def encode_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(f"o:{offset}".encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str]) -> int:
+    """Row offset of an opaque cursor; no cursor is the first page"""
+    if not cursor:
+        return 0
+    try:
+        prefix, offset = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii').split(':')
+        if prefix != 'o' or not offset.isdigit():
+            raise ValueError(cursor)
+        return int(offset)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(f"invalid cursor: {cursor}")
+
+
+class ResultSet:
+    """The matched rows of a cohort frame, materialized one page at a time"""
+
+    def __init__(self, frame: CohortFrame, rows: np.ndarray):
+        self.frame = frame
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def page(self, cursor: Optional[str] = None,
+             limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Patient dicts of the page at `cursor`, and the cursor of the next page (None after the last)"""
+        limit = limit or Config.QUERY_PAGE_SIZE
+        offset = decode_cursor(cursor)
+        if offset > len(self):
+            raise InvalidCursor(f"invalid cursor: {cursor}")
+        end = offset + limit
+        return self.frame.to_dicts(self.rows[offset:end]), encode_cursor(end) if end < len(self) else None
+
+
+class ResultStore:
+    """Result sets of recent queries by handle, so later pages need no upstream round trip.
+
+    Entries expire after RESULT_SET_TTL seconds and the least recently read
+    ones are dropped beyond RESULT_SET_MAX_ENTRIES. A handle is registered
+    per response; cached query results share one ResultSet between handles.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[float] = None):
+        self.result_sets = MemoCache('result_sets', max_entries or Config.RESULT_SET_MAX_ENTRIES,
+                                     ttl=ttl or Config.RESULT_SET_TTL)
+
+    def __len__(self) -> int:
+        return len(self.result_sets)
+
+    def put(self, result_set: ResultSet) -> str:
+        handle = secrets.token_urlsafe(16)
+        self.result_sets.put(handle, result_set)
+        return handle
+
+    def get(self, handle: str) -> Optional[ResultSet]:
+        return self.result_sets.get(handle)
@@ -0,0 +1,107 @@
+from unittest.mock import Mock
+
+import httpx
+
+from app.nlp.fhir_nlp_service import FHIRQueryProcessor
+from app.services.fhir_client import FHIRClient
+
+
+BASE_URL = "https://hapi.fhir.org/baseR5"
+
+SCT = "http://snomed.info/sct"
+DIABETES = f"{SCT}|73211009"
+HYPERTENSION = f"{SCT}|38341003"
+ASTHMA = f"{SCT}|195967001"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def condition_entry(patient_id, display="Diabetes mellitus"):
+    return {"resource": {
+        "resourceType": "Condition",
+        "subject": {"reference": f"Patient/{patient_id}"},
+        "code": {"coding": [{"display": display}]}
+    }}
+
+
+def patient_entry(patient_id, birth_date="1950-01-01", gender="female"):
+    return {"resource": {
+        "resourceType": "Patient",
+        "id": patient_id,
+        "name": [{"given": ["Test"], "family": patient_id}],
+        "birthDate": birth_date,
+        "gender": gender
+    }}
+
+
+def bundle(entries, next_url=None, total=None):
+    page = {"resourceType": "Bundle", "type": "searchset", "entry": entries}
+    if next_url:
+        page["link"] = [{"relation": "next", "url": next_url}]
+    if total is not None:
+        page["total"] = total
+    return page
+
+
+def make_client(handler, **kwargs) -> FHIRClient:
+    return FHIRClient(httpx.AsyncClient(transport=httpx.MockTransport(handler)), **kwargs)
+
+
+def make_processor(handler) -> FHIRQueryProcessor:
+    return FHIRQueryProcessor(nlp=Mock(), fhir_client=make_client(handler))
+
+
+class FakeCohortServer:
+    """Answers Condition/Patient searches over `conditions` and `patients`, recording each request.
+
+    `conditions` maps a code to the ids of its patients and `patients` an
+    id to its gender; every patient is born 1950-01-01.
+    """
+
+    CONDITIONS = {
+        DIABETES: ["p1", "p2", "p3", "p4"],
+        HYPERTENSION: ["p2", "p3", "p5"],
+        ASTHMA: ["p3", "p6"],
+    }
+    PATIENTS = {f"p{i}": "male" if i % 2 else "female" for i in range(1, 7)}
+
+    def __init__(self, conditions=None, patients=None):
+        self.conditions = dict(conditions or self.CONDITIONS)
+        self.patients = dict(patients or self.PATIENTS)
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        params = request.url.params
+        resource_type = request.url.path.rsplit('/', 1)[-1]
+
+        if resource_type == 'Condition':
+            codes = params.get('code', '').split(',')
+            subjects = params.get('subject')
+            allowed = {s.split('/', 1)[1] for s in subjects.split(',')} if subjects else None
+            entries = [
+                condition_entry(patient_id, code)
+                for code in codes for patient_id in self.conditions.get(code, [])
+                if allowed is None or patient_id in allowed
+            ]
+        else:
+            ids = params['_id'].split(',') if '_id' in params else list(self.patients)
+            entries = [
+                patient_entry(patient_id, gender=self.patients[patient_id])
+                for patient_id in ids
+                if patient_id in self.patients
+                and params.get('gender', self.patients[patient_id]) == self.patients[patient_id]
+            ]
+
+        if params.get('_summary') == 'count':
+            return httpx.Response(200, json={"resourceType": "Bundle", "total": len(entries)})
+        return httpx.Response(200, json=bundle(entries))
+
+    def searched(self, resource_type):
+        return [r for r in self.requests if r.url.path.endswith(resource_type) and r.url.params.get('_summary') != 'count']
@@ -6,6 +6,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from .conftest import async_client
 
 # Assuming your main FastAPI app is in app/main.py
+from app.config import Config
 from app.main import app
 from app.nlp.fhir_nlp_service import FHIRQueryProcessor
 
@@ -200,6 +201,250 @@ class TestRoutes:
             assert response.status_code == 200
             # Logging error should be handled gracefully
 
+    # Test POST /query/batch
+    @pytest.fixture
+    def batch_processor(self):
+        """Real query building with upstream execution mocked out"""
+        from app.dependencies import get_fhir_processor
+
+        processor = FHIRQueryProcessor(nlp=Mock())
+        processor.execute_query = AsyncMock(side_effect=lambda fhir_query, **options: {
+            "total_patients": 1, "patients": [], "url": fhir_query["fhir_url"], "options": options
+        })
+        app.dependency_overrides[get_fhir_processor] = lambda: processor
+        yield processor
+        app.dependency_overrides.pop(get_fhir_processor, None)
+
+    def test_process_query_batch_deduplicates_searches(self, async_client, batch_processor):
+        """Test that identical plans run one upstream search"""
+        response = async_client.post("/query/batch", json={"queries": [
+            "Show me diabetic patients",
+            "show me diabetic patients",
+            "Patients with asthma under 30",
+        ]})
+
+        assert response.status_code == 200
+        response_data = response.json()
+        assert len(response_data["results"]) == 3
+        assert response_data["distinct_searches"] == 2
+        assert batch_processor.execute_query.await_count == 2
+        assert response_data["results"][0]["processed_results"] == response_data["results"][1]["processed_results"]
+        assert set(response_data["timing"]) == {"parse_ms", "execute_ms", "total_ms"}
+
+    def test_process_query_batch_reports_per_query_errors(self, async_client, batch_processor):
+        """Test that one failed search does not fail the batch"""
+        batch_processor.execute_query.side_effect = [Exception("FHIR server unavailable"), {"total_patients": 0}]
+
+        response = async_client.post("/query/batch", json={"queries": ["patients with asthma", "patients with diabetes"]})
+
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert results[0]["error"] == "FHIR server unavailable"
+        assert results[1]["processed_results"] == {"total_patients": 0}
+
+    def test_process_query_batch_validation(self, async_client, batch_processor):
+        """Test batch request validation"""
+        assert async_client.post("/query/batch", json={"queries": []}).status_code == 422
+        assert async_client.post("/query/batch", json={"queries": ["ok"], "batch_size": 0}).status_code == 422
+        too_many = Config.NLP_MAX_N_PROCESS + 1
+        assert async_client.post("/query/batch", json={"queries": ["ok"], "n_process": too_many}).status_code == 422
+
+    # Test POST /query/structured
+    def test_process_structured_query(self, async_client, batch_processor):
+        """Test that explicit filters are planned without touching the NLP pipeline"""
+        response = async_client.post("/query/structured", json={
+            "intent": "search_patients",
+            "conditions": [{"system": "http://snomed.info/sct", "code": "195967001"}],
+            "age_filters": [{"operator": "lt", "value": 30}],
+        })
+
+        assert response.status_code == 200
+        fhir_query = response.json()["fhir_query"]
+        assert "code=http://snomed.info/sct|195967001" in fhir_query["fhir_url"]
+        assert fhir_query["filters"]["age_filters"][0]["operator"] == "lt"
+        assert response.json()["processed_results"]["url"] == fhir_query["fhir_url"]
+        batch_processor.nlp.assert_not_called()
+        # Same plan as the equivalent sentence, so both share cached results
+        assert fhir_query["plan_hash"] == batch_processor.build_fhir_query("patients with asthma under 30")["plan_hash"]
+
+    @pytest.mark.parametrize("params,expected", [
+        ("", {"aggregates": False, "materialize": True}),
+        ("?aggregates=true", {"aggregates": True, "materialize": True}),
+        ("?fields=aggregates", {"aggregates": True, "materialize": False}),
+    ])
+    def test_process_structured_query_aggregates(self, async_client, batch_processor, params, expected):
+        """Test that `aggregates` / `fields=aggregates` reach the processor"""
+        response = async_client.post(f"/query/structured{params}", json={"intent": "search_patients"})
+
+        assert response.status_code == 200
+        assert response.json()["processed_results"]["options"] == expected
+
+    def test_process_structured_query_shaping(self, async_client, batch_processor):
+        """Test that raw bundles are opt-in and unknown fields are rejected"""
+        batch_processor.execute_query.side_effect = lambda fhir_query, **options: {
+            "total_patients": 1, "patients": [{"id": "p1", "age": 40}], "raw_fhir_response": {"resourceType": "Bundle"}
+        }
+
+        default = async_client.post("/query/structured", json={}).json()["processed_results"]
+        raw = async_client.post("/query/structured?include_raw=true", json={}).json()["processed_results"]
+        compact = async_client.post("/query/structured?fields=age&encoding=compact", json={}).json()["processed_results"]
+
+        assert "raw_fhir_response" not in default
+        assert raw["raw_fhir_response"] == {"resourceType": "Bundle"}
+        assert compact["patients"] == {"columns": ["id", "age"], "rows": [["p1", 40]]}
+        assert async_client.post("/query/structured?fields=ssn", json={}).status_code == 422
+
+    # Test GET /query/{handle}/results
+    @pytest.fixture
+    def paged_query(self, batch_processor):
+        """/query over a 5-patient result set, with NLP and the database mocked out"""
+        import numpy as np
+        from app.dependencies import get_nlp_executor
+        from app.database.db_engine import get_session
+        from app.services.cohort_frame import CohortFrameBuilder
+
+        builder = CohortFrameBuilder()
+        for number in range(5):
+            builder.add_patient(f"p{number}", f"Test p{number}", "1980-01-01", "female")
+        frame = builder.build()
+        batch_processor.execute_query.side_effect = lambda fhir_query, **options: {
+            **batch_processor.frame_results(frame, np.arange(len(frame)), aggregates=options.get("aggregates", False),
+                                            materialize=options.get("materialize", True)),
+            "options": options
+        }
+        executor = Mock()
+        executor.build_fhir_query = AsyncMock(side_effect=batch_processor.build_fhir_query)
+        app.dependency_overrides[get_nlp_executor] = lambda: executor
+        app.dependency_overrides[get_session] = lambda: None
+        yield batch_processor
+        app.dependency_overrides.pop(get_nlp_executor, None)
+        app.dependency_overrides.pop(get_session, None)
+
+    def test_process_query_returns_first_page_and_handle(self, async_client, paged_query):
+        """Test that /query pages the result set and later pages are served by handle"""
+        first = async_client.post("/query?limit=2", json={"query": "patients with asthma"}).json()["processed_results"]
+
+        assert first["options"]["materialize"] is False and first["options"]["paged"] is True
+        assert first["total_patients"] == 5
+        assert [p["id"] for p in first["patients"]] == ["p0", "p1"]
+        assert "result_set" not in first
+
+        ids, cursor = [], first["next_cursor"]
+        while cursor:
+            page = async_client.get(f"/query/{first['handle']}/results",
+                                    params={"cursor": cursor, "limit": 2, "fields": "name"}).json()
+            ids += [p["id"] for p in page["patients"]]
+            assert set(page["patients"][0]) == {"id", "name"}
+            cursor = page["next_cursor"]
+        assert ids == ["p2", "p3", "p4"]
+        assert paged_query.execute_query.await_count == 1
+
+    def test_query_aggregates_cover_the_whole_result_set(self, async_client, paged_query):
+        """Test that aggregates by handle count every patient, not just the first page"""
+        handle = async_client.post("/query?limit=2", json={"query": "patients with asthma"}).json()["processed_results"]["handle"]
+
+        body = async_client.get(f"/query/{handle}/aggregates").json()
+
+        assert body["total_patients"] == 5
+        assert body["aggregates"]["patients"] == 5
+        assert body["aggregates"]["gender"]["female"] == 5
+        assert async_client.get("/query/unknown/aggregates").status_code == 404
+
+    @pytest.fixture
+    def cohort_server(self):
+        """A real processor and inline NLP over a fake FHIR server, with the database mocked out"""
+        from app.dependencies import get_fhir_processor
+        from app.database.db_engine import get_session
+        from app.tests.helpers import FakeCohortServer, make_processor
+
+        server = FakeCohortServer()
+        processor = make_processor(server)
+        app.dependency_overrides[get_fhir_processor] = lambda: processor
+        app.dependency_overrides[get_session] = lambda: None
+        yield server
+        app.dependency_overrides.pop(get_fhir_processor, None)
+        app.dependency_overrides.pop(get_session, None)
+
+    def test_process_query_cohort_rows_have_demographics(self, async_client, cohort_server):
+        """Test that AND cohorts resolve Patients for the first page and for later pages"""
+        first = async_client.post("/query?limit=1", json={"query": "patients with diabetes and hypertension"}).json()
+        results = first["processed_results"]
+        page = async_client.get(f"/query/{results['handle']}/results",
+                                params={"cursor": results["next_cursor"]}).json()
+
+        assert first["fhir_query"]["cohort"]["all_of"]
+        assert results["total_patients"] == 2
+        for patient in results["patients"] + page["patients"]:
+            assert {"name", "birthDate", "age", "gender"} <= set(patient)
+        assert [p["id"] for p in results["patients"] + page["patients"]] == ["p2", "p3"]
+        assert cohort_server.searched("Patient")
+
+    def test_process_query_cohort_count_has_no_rows(self, async_client, cohort_server):
+        """Test that a count over an AND/NOT cohort returns only the total, like other counts"""
+        response = async_client.post("/query", json={"query": "how many patients with diabetes but not asthma"})
+        results = response.json()["processed_results"]
+
+        assert response.status_code == 200
+        assert results["total_patients"] == 3
+        assert results["count_method"] == "cohort"
+        assert results["patients"] == []
+        assert "handle" not in results and "next_cursor" not in results
+
+    def test_query_results_errors(self, async_client, paged_query):
+        """Test unknown handles, bad cursors and out-of-range limits"""
+        handle = async_client.post("/query", json={"query": "patients with asthma"}).json()["processed_results"]["handle"]
+
+        assert async_client.get("/query/unknown/results").status_code == 404
+        assert async_client.get(f"/query/{handle}/results", params={"cursor": "nope"}).status_code == 400
+        assert async_client.get(f"/query/{handle}/results", params={"limit": 0}).status_code == 422
+
+    # Test POST /query/stream
+    def test_stream_query_formats(self, async_client, paged_query):
+        """Test NDJSON by default and Server-Sent Events on request"""
+        import json
+
+        ndjson = async_client.post("/query/stream", json={"query": "count patients with asthma"})
+        sse = async_client.post("/query/stream", json={"query": "count patients with asthma"},
+                                headers={"Accept": "text/event-stream"})
+
+        assert ndjson.headers["content-type"].startswith("application/x-ndjson")
+        events = [json.loads(line) for line in ndjson.text.splitlines()]
+        assert [event["event"] for event in events] == ["header", "summary"]
+        assert events[0]["data"]["original_query"] == "count patients with asthma"
+        assert events[1]["data"]["total_patients"] == 5
+        assert sse.headers["content-type"].startswith("text/event-stream")
+        assert sse.text.startswith("event: header\ndata: ")
+
+    def test_stream_query_validation(self, async_client, paged_query):
+        """Test that aggregates and unknown fields are rejected before streaming"""
+        assert async_client.post("/query/stream?fields=aggregates", json={"query": "asthma"}).status_code == 422
+        assert async_client.post("/query/stream?fields=ssn", json={"query": "asthma"}).status_code == 422
+        assert async_client.post("/query/stream", json={}).status_code == 422
+
+    def test_process_structured_query_validation(self, async_client, batch_processor):
+        """Test structured request validation"""
+        assert async_client.post("/query/structured", json={"age_filters": [{"operator": "eq", "value": 30}]}).status_code == 422
+        assert async_client.post("/query/structured", json={"conditions": [{"code": "195967001"}]}).status_code == 422
+        assert async_client.post("/query/structured", json={"intent": "delete_patients"}).status_code == 422
+
+    def test_process_query_nlp_queue_full(self, async_client):
+        """Test that a saturated NLP stage sheds load with 503 and Retry-After"""
+        from app.dependencies import get_fhir_processor, get_nlp_executor
+        from app.nlp.executor import NLPQueueFull
+
+        busy_executor = Mock()
+        busy_executor.build_fhir_query = AsyncMock(side_effect=NLPQueueFull(retry_after=2))
+        app.dependency_overrides[get_fhir_processor] = lambda: FHIRQueryProcessor(nlp=Mock())
+        app.dependency_overrides[get_nlp_executor] = lambda: busy_executor
+        try:
+            response = async_client.post("/query", json={"query": "patients with asthma"})
+        finally:
+            app.dependency_overrides.pop(get_fhir_processor, None)
+            app.dependency_overrides.pop(get_nlp_executor, None)
+
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "2"
+
     # Test GET /suggestions
     def test_get_suggestions_success(self, async_client):
         """Test successful suggestions retrieval"""
@@ -230,6 +475,18 @@ class TestRoutes:
             assert isinstance(suggestion, str)
             assert len(suggestion.strip()) > 0
 
+    # Test GET /metrics
+    def test_get_metrics(self, async_client):
+        """Test metrics snapshot retrieval"""
+        response = async_client.get("/metrics")
+
+        assert response.status_code == 200
+
+        response_data = response.json()
+        assert "counters" in response_data
+        assert "gauges" in response_data
+        assert "timings" in response_data
+
     # Test GET /health
     @pytest.mark.asyncio
     async def test_health_check_success(self, async_client, mock_db):
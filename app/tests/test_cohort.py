@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+
+from app.services.cohort import PatientIds, page_patient_ids
+from app.tests.helpers import ASTHMA, DIABETES, HYPERTENSION, FakeCohortServer, make_processor
+
+
+@pytest.fixture
+def server():
+    return FakeCohortServer()
+
+
+@pytest.fixture
+def processor(server):
+    return make_processor(server)
+
+
+class TestPatientIds:
+    """Test cases for integer-interned patient id sets"""
+
+    def test_intern_is_sorted_unique_and_stable(self):
+        ids = PatientIds()
+
+        first = ids.intern(["b", "a", "b"])
+        second = ids.intern(["a", "c"])
+
+        assert first.tolist() == [0, 1]
+        assert second.tolist() == [1, 2]
+        assert ids.resolve(np.intersect1d(first, second)) == ["a"]
+
+    def test_page_patient_ids(self):
+        page = {"entry": [
+            {"resource": {"resourceType": "Condition", "subject": {"reference": "Patient/p1"}}},
+            {"resource": {"resourceType": "Condition", "subject": {"reference": "Group/g1"}}},
+            {"resource": {"resourceType": "Patient", "id": "p2"}},
+        ]}
+
+        assert page_patient_ids(page) == ["p1", "p2"]
+
+
+class TestCohortParsing:
+    """Test cases for AND/OR/NOT condition groups"""
+
+    def test_and_creates_groups(self, processor):
+        fhir_query = processor.build_fhir_query("patients with asthma and hypertension")
+
+        assert fhir_query['cohort'] == {'all_of': [[ASTHMA], [HYPERTENSION]], 'none_of': []}
+
+    def test_or_stays_one_search(self, processor):
+        fhir_query = processor.build_fhir_query("patients with asthma or hypertension")
+
+        assert fhir_query['cohort'] is None
+        assert f"code={ASTHMA},{HYPERTENSION}" in fhir_query['fhir_url']
+
+    def test_negation_excludes_group(self, processor):
+        fhir_query = processor.build_fhir_query("patients with hypertension but not asthma")
+
+        assert fhir_query['cohort'] == {'all_of': [[HYPERTENSION]], 'none_of': [[ASTHMA]]}
+        assert ASTHMA not in fhir_query['fhir_url']
+        assert [c['code'] for c in fhir_query['filters']['conditions']] == ['38341003']
+
+    def test_negated_age_does_not_negate_the_condition(self, processor):
+        fhir_query = processor.build_fhir_query("patients not older than 50 with diabetes")
+
+        assert fhir_query['cohort'] is None
+        assert DIABETES in fhir_query['fhir_url']
+
+
+class TestCohortExecution:
+    """Test cases for executing cohort queries as set algebra"""
+
+    @pytest.mark.asyncio
+    async def test_and_intersects_smallest_first(self, processor, server):
+        fhir_query = processor.build_fhir_query("patients with asthma and hypertension")
+
+        result = await processor.execute_query(fhir_query)
+
+        assert [p['id'] for p in result['patients']] == ['p3']
+        subqueries = result['cohort']['subqueries']
+        assert [(s['codes'], s['estimate']) for s in subqueries] == [([ASTHMA], 2), ([HYPERTENSION], 3)]
+        conditions = server.searched('Condition')
+        # Asthma (2 patients) runs first; hypertension is searched only within those patients
+        assert conditions[0].url.params['code'] == ASTHMA
+        assert conditions[1].url.params['subject'] == 'Patient/p3,Patient/p6'
+        # Demographics only for the final cohort
+        assert [r.url.params['_id'] for r in server.searched('Patient')] == ['p3']
+        assert result['patients'][0]['gender'] == 'male'
+
+    @pytest.mark.asyncio
+    async def test_not_subtracts(self, processor):
+        fhir_query = processor.build_fhir_query("patients with diabetes without hypertension")
+
+        result = await processor.execute_query(fhir_query)
+
+        assert sorted(p['id'] for p in result['patients']) == ['p1', 'p4']
+
+    @pytest.mark.asyncio
+    async def test_only_exclusions_start_from_all_patients(self, processor, server):
+        fhir_query = processor.build_fhir_query("female patients without diabetes")
+
+        result = await processor.execute_query(fhir_query)
+
+        assert sorted(p['id'] for p in result['patients']) == ['p6']
+        assert server.searched('Patient')[0].url.params['gender'] == 'female'
+
+    @pytest.mark.asyncio
+    async def test_count_skips_demographics(self, processor, server):
+        fhir_query = processor.build_fhir_query("how many patients have diabetes and hypertension")
+
+        result = await processor.execute_query(fhir_query)
+
+        assert result['total_patients'] == 2
+        assert result['count_method'] == 'cohort'
+        assert result['patients'] == []
+        assert server.searched('Patient') == []
+
+    @pytest.mark.asyncio
+    async def test_empty_first_cohort_stops_early(self, processor, server):
+        server.conditions[ASTHMA] = []
+        fhir_query = processor.build_fhir_query("patients with asthma and diabetes")
+
+        result = await processor.execute_query(fhir_query)
+
+        assert result['total_patients'] == 0
+        assert len(server.searched('Condition')) == 1
+
+    @pytest.mark.asyncio
+    async def test_large_first_cohort_is_not_used_as_constraint(self, processor, server, monkeypatch):
+        monkeypatch.setattr('app.services.cohort.Config.COHORT_CONSTRAIN_MAX_IDS', 1)
+        fhir_query = processor.build_fhir_query("patients with asthma and hypertension")
+
+        result = await processor.execute_query(fhir_query)
+
+        assert [p['id'] for p in result['patients']] == ['p3']
+        assert all('subject' not in r.url.params for r in server.searched('Condition'))
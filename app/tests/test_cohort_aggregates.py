@@ -0,0 +1,109 @@
+from datetime import date
+
+import numpy as np
+import pytest
+import httpx
+
+from app.services import cohort_aggregates as aggregates_module
+from app.services.cohort_aggregates import cohort_aggregates
+from app.services.cohort_frame import CohortFrameBuilder
+from app.tests.helpers import bundle, condition_entry, make_processor, patient_entry
+
+
+TODAY = date(2026, 6, 1)
+PATIENTS = [
+    # id, conditions, birth date, gender
+    ("p1", ["Diabetes", "Hypertension"], "1970-01-01", "male"),
+    ("p2", ["Diabetes", "Hypertension", "Asthma"], "1990-01-01", "female"),
+    ("p3", ["Diabetes", "Diabetes"], "2016", "female"),
+    ("p4", ["Asthma"], None, None),
+    ("p5", ["Obesity"], "1920-05-05", "other"),
+]
+
+
+@pytest.fixture
+def frame():
+    builder = CohortFrameBuilder()
+    for patient_id, conditions, birth_date, gender in PATIENTS:
+        for condition in conditions:
+            builder.add_condition(patient_id, condition)
+        if birth_date:
+            builder.add_patient(patient_id, "Test", birth_date, gender)
+    return builder.build()
+
+
+class TestCohortAggregates:
+    """Test cases for the vectorized cohort summary"""
+
+    def test_age_buckets_and_percentiles(self, frame):
+        age = cohort_aggregates(frame, np.arange(5), today=TODAY)['age']
+
+        counts = {bucket['range']: bucket['count'] for bucket in age['buckets']}
+        assert counts["10-19"] == 1 and counts["30-39"] == 1 and counts["50-59"] == 1 and counts["90+"] == 1
+        assert sum(counts.values()) == 4
+        assert age['unknown'] == 1
+        assert age['percentiles']['p50'] == 46.0
+        assert age['mean'] == 52.0
+
+    def test_gender_counts(self, frame):
+        gender = cohort_aggregates(frame, np.arange(5), today=TODAY)['gender']
+
+        assert gender == {'missing': 1, 'unknown': 0, 'male': 1, 'female': 2, 'other': 1}
+
+    def test_conditions_count_each_patient_once(self, frame):
+        result = cohort_aggregates(frame, np.arange(5), today=TODAY)
+
+        assert result['conditions'][0] == {'condition': 'Diabetes', 'patients': 3}
+        assert {c['condition']: c['patients'] for c in result['conditions']}['Asthma'] == 2
+        assert result['co_occurring'][0] == {'conditions': ['Diabetes', 'Hypertension'], 'patients': 2}
+        assert {tuple(sorted(pair['conditions'])) for pair in result['co_occurring']} == {
+            ('Diabetes', 'Hypertension'), ('Asthma', 'Diabetes'), ('Asthma', 'Hypertension')
+        }
+
+    def test_subset_of_rows(self, frame):
+        result = cohort_aggregates(frame, np.array([3, 4]), today=TODAY)
+
+        assert result['patients'] == 2
+        assert result['co_occurring'] == []
+        assert [c['condition'] for c in result['conditions']] == ['Asthma', 'Obesity']
+
+    def test_empty_cohort(self, frame):
+        result = cohort_aggregates(frame, np.array([], dtype=np.int64))
+
+        assert result['patients'] == 0
+        assert result['age']['percentiles'] is None
+        assert result['conditions'] == [] and result['co_occurring'] == []
+
+    def test_co_occurrence_across_blocks(self, frame, monkeypatch):
+        monkeypatch.setattr(aggregates_module, 'CO_OCCURRENCE_BLOCK', 2)
+
+        assert cohort_aggregates(frame, np.arange(5))['co_occurring'][0]['patients'] == 2
+
+
+class TestAggregatesMode:
+    """Test cases for aggregates through execute_query"""
+
+    @pytest.fixture
+    def processor(self):
+        page = bundle([condition_entry("p1", "Asthma"), patient_entry("p1", "1990-01-01")])
+        return make_processor(lambda request: httpx.Response(200, json=page))
+
+    @pytest.mark.asyncio
+    async def test_aggregates_without_rows(self, processor):
+        fhir_query = processor.build_structured_query('search_patients', [], [], 'female')
+
+        full = await processor.execute_query(fhir_query)
+        summary = await processor.execute_query(fhir_query, aggregates=True, materialize=False)
+
+        assert 'aggregates' not in full and len(full['patients']) == 1
+        assert summary['patients'] == [] and summary['total_patients'] == 1
+        assert summary['aggregates']['gender']['female'] == 1
+
+    @pytest.mark.asyncio
+    async def test_count_with_aggregates_streams_the_cohort(self, processor):
+        fhir_query = processor.build_structured_query('count_patients', [], [], None)
+
+        result = await processor.execute_query(fhir_query, aggregates=True)
+
+        assert result['count_method'] == 'streaming'
+        assert result['aggregates']['conditions'] == [{'condition': 'Asthma', 'patients': 1}]
@@ -0,0 +1,89 @@
+from datetime import date
+
+import pytest
+
+from app.services.cohort_frame import NO_BIRTH_DATE, CohortFrameBuilder, birth_day
+from app.tests.helpers import bundle, condition_entry, patient_entry
+
+
+TODAY = date(2026, 6, 1)
+
+
+@pytest.fixture
+def frame():
+    builder = CohortFrameBuilder()
+    builder.add_bundle(bundle([
+        condition_entry("p1", "Diabetes mellitus"),
+        condition_entry("p2", "Asthma"),
+        patient_entry("p1", "1976-03-02", "male"),   # 50
+        condition_entry("p1", "Hypertension"),
+    ]))
+    builder.add_bundle(bundle([
+        patient_entry("p2", "1986-01-01", "female"),  # 40
+        patient_entry("p3", "1966", "female"),        # 60, partial date
+        patient_entry("p4", "not-a-date", "other"),   # unknown age
+        condition_entry("p5", "Asthma"),              # Patient never seen
+    ]))
+    return builder.build()
+
+
+class TestCohortFrame:
+    """Test cases for the columnar cohort table"""
+
+    def test_birth_day(self):
+        assert birth_day("1970-01-02") == 1
+        assert birth_day("1971") == 365
+        assert birth_day("1970-13-40") == 0
+        assert birth_day("") == NO_BIRTH_DATE
+        assert birth_day("unknown") == NO_BIRTH_DATE
+
+    def test_rows_keep_first_seen_order_and_condition_order(self, frame):
+        patients = frame.to_dicts(range(len(frame)), today=TODAY)
+
+        assert [p['id'] for p in patients] == ["p1", "p2", "p3", "p4", "p5"]
+        assert patients[0] == {
+            'id': 'p1', 'name': 'Test p1', 'birthDate': '1976-03-02', 'age': 50, 'gender': 'male',
+            'conditions': ['Diabetes mellitus', 'Hypertension']
+        }
+        assert patients[3]['age'] is None
+        assert patients[4] == {'id': 'p5', 'conditions': ['Asthma']}
+
+    @pytest.mark.parametrize("operator,value,expected", [
+        ("gt", 50, ["p3", "p4", "p5"]),
+        ("ge", 50, ["p1", "p3", "p4", "p5"]),
+        ("lt", 50, ["p2", "p4", "p5"]),
+        ("le", 50, ["p1", "p2", "p4", "p5"]),
+    ])
+    def test_age_operators(self, frame, operator, value, expected):
+        rows = frame.filter({'age_filters': [{'operator': operator, 'value': value}]}, today=TODAY)
+
+        assert [frame.ids[row] for row in rows] == expected
+
+    def test_age_range_and_gender(self, frame):
+        filters = {
+            'age_filters': [{'operator': 'ge', 'value': 40}, {'operator': 'le', 'value': 60}],
+            'gender': {'value': 'female'}
+        }
+
+        assert [frame.ids[row] for row in frame.filter(filters, today=TODAY)] == ["p2", "p3", "p5"]
+
+    def test_pushed_down_filters_are_skipped(self, frame):
+        filters = {'age_filters': [{'operator': 'gt', 'value': 90, 'pushed_down': True}],
+                   'gender': {'value': 'male', 'pushed_down': True}}
+
+        assert len(frame.filter(filters)) == len(frame)
+
+    def test_filter_within_rows(self, frame):
+        rows = frame.filter({'gender': {'value': 'female'}}, rows=frame.rows_for(["p5", "p1", "p3"]))
+
+        assert [frame.ids[row] for row in rows] == ["p5", "p3"]
+
+    def test_patients_only_fills_known_rows(self):
+        builder = CohortFrameBuilder()
+        builder.add_condition("p1", "Asthma")
+        builder.add_bundle(bundle([patient_entry("p1", "1950-01-01", "male"), patient_entry("p2", "1950-01-01", "male"),
+                                   condition_entry("p1", "Asthma")]), patients_only=True)
+
+        assert builder.ids == ["p1"]
+        assert builder.missing_ids() == []
+        assert builder.build().conditions(0) == ["Asthma"]
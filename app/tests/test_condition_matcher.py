@@ -0,0 +1,206 @@
+import os
+import pickle
+import stat
+import pytest
+from unittest.mock import Mock
+
+from app.metrics import metrics
+from app.nlp.condition_matcher import ConditionMatcher, load_matcher
+from app.nlp.terminology_index import read_lexicon, words
+from app.nlp.fhir_nlp_service import FHIRQueryProcessor
+
+
+SCT = "http://snomed.info/sct"
+
+LEXICON = (
+    "# comment\n"
+    f"diabetes\t{SCT}\t73211009\tDiabetes mellitus\n"
+    f"type 2 diabetes\t{SCT}\t44054006\tDiabetes mellitus type 2\n"
+    f"heart failure\t{SCT}\t84114007\tHeart failure\n"
+    f"congestive heart failure\t{SCT}\t84114007\tHeart failure\n"
+    f"failure to thrive\t{SCT}\t54840006\tFailure to thrive\n"
+    f"Alzheimer's disease\t{SCT}\t26929004\tAlzheimer's disease\n"
+)
+
+
+@pytest.fixture
+def lexicon_path(tmp_path):
+    path = tmp_path / "conditions.tsv"
+    path.write_text(LEXICON)
+    return str(path)
+
+
+@pytest.fixture
+def matcher(lexicon_path):
+    return ConditionMatcher(read_lexicon(lexicon_path))
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+    yield
+
+
+class TestConditionMatcher:
+    """Test cases for the Aho-Corasick condition matcher"""
+
+    def test_multi_word_terms_match_leftmost_longest(self, matcher):
+        found = matcher.find(words("patients with type 2 diabetes and congestive heart failure"))
+
+        assert [term for _, _, term in found] == ['type 2 diabetes', 'congestive heart failure']
+
+    def test_overlapping_terms_resolve_leftmost(self, matcher):
+        # "failure to thrive" is reached through a failure link but overlaps the earlier match
+        found = matcher.find(words("heart failure to thrive"))
+
+        assert [term for _, _, term in found] == ['heart failure']
+
+    def test_match_inside_other_words_is_ignored(self, matcher):
+        assert matcher.find(words("prediabetes and nondiabetes")) == []
+
+    def test_punctuation_is_normalized(self, matcher):
+        codings = matcher.match(words("history of Alzheimer's disease"))
+
+        assert [c['code'] for c in codings] == ['26929004']
+
+    def test_codings_are_deduplicated(self, matcher):
+        codings = matcher.match(words("heart failure or congestive heart failure"))
+
+        assert codings == [{'system': SCT, 'code': '84114007', 'display': 'Heart failure'}]
+
+    def test_misspelled_words_are_corrected(self, matcher):
+        codings, corrections = matcher.match_with_corrections(words("patients with type 2 diabetis"))
+
+        assert [c['code'] for c in codings] == ['44054006']
+        assert corrections == [{'original': 'diabetis', 'corrected': 'diabetes', 'distance': 1, 'applied': True}]
+
+    def test_real_words_are_only_suggested(self, lexicon_path):
+        matcher = ConditionMatcher(read_lexicon(lexicon_path), real_words={'diabetic'})
+
+        codings, corrections = matcher.match_with_corrections(words("patients with type 2 diabetic"))
+
+        assert codings == []
+        assert corrections == [{'original': 'diabetic', 'corrected': 'diabetes', 'distance': 2, 'applied': False}]
+
+    def test_corrections_outside_matches_are_dropped(self, matcher):
+        codings, corrections = matcher.match_with_corrections(words("patients with failures"))
+
+        assert codings == []
+        assert corrections == []
+
+    def test_short_words_are_not_corrected(self, matcher):
+        codings, corrections = matcher.match_with_corrections(words("type 2 diabetes and hart"))
+
+        assert [c['code'] for c in codings] == ['44054006']
+        assert corrections == []
+
+    def test_malformed_lexicon_line(self, tmp_path):
+        path = tmp_path / "bad.tsv"
+        path.write_text("diabetes\t73211009\n")
+
+        with pytest.raises(ValueError, match="bad.tsv:1"):
+            read_lexicon(str(path))
+
+
+class TestMatcherCache:
+    """Test cases for the on-disk compiled matcher cache"""
+
+    def test_compiled_matcher_is_cached_and_reused(self, lexicon_path, tmp_path):
+        cache_dir = str(tmp_path / "cache")
+
+        first = load_matcher(lexicon_path, cache_dir)
+        second = load_matcher(lexicon_path, cache_dir)
+
+        assert sorted(os.path.splitext(name)[1] for name in os.listdir(cache_dir)) == ['.idx', '.pickle']
+        assert second.terms == first.terms
+        counters = metrics.snapshot()['counters']
+        assert counters['condition_matcher_cache_misses'] == 1
+        assert counters['condition_matcher_cache_hits'] == 1
+
+    def test_editing_lexicon_invalidates_cache(self, lexicon_path, tmp_path):
+        cache_dir = str(tmp_path / "cache")
+        load_matcher(lexicon_path, cache_dir)
+        with open(lexicon_path, 'a') as f:
+            f.write(f"asthma\t{SCT}\t195967001\tAsthma\n")
+
+        matcher = load_matcher(lexicon_path, cache_dir)
+
+        assert 'asthma' in matcher.terms
+        assert metrics.snapshot()['counters']['condition_matcher_cache_misses'] == 2
+
+    def test_cache_dir_is_private(self, lexicon_path, tmp_path):
+        cache_dir = tmp_path / "cache"
+
+        load_matcher(lexicon_path, str(cache_dir))
+
+        assert stat.S_IMODE(os.stat(cache_dir).st_mode) == 0o700
+
+    def test_cache_in_a_shared_dir_is_never_loaded(self, lexicon_path, tmp_path, monkeypatch):
+        cache_dir = tmp_path / "cache"
+        load_matcher(lexicon_path, str(cache_dir))
+        os.chmod(cache_dir, 0o777)
+        unpickle = Mock(wraps=pickle.load)
+        monkeypatch.setattr(pickle, 'load', unpickle)
+
+        matcher = load_matcher(lexicon_path, str(cache_dir))
+
+        assert 'diabetes' in matcher.terms
+        unpickle.assert_not_called()
+        assert 'condition_matcher_cache_hits' not in metrics.snapshot()['counters']
+
+    def test_corrupt_cache_is_rebuilt(self, lexicon_path, tmp_path):
+        cache_dir = tmp_path / "cache"
+        load_matcher(lexicon_path, str(cache_dir))
+        for name in os.listdir(cache_dir):
+            if name.endswith('.pickle'):
+                (cache_dir / name).write_bytes(b"not a pickle")
+
+        matcher = load_matcher(lexicon_path, str(cache_dir))
+
+        assert 'diabetes' in matcher.terms
+
+
+class TestProcessorConditions:
+    """Test cases for condition extraction against the bundled lexicon"""
+
+    @pytest.fixture
+    def processor(self):
+        return FHIRQueryProcessor(nlp=Mock())
+
+    @pytest.mark.parametrize("text,codes", [
+        ("patients with type 2 diabetes", ['44054006']),
+        ("patients with high blood pressure and heart failure", ['38341003', '84114007']),
+        ("patients with diabetes", ['73211009', 'E10-E14']),
+        ("copd patients over 60", ['13645005']),
+    ])
+    def test_bundled_lexicon(self, processor, text, codes):
+        result = processor.extract_conditions(text)
+
+        assert [c['code'] for c in result] == codes
+        assert all(c['search_param'] == f"code={c['system']}|{c['code']}" for c in result)
+
+    def test_build_reports_did_you_mean(self, processor):
+        result = processor.build_fhir_query("Patients with Hypertention and asthama")
+
+        assert '38341003' in result['fhir_url'] and '195967001' in result['fhir_url']
+        assert [c['corrected'] for c in result['corrections']] == ['hypertension', 'asthma']
+        assert result['did_you_mean'] == "Patients with hypertension and asthma"
+
+    @pytest.mark.parametrize("text,suggestion", [
+        ("patients with kidney stones", "patients with kidney strokes"),
+        ("patients with a cold", "patients with a copd"),
+    ])
+    def test_real_words_are_not_searched_corrected(self, processor, text, suggestion):
+        result = processor.build_fhir_query(text)
+
+        assert result['filters']['conditions'] == []
+        assert 'code=' not in result['fhir_url']
+        assert [c['applied'] for c in result['corrections']] == [False]
+        assert result['did_you_mean'] == suggestion
+        assert 'condition_spelling_corrections' not in metrics.snapshot()['counters']
+
+    def test_build_without_corrections(self, processor):
+        result = processor.build_fhir_query("patients with asthma")
+
+        assert result['corrections'] == []
+        assert result['did_you_mean'] is None
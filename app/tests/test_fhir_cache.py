@@ -0,0 +1,146 @@
+import pytest
+import httpx
+
+from app.metrics import metrics
+from app.services.fhir_cache import FHIRResponseCache, canonical_url, parse_ttls
+from app.tests.helpers import BASE_URL, FakeClock, make_client
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(clock):
+    return FHIRResponseCache(max_bytes=1000, ttls={'Patient': 100, 'Condition': 10}, default_ttl=5, clock=clock)
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+    yield
+
+
+class TestFHIRResponseCache:
+    """Test cases for the byte-bounded FHIR response cache"""
+
+    def test_canonical_url_sorts_parameters(self):
+        first = canonical_url(f"{BASE_URL}/Condition?code=http://snomed.info/sct|73211009&_count=50")
+        second = canonical_url(f"https://HAPI.fhir.org/baseR5/Condition/?_count=50&code=http://snomed.info/sct|73211009")
+
+        assert first == second
+
+    def test_parse_ttls(self):
+        assert parse_ttls("metadata:3600, Patient:600,") == {'metadata': 3600.0, 'Patient': 600.0}
+
+    def test_ttl_per_resource_type(self, cache):
+        assert cache.ttl_for(canonical_url(f"{BASE_URL}/Patient?gender=male")) == 100
+        assert cache.ttl_for(canonical_url(f"{BASE_URL}/Condition?code=x")) == 10
+        assert cache.ttl_for(canonical_url(f"{BASE_URL}/Observation")) == 5
+
+    def test_expiry(self, cache, clock):
+        key = canonical_url(f"{BASE_URL}/Condition")
+        cache.store(key, {'total': 1}, 10)
+
+        assert cache.is_fresh(cache.lookup(key))
+        clock.now += 11
+        assert not cache.is_fresh(cache.lookup(key))
+
+    def test_lru_eviction_by_bytes(self, cache):
+        cache.store('a', {}, 400)
+        cache.store('b', {}, 400)
+        cache.lookup('a')
+        cache.store('c', {}, 400)
+
+        assert cache.lookup('b') is None
+        assert cache.lookup('a') is not None
+        assert cache.total_bytes == 800
+        assert metrics.snapshot()['counters']['fhir_cache_evictions'] == 1
+
+    def test_oversized_and_no_store_responses_are_skipped(self, cache):
+        cache.store('big', {}, 5000)
+        cache.store('private', {}, 10, {'cache-control': 'no-store'})
+
+        assert len(cache) == 0
+
+
+class TestCachedFHIRClient:
+    """Test cases for cached and conditionally revalidated FHIR GETs"""
+
+    @pytest.mark.asyncio
+    async def test_repeat_request_is_served_from_cache(self, cache):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json={"resourceType": "Bundle", "total": 7})
+
+        client = make_client(handler, cache=cache)
+
+        first = await client.get_json(f"{BASE_URL}/Condition?b=2&a=1")
+        second = await client.get_json(f"{BASE_URL}/Condition?a=1&b=2")
+
+        assert first == second == {"resourceType": "Bundle", "total": 7}
+        assert len(calls) == 1
+        counters = metrics.snapshot()['counters']
+        assert counters['fhir_cache_misses'] == 1
+        assert counters['fhir_cache_hits'] == 1
+
+    @pytest.mark.asyncio
+    async def test_expired_entry_revalidates_with_304(self, cache, clock):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            if request.headers.get('If-None-Match') == '"v1"':
+                return httpx.Response(304, headers={'ETag': '"v1"'})
+            return httpx.Response(200, json={"total": 1},
+                                  headers={'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+
+        client = make_client(handler, cache=cache)
+        url = f"{BASE_URL}/Condition?code=x"
+
+        await client.get_json(url)
+        clock.now += 11
+        result = await client.get_json(url)
+
+        assert result == {"total": 1}
+        assert len(calls) == 2
+        assert calls[1].headers['If-Modified-Since'] == 'Mon, 01 Jan 2024 00:00:00 GMT'
+        assert metrics.snapshot()['counters']['fhir_cache_revalidations'] == 1
+        assert cache.is_fresh(cache.lookup(canonical_url(url)))
+
+    @pytest.mark.asyncio
+    async def test_expired_entry_replaced_when_changed(self, cache, clock):
+        versions = iter([{"total": 1}, {"total": 2}])
+
+        client = make_client(lambda request: httpx.Response(200, json=next(versions), headers={'ETag': '"v"'}),
+                             cache=cache)
+        url = f"{BASE_URL}/Condition?code=x"
+
+        await client.get_json(url)
+        clock.now += 11
+
+        assert await client.get_json(url) == {"total": 2}
+
+    @pytest.mark.asyncio
+    async def test_streamed_and_full_bodies_cached_separately(self, cache):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(200, json={"resourceType": "Bundle", "entry": [
+                {"resource": {"resourceType": "Patient", "id": "p1", "address": [{"city": "Boston"}]}}
+            ]})
+
+        client = make_client(handler, cache=cache)
+        url = f"{BASE_URL}/Patient"
+
+        full = await client.get_json(url)
+        projected = await client.get_bundle_streaming(url)
+        await client.get_bundle_streaming(url)
+
+        assert 'address' in full['entry'][0]['resource']
+        assert 'address' not in projected['entry'][0]['resource']
+        assert len(calls) == 2
@@ -0,0 +1,356 @@
+import pytest
+import asyncio
+import json
+import httpx
+from unittest.mock import Mock
+
+from app.config import Config
+from app.nlp.query_planner import supports_batch
+from app.services.fhir_cache import FHIRResponseCache
+from app.services.fhir_client import FHIRClient, FHIRServerError, create_http_client, split_base, FHIR_JSON_HEADERS
+from app.services.fhir_paging import SearchPager
+
+
+BASE_URL = "https://hapi.fhir.org/baseR5"
+
+
+def make_client(handler, **kwargs) -> FHIRClient:
+    """FHIRClient backed by an in-memory transport"""
+    return FHIRClient(httpx.AsyncClient(transport=httpx.MockTransport(handler), headers=FHIR_JSON_HEADERS), **kwargs)
+
+
+class TestFHIRClient:
+    """Test cases for the pooled async FHIR client"""
+
+    def test_create_http_client_configuration(self):
+        """Test that the shared client carries timeouts, pool limits and FHIR headers"""
+        client = create_http_client()
+
+        assert client.timeout.connect is not None
+        assert client.timeout.read is not None
+        assert client.headers['Accept'] == 'application/fhir+json'
+        asyncio.run(client.aclose())
+
+    @pytest.mark.asyncio
+    async def test_get_json_success(self):
+        """Test decoding a FHIR JSON response"""
+        handler = Mock(return_value=httpx.Response(200, json={"resourceType": "Bundle", "total": 3}))
+        client = make_client(handler)
+
+        result = await client.get_json(f"{BASE_URL}/Condition")
+
+        assert result == {"resourceType": "Bundle", "total": 3}
+        request = handler.call_args[0][0]
+        assert request.headers['Accept'] == 'application/fhir+json'
+
+    @pytest.mark.asyncio
+    async def test_get_json_http_error(self):
+        """Test that upstream error statuses surface as FHIRServerError"""
+        client = make_client(lambda request: httpx.Response(503, text="unavailable"))
+
+        with pytest.raises(FHIRServerError, match="FHIR server error") as exc_info:
+            await client.get_json(f"{BASE_URL}/Condition")
+
+        assert exc_info.value.status_code == 503
+
+    @pytest.mark.asyncio
+    async def test_get_json_timeout(self):
+        """Test that transport timeouts surface as FHIRServerError"""
+        def handler(request):
+            raise httpx.ReadTimeout("timed out", request=request)
+
+        client = make_client(handler)
+
+        with pytest.raises(FHIRServerError, match="timed out"):
+            await client.get_json(f"{BASE_URL}/Condition")
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_overlap(self):
+        """Test that concurrent calls overlap their upstream I/O"""
+        in_flight = 0
+        peak = 0
+
+        async def handler(request):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return httpx.Response(200, json={"resourceType": "Bundle"})
+
+        client = make_client(handler)
+
+        await asyncio.gather(*(client.get_json(f"{BASE_URL}/Condition?n={i}") for i in range(5)))
+
+        assert peak == 5
+
+    @pytest.mark.asyncio
+    async def test_per_host_connection_limit(self):
+        """Test that requests to one host are capped at max_connections_per_host"""
+        in_flight = 0
+        peak = 0
+
+        async def handler(request):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return httpx.Response(200, json={})
+
+        client = make_client(handler, max_connections_per_host=2)
+
+        await asyncio.gather(*(client.get_json(f"{BASE_URL}/Patient/{i}") for i in range(6)))
+
+        assert peak == 2
+
+
+class TestSingleFlight:
+    """Test cases for coalescing concurrent identical FHIR requests"""
+
+    @staticmethod
+    def slow_handler(calls, response=None, release=None):
+        async def handler(request):
+            calls.append(request)
+            if release is not None:
+                await release.wait()
+            else:
+                await asyncio.sleep(0.01)
+            return response or httpx.Response(200, json={"resourceType": "Bundle", "total": 1})
+        return handler
+
+    @pytest.mark.asyncio
+    async def test_identical_requests_share_one_upstream_call(self):
+        from app.metrics import metrics
+        metrics.reset()
+        calls = []
+        client = make_client(self.slow_handler(calls))
+
+        results = await asyncio.gather(*(
+            client.get_json(f"{BASE_URL}/Condition?code=x&_count=50") for _ in range(3)
+        ), client.get_json(f"{BASE_URL}/Condition?_count=50&code=x"))
+
+        assert len(calls) == 1
+        assert all(result == {"resourceType": "Bundle", "total": 1} for result in results)
+        assert metrics.snapshot()['counters']['fhir_requests_coalesced'] == 3
+        assert client._in_flight == {}
+
+    @pytest.mark.asyncio
+    async def test_failure_propagates_to_every_waiter(self):
+        calls = []
+        client = make_client(self.slow_handler(calls, httpx.Response(502, text="bad gateway")))
+
+        results = await asyncio.gather(
+            *(client.get_json(f"{BASE_URL}/Condition") for _ in range(3)), return_exceptions=True
+        )
+
+        assert len(calls) == 1
+        assert all(isinstance(result, FHIRServerError) for result in results)
+        assert all(result.status_code == 502 for result in results)
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_does_not_cancel_others(self):
+        calls = []
+        release = asyncio.Event()
+        client = make_client(self.slow_handler(calls, release=release))
+
+        first = asyncio.ensure_future(client.get_json(f"{BASE_URL}/Condition"))
+        second = asyncio.ensure_future(client.get_json(f"{BASE_URL}/Condition"))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await second == {"resourceType": "Bundle", "total": 1}
+        assert first.cancelled()
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_upstream_request_abandoned_when_all_waiters_cancel(self):
+        calls = []
+        release = asyncio.Event()
+        client = make_client(self.slow_handler(calls, release=release))
+
+        waiter = asyncio.ensure_future(client.get_json(f"{BASE_URL}/Condition"))
+        await asyncio.sleep(0.01)
+        flight = client._in_flight[next(iter(client._in_flight))]
+        waiter.cancel()
+        await asyncio.sleep(0.01)
+
+        assert flight.task.cancelled()
+        assert client._in_flight == {}
+
+    @pytest.mark.asyncio
+    async def test_caller_joining_after_last_waiter_cancels_gets_a_new_flight(self):
+        calls = []
+        release = asyncio.Event()
+        client = make_client(self.slow_handler(calls, release=release))
+
+        waiter = asyncio.ensure_future(client.get_json(f"{BASE_URL}/Condition"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        # The waiter has abandoned the flight, which has not landed yet
+        assert waiter.cancelled()
+        joiner = asyncio.ensure_future(client.get_json(f"{BASE_URL}/Condition"))
+        await asyncio.sleep(0.01)
+        release.set()
+
+        assert await joiner == {"resourceType": "Bundle", "total": 1}
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_later_requests_start_a_new_flight(self):
+        calls = []
+        client = make_client(self.slow_handler(calls))
+
+        await client.get_json(f"{BASE_URL}/Condition")
+        await client.get_json(f"{BASE_URL}/Condition")
+
+        assert len(calls) == 2
+
+
+class BatchServer:
+    """Answers batch Bundles and plain GETs, echoing each search URL back as a Bundle id"""
+
+    def __init__(self, post_status=200, failing=()):
+        self.requests = []
+        self.post_status = post_status
+        self.failing = set(failing)
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if request.method == 'POST':
+            if self.post_status != 200:
+                return httpx.Response(self.post_status)
+            batch = json.loads(request.content)
+            assert batch['type'] == 'batch'
+            entries = []
+            for entry in batch['entry']:
+                url = entry['request']['url']
+                if url in self.failing:
+                    entries.append({"response": {"status": "404 Not Found"}})
+                else:
+                    entries.append({"resource": {"resourceType": "Bundle", "id": url},
+                                    "response": {"status": "200 OK", "etag": 'W/"1"'}})
+            return httpx.Response(200, json={"resourceType": "Bundle", "type": "batch-response", "entry": entries})
+        url = str(request.url).split('/baseR5/', 1)[1]
+        return httpx.Response(200, json={"resourceType": "Bundle", "id": url})
+
+
+class TestBatch:
+    """Test cases for combining searches into one batch Bundle"""
+
+    URLS = [f"{BASE_URL}/Patient?_id=p1", f"{BASE_URL}/Patient?_id=p2", f"{BASE_URL}/Condition?code=x"]
+
+    @pytest.fixture
+    def batch_mode(self, monkeypatch):
+        monkeypatch.setattr(Config, 'FHIR_BATCH_MODE', 'auto')
+        monkeypatch.setattr(Config, 'FHIR_BATCH_MIN_RTT_MS', 50)
+
+    def test_split_base(self):
+        assert split_base(f"{BASE_URL}/Patient?_id=a,b") == (BASE_URL, "Patient?_id=a,b")
+        assert split_base(f"{BASE_URL}/metadata") == (BASE_URL, "metadata")
+        paging_url = f"{BASE_URL}?_getpages=abc&_getpagesoffset=10"
+        assert split_base(paging_url, [BASE_URL]) == (BASE_URL, "?_getpages=abc&_getpagesoffset=10")
+        assert split_base(f"{BASE_URL}/Patient?_id=a", [BASE_URL]) == (BASE_URL, "Patient?_id=a")
+
+    @pytest.mark.asyncio
+    async def test_pager_batches_getpages_links(self, batch_mode):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            if request.method == 'POST':
+                entries = [{"resource": {"resourceType": "Bundle", "entry": [{"resource": {"id": entry['request']['url']}}]},
+                            "response": {"status": "200 OK"}}
+                           for entry in json.loads(request.content)['entry']]
+                return httpx.Response(200, json={"resourceType": "Bundle", "type": "batch-response", "entry": entries})
+            return httpx.Response(200, json={
+                "resourceType": "Bundle", "total": 3, "entry": [{"resource": {"id": "first"}}],
+                "link": [{"relation": "next", "url": f"{BASE_URL}?_getpages=abc&_getpagesoffset=1&_count=1"}]
+            })
+
+        client = make_client(handler)
+        client.set_batch_support(BASE_URL, True)
+        client._record_rtt(BASE_URL, 0.5)
+        pager = SearchPager(client, f"{BASE_URL}/Condition?_count=1", concurrency=2, streaming=False)
+
+        pages = [page async for page in pager]
+
+        assert [r.method for r in requests] == ['GET', 'POST']
+        assert str(requests[1].url) == BASE_URL
+        assert [page['entry'][0]['resource']['id'] for page in pages[1:]] == [
+            "?_getpages=abc&_count=1&_getpagesoffset=1", "?_getpages=abc&_count=1&_getpagesoffset=2"
+        ]
+
+    def test_supports_batch(self):
+        statement = {"rest": [{"mode": "server", "interaction": [{"code": "transaction"}, {"code": "batch"}]}]}
+
+        assert supports_batch(statement)
+        assert not supports_batch({"rest": [{"mode": "server", "interaction": [{"code": "transaction"}]}]})
+
+    def test_batches_only_declared_servers_with_high_rtt(self, batch_mode):
+        client = make_client(BatchServer())
+
+        assert not client.should_batch(self.URLS)
+        client.set_batch_support(BASE_URL, True)
+        assert not client.should_batch(self.URLS)  # RTT not measured yet
+        client._record_rtt(BASE_URL, 0.01)
+        assert not client.should_batch(self.URLS)
+        client._record_rtt(BASE_URL, 0.5)
+        assert client.should_batch(self.URLS)
+        assert not client.should_batch(self.URLS[:1])
+        assert not client.should_batch([self.URLS[0], "https://other.example/fhir/Patient"])
+
+    @pytest.mark.asyncio
+    async def test_get_many_sends_one_batch_and_demultiplexes(self, monkeypatch):
+        monkeypatch.setattr(Config, 'FHIR_BATCH_MODE', 'always')
+        server = BatchServer()
+        client = make_client(server, cache=FHIRResponseCache())
+        client.set_batch_support(BASE_URL, True)
+
+        results = await client.get_many(self.URLS)
+
+        assert [r['id'] for r in results] == ["Patient?_id=p1", "Patient?_id=p2", "Condition?code=x"]
+        assert len(server.requests) == 1
+        assert server.requests[0].method == 'POST'
+        assert str(server.requests[0].url) == BASE_URL
+        # Entries are cached, so a later GET of the same search needs no round trip
+        assert (await client.get_json(self.URLS[1]))['id'] == "Patient?_id=p2"
+        assert len(server.requests) == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_entry(self, monkeypatch):
+        monkeypatch.setattr(Config, 'FHIR_BATCH_MODE', 'always')
+        client = make_client(BatchServer(failing={"Patient?_id=p2"}))
+        client.set_batch_support(BASE_URL, True)
+
+        results = await client.get_many(self.URLS, return_exceptions=True)
+        assert isinstance(results[1], FHIRServerError) and results[1].status_code == 404
+        assert results[0]['id'] == "Patient?_id=p1"
+
+        with pytest.raises(FHIRServerError):
+            await client.get_many(self.URLS)
+
+    @pytest.mark.asyncio
+    async def test_rejected_batch_falls_back_to_parallel_gets(self, monkeypatch):
+        monkeypatch.setattr(Config, 'FHIR_BATCH_MODE', 'always')
+        server = BatchServer(post_status=405)
+        client = make_client(server)
+
+        results = await client.get_many(self.URLS)
+
+        assert [r['id'] for r in results] == ["Patient?_id=p1", "Patient?_id=p2", "Condition?code=x"]
+        assert [r.method for r in server.requests] == ['POST', 'GET', 'GET', 'GET']
+        assert client.batch_support[BASE_URL] is False
+        assert not client.should_batch(self.URLS)
+
+    @pytest.mark.asyncio
+    async def test_parallel_gets_without_batch_support(self, batch_mode):
+        server = BatchServer()
+        client = make_client(server)
+
+        await client.get_many(self.URLS)
+
+        assert [r.method for r in server.requests] == ['GET', 'GET', 'GET']
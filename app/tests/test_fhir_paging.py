@@ -0,0 +1,154 @@
+import pytest
+import httpx
+from unittest.mock import Mock
+
+from app.nlp.fhir_nlp_service import FHIRQueryProcessor
+from app.services.fhir_paging import SearchPager, get_query_param, set_query_param, get_link
+from app.tests.helpers import BASE_URL, bundle, condition_entry, make_client, patient_entry
+
+
+async def collect(pager):
+    return [page async for page in pager]
+
+
+class TestQueryParams:
+    """Test cases for URL query helpers"""
+
+    def test_set_query_param_keeps_search_values_readable(self):
+        url = set_query_param(f"{BASE_URL}/Condition?code=http://snomed.info/sct|73211009", "_count", 50)
+
+        assert get_query_param(url, "_count") == "50"
+        assert "code=http://snomed.info/sct|73211009" in url
+
+    def test_set_query_param_replaces_existing(self):
+        url = set_query_param(f"{BASE_URL}/Condition?_count=10", "_count", 50)
+
+        assert url.count("_count") == 1
+        assert get_query_param(url, "_count") == "50"
+
+    def test_get_link(self):
+        assert get_link(bundle([], next_url="next-page"), "next") == "next-page"
+        assert get_link(bundle([]), "next") is None
+
+
+class TestSearchPager:
+    """Test cases for the FHIR Bundle paging engine"""
+
+    @pytest.mark.asyncio
+    async def test_adds_count_parameter(self):
+        handler = Mock(return_value=httpx.Response(200, json=bundle([])))
+        pager = SearchPager(make_client(handler), f"{BASE_URL}/Condition", page_size=25)
+
+        await collect(pager)
+
+        request = handler.call_args[0][0]
+        assert request.url.params["_count"] == "25"
+
+    @pytest.mark.asyncio
+    async def test_follows_next_links(self):
+        pages = {
+            "1": bundle([condition_entry("a")], next_url=f"{BASE_URL}?page=2"),
+            "2": bundle([condition_entry("b")], next_url=f"{BASE_URL}?page=3"),
+            "3": bundle([condition_entry("c")]),
+        }
+
+        def handler(request):
+            return httpx.Response(200, json=pages[request.url.params.get("page", "1")])
+
+        pager = SearchPager(make_client(handler), f"{BASE_URL}/Condition")
+        result = await collect(pager)
+
+        assert len(result) == 3
+        assert pager.stats() == {'pages_fetched': 3, 'resources_fetched': 3, 'total': None, 'truncated': False}
+
+    @pytest.mark.asyncio
+    async def test_fetches_offset_pages_concurrently(self):
+        requested_offsets = []
+
+        def handler(request):
+            offset = request.url.params.get("_getpagesoffset")
+            if offset is None:
+                return httpx.Response(200, json=bundle(
+                    [condition_entry("p0")],
+                    next_url=f"{BASE_URL}?_getpages=abc&_getpagesoffset=1&_count=1",
+                    total=4
+                ))
+            requested_offsets.append(int(offset))
+            return httpx.Response(200, json=bundle([condition_entry(f"p{offset}")]))
+
+        pager = SearchPager(make_client(handler), f"{BASE_URL}/Condition", concurrency=3)
+        result = await collect(pager)
+
+        assert len(result) == 4
+        assert sorted(requested_offsets) == [1, 2, 3]
+        assert pager.truncated is False
+
+    @pytest.mark.asyncio
+    async def test_max_pages_budget(self):
+        def handler(request):
+            page = int(request.url.params.get("page", "1"))
+            return httpx.Response(200, json=bundle([condition_entry(str(page))], next_url=f"{BASE_URL}?page={page + 1}"))
+
+        pager = SearchPager(make_client(handler), f"{BASE_URL}/Condition", max_pages=2)
+        result = await collect(pager)
+
+        assert len(result) == 2
+        assert pager.truncated is True
+
+    @pytest.mark.asyncio
+    async def test_max_pages_budget_offset_paging(self):
+        def handler(request):
+            if "_getpagesoffset" not in request.url.params:
+                return httpx.Response(200, json=bundle(
+                    [], next_url=f"{BASE_URL}?_getpages=abc&_getpagesoffset=10&_count=10", total=100
+                ))
+            return httpx.Response(200, json=bundle([]))
+
+        pager = SearchPager(make_client(handler), f"{BASE_URL}/Condition", max_pages=3)
+        result = await collect(pager)
+
+        assert len(result) == 3
+        assert pager.truncated is True
+
+    @pytest.mark.asyncio
+    async def test_max_resources_budget(self):
+        def handler(request):
+            page = int(request.url.params.get("page", "1"))
+            entries = [condition_entry(f"{page}-{i}") for i in range(5)]
+            return httpx.Response(200, json=bundle(entries, next_url=f"{BASE_URL}?page={page + 1}"))
+
+        pager = SearchPager(make_client(handler), f"{BASE_URL}/Condition", max_resources=8)
+        result = await collect(pager)
+
+        assert len(result) == 2
+        assert pager.truncated is True
+
+
+class TestProcessFHIRPages:
+    """Test cases for incremental page merging in the processor"""
+
+    @pytest.fixture
+    def processor(self):
+        return FHIRQueryProcessor(nlp=Mock())
+
+    @pytest.mark.asyncio
+    async def test_merges_condition_and_patient_across_pages(self, processor):
+        pages = {
+            "1": bundle([condition_entry("patient-1")], next_url=f"{BASE_URL}?page=2"),
+            "2": bundle([patient_entry("patient-1"), condition_entry("patient-2", "Asthma")]),
+        }
+
+        def handler(request):
+            return httpx.Response(200, json=pages[request.url.params.get("page", "1")])
+
+        processor.fhir_client = make_client(handler)
+        pages_iter = processor.search_pages(f"{BASE_URL}/Condition", streaming=False)
+        result = await processor.process_fhir_pages(pages_iter, {'age_filters': []})
+
+        assert result['total_patients'] == 2
+        patients = {patient['id']: patient for patient in result['patients']}
+        assert patients['patient-1']['conditions'] == ['Diabetes mellitus']
+        assert patients['patient-1']['name'] == 'Test patient-1'
+        assert patients['patient-2']['conditions'] == ['Asthma']
+        assert result['paging']['pages_fetched'] == 2
+        assert result['raw_fhir_response'] == pages["1"]
@@ -0,0 +1,147 @@
+import json
+import pytest
+import httpx
+
+from app.services.fhir_client import FHIRClient, FHIRServerError
+from app.services.fhir_stream import BundleStreamParser, project_resource
+
+
+BASE_URL = "https://hapi.fhir.org/baseR5"
+
+
+@pytest.fixture
+def full_bundle():
+    """Searchset Bundle with the noise real servers send alongside the fields we use"""
+    return {
+        "resourceType": "Bundle",
+        "id": "bundle-1",
+        "meta": {"lastUpdated": "2024-01-01T00:00:00Z"},
+        "type": "searchset",
+        "total": 12345,
+        "link": [{"relation": "next", "url": f"{BASE_URL}?_getpages=abc&_getpagesoffset=2"}],
+        "entry": [
+            {
+                "fullUrl": f"{BASE_URL}/Condition/c1",
+                "resource": {
+                    "resourceType": "Condition",
+                    "id": "c1",
+                    "text": {"status": "generated", "div": "<div>" + "x" * 500 + "</div>"},
+                    "subject": {"reference": "Patient/p1", "display": "John Doe"},
+                    "code": {"coding": [
+                        {"system": "http://snomed.info/sct", "code": "73211009", "display": "Diabetes mellitus"},
+                        {"system": "http://hl7.org/fhir/sid/icd-10", "code": "E11", "display": "Type 2 diabetes"}
+                    ]},
+                    "extension": [{"url": "http://example.org/ext", "valueString": "ignored"}]
+                },
+                "search": {"mode": "match"}
+            },
+            {
+                "resource": {
+                    "resourceType": "Patient",
+                    "id": "p1",
+                    "identifier": [{"value": "MRN-1"}],
+                    "name": [{"given": ["John", "Q"], "family": "Doe"}, {"given": ["Johnny"]}],
+                    "birthDate": "1960-05-15",
+                    "gender": "male",
+                    "address": [{"city": "Springfield"}]
+                },
+                "search": {"mode": "include"}
+            }
+        ]
+    }
+
+
+class TestBundleStreamParser:
+    """Test cases for incremental, selective Bundle decoding"""
+
+    def test_project_condition(self, full_bundle):
+        projected = project_resource(full_bundle["entry"][0]["resource"])
+
+        assert projected == {
+            "resourceType": "Condition",
+            "id": "c1",
+            "subject": {"reference": "Patient/p1"},
+            "code": {"coding": [{"display": "Diabetes mellitus"}]}
+        }
+
+    def test_project_patient(self, full_bundle):
+        projected = project_resource(full_bundle["entry"][1]["resource"])
+
+        assert projected == {
+            "resourceType": "Patient",
+            "id": "p1",
+            "name": [{"given": ["John"], "family": "Doe"}],
+            "birthDate": "1960-05-15",
+            "gender": "male"
+        }
+
+    @pytest.mark.parametrize("chunk_size", [1, 7, 64, 100000])
+    def test_feed_in_chunks(self, full_bundle, chunk_size):
+        """Test that entries and envelope survive arbitrary chunk boundaries"""
+        payload = json.dumps(full_bundle).encode()
+        parser = BundleStreamParser()
+
+        resources = []
+        for start in range(0, len(payload), chunk_size):
+            resources.extend(parser.feed(payload[start:start + chunk_size]))
+        resources.extend(parser.close())
+
+        assert [r["id"] for r in resources] == ["c1", "p1"]
+        assert parser.entry_count == 2
+        assert parser.envelope["total"] == 12345
+        assert parser.envelope["link"][0]["relation"] == "next"
+        assert "entry" not in parser.envelope
+
+    def test_multibyte_characters_split_across_chunks(self):
+        payload = json.dumps({"resourceType": "Bundle", "entry": [
+            {"resource": {"resourceType": "Patient", "id": "p1", "name": [{"family": "Muñoz"}]}}
+        ]}, ensure_ascii=False).encode()
+        parser = BundleStreamParser()
+
+        resources = []
+        for byte in range(len(payload)):
+            resources.extend(parser.feed(payload[byte:byte + 1]))
+        resources.extend(parser.close())
+
+        assert resources[0]["name"][0]["family"] == "Muñoz"
+
+    def test_truncated_stream(self, full_bundle):
+        payload = json.dumps(full_bundle).encode()
+        parser = BundleStreamParser()
+        parser.feed(payload[:len(payload) // 2])
+
+        with pytest.raises(ValueError, match="Truncated|Malformed"):
+            parser.close()
+
+    def test_not_an_object(self):
+        with pytest.raises(ValueError):
+            BundleStreamParser().feed(b'[1, 2]')
+
+
+class TestStreamingClient:
+    """Test cases for streaming Bundle fetches"""
+
+    @pytest.mark.asyncio
+    async def test_get_bundle_streaming(self, full_bundle):
+        client = FHIRClient(httpx.AsyncClient(transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, json=full_bundle)
+        )))
+
+        bundle = await client.get_bundle_streaming(f"{BASE_URL}/Condition")
+
+        assert bundle["resourceType"] == "Bundle"
+        assert bundle["total"] == 12345
+        assert len(bundle["entry"]) == 2
+        assert "text" not in bundle["entry"][0]["resource"]
+        assert "meta" in bundle
+
+    @pytest.mark.asyncio
+    async def test_streaming_http_error(self):
+        client = FHIRClient(httpx.AsyncClient(transport=httpx.MockTransport(
+            lambda request: httpx.Response(500, text="boom")
+        )))
+
+        with pytest.raises(FHIRServerError) as exc_info:
+            await client.get_bundle_streaming(f"{BASE_URL}/Condition")
+
+        assert exc_info.value.status_code == 500
@@ -0,0 +1,54 @@
+import pytest
+
+from app.metrics import metrics
+from app.services.memo_cache import MemoCache
+from app.tests.helpers import FakeClock
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+    yield
+
+
+class TestMemoCache:
+    """Test cases for the entry-bounded memo LRU"""
+
+    def test_hits_and_misses_are_counted_per_layer(self):
+        cache = MemoCache('plan_cache', max_entries=4)
+        cache.put('a', 1)
+
+        assert cache.get('a') == 1
+        assert cache.get('b') is None
+        snapshot = metrics.snapshot()
+        assert snapshot['counters']['plan_cache_hits'] == 1
+        assert snapshot['counters']['plan_cache_misses'] == 1
+        assert snapshot['hit_rates']['plan_cache'] == 0.5
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = MemoCache('memo', max_entries=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+
+        assert 'b' not in cache
+        assert 'a' in cache and 'c' in cache
+        assert metrics.snapshot()['counters']['memo_evictions'] == 1
+
+    def test_entries_expire(self):
+        clock = FakeClock()
+        cache = MemoCache('memo', max_entries=2, ttl=10, clock=clock)
+        cache.put('a', 1)
+
+        clock.now += 11
+
+        assert 'a' not in cache
+        assert cache.get('a') is None
+        assert len(cache) == 0
+
+    def test_zero_entries_disables_the_cache(self):
+        cache = MemoCache('memo', max_entries=0)
+        cache.put('a', 1)
+
+        assert len(cache) == 0
@@ -44,7 +44,7 @@ class TestModels:
         self.app_context = self.app.app_context()
         self.app_context.push()
         """Test successful health check with database connected"""
-        with patch('app.main.get_session', return_value=mock_db), \
+        with patch('app.database.db_engine.get_session', return_value=mock_db), \
             patch('app.models.test_db_connection', AsyncMock(return_value=True)):
             stmt = select(UserModel).all()
             result = db.execute(stmt)
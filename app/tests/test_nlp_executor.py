@@ -0,0 +1,106 @@
+import pytest
+import asyncio
+import threading
+from unittest.mock import Mock
+
+from app.metrics import metrics
+from app.nlp import executor as executor_module
+from app.nlp.executor import NLPExecutor, NLPQueueFull
+from app.nlp.fhir_nlp_service import FHIRQueryProcessor
+
+
+class TestNLPExecutor:
+    """Test cases for running the NLP stage off the event loop"""
+
+    @pytest.fixture
+    def processor(self):
+        return FHIRQueryProcessor(nlp=Mock())
+
+    @pytest.fixture(autouse=True)
+    def reset_metrics(self):
+        metrics.reset()
+        yield
+
+    def test_unknown_mode(self, processor):
+        with pytest.raises(ValueError, match="Unknown NLP executor mode"):
+            NLPExecutor(processor, mode="gpu")
+
+    @pytest.mark.asyncio
+    async def test_inline_mode(self, processor):
+        executor = NLPExecutor(processor, mode="inline")
+
+        result = await executor.build_fhir_query("patients with asthma")
+
+        assert '195967001' in result['fhir_url']
+        assert 'nlp_queue_wait_ms' not in metrics.snapshot()['timings']
+
+    @pytest.mark.asyncio
+    async def test_plan_cache_counts_each_lookup_once(self, processor):
+        executor = NLPExecutor(processor, mode="inline")
+
+        await executor.build_fhir_query("patients with asthma")
+        await executor.build_fhir_query("Patients with asthma?")
+
+        counters = metrics.snapshot()['counters']
+        assert counters['plan_cache_misses'] == 1
+        assert counters['plan_cache_hits'] == 1
+
+    @pytest.mark.asyncio
+    async def test_thread_mode_runs_off_the_loop(self, processor):
+        loop_thread = threading.get_ident()
+        seen_threads = []
+        original = processor.parse_fhir_query
+
+        def parse(text):
+            seen_threads.append(threading.get_ident())
+            return original(text)
+
+        processor.parse_fhir_query = parse
+        executor = NLPExecutor(processor, mode="thread", workers=2)
+
+        result = await executor.build_fhir_query("patients with diabetes")
+        executor.shutdown()
+
+        assert '73211009' in result['fhir_url']
+        assert seen_threads and seen_threads[0] != loop_thread
+        assert metrics.snapshot()['timings']['nlp_queue_wait_ms']['count'] == 1
+        assert executor.pending == 0
+
+    @pytest.mark.asyncio
+    async def test_thread_mode_batch(self, processor):
+        processor.nlp.pipe = Mock(side_effect=RuntimeError("no pipe"))
+        executor = NLPExecutor(processor, mode="thread", workers=1)
+
+        result = await executor.build_fhir_queries(["asthma", "diabetes"], batch_size=4)
+        executor.shutdown()
+
+        assert len(result) == 2
+
+    @pytest.mark.asyncio
+    async def test_queue_full_rejects(self, processor):
+        release = threading.Event()
+        processor.parse_fhir_query = Mock(side_effect=lambda text: release.wait(5) and {'fhir_url': text})
+        executor = NLPExecutor(processor, mode="thread", workers=1, max_queue=1)
+
+        running = [asyncio.ensure_future(executor.build_fhir_query(f"q{i}")) for i in range(2)]
+        await asyncio.sleep(0.01)
+
+        with pytest.raises(NLPQueueFull) as exc_info:
+            await executor.build_fhir_query("q3")
+
+        release.set()
+        await asyncio.gather(*running)
+        executor.shutdown()
+
+        assert exc_info.value.retry_after >= 1
+        assert metrics.snapshot()['counters']['nlp_queue_rejected'] == 1
+        assert executor.pending == 0
+
+    def test_process_worker_uses_preloaded_processor(self, processor):
+        """Test the function process-pool workers run against their preloaded processor"""
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr(executor_module, '_worker_processor', processor)
+            result, queue_wait = executor_module._run_in_worker('parse_fhir_query', 0.0, "patients with asthma")
+
+        assert '195967001' in result['fhir_url']
+        assert queue_wait > 0
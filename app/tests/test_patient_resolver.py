@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+import httpx
+from unittest.mock import Mock
+
+from app.metrics import metrics
+from app.nlp.fhir_nlp_service import FHIRQueryProcessor
+from app.services.cohort_frame import CohortFrameBuilder
+from app.services.patient_resolver import PatientResolver
+from app.tests.helpers import bundle, condition_entry, make_processor, patient_entry
+
+
+BIRTH_DATES = {"p1": "1940-01-01", "p2": "2000-01-01", "p3": "1950-06-01", "p4": "1990-01-01"}
+
+
+class FakePatientServer:
+    """Answers `Patient?_id=` searches over BIRTH_DATES and tracks concurrency"""
+
+    def __init__(self, delay=0.0):
+        self.requests = []
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        ids = request.url.params['_id'].split(',')
+        entries = [patient_entry(patient_id, BIRTH_DATES[patient_id]) for patient_id in ids if patient_id in BIRTH_DATES]
+        return httpx.Response(200, json=bundle(entries))
+
+
+def condition_rows(patient_ids) -> CohortFrameBuilder:
+    builder = CohortFrameBuilder()
+    for patient_id in patient_ids:
+        builder.add_condition(patient_id, "Diabetes mellitus")
+    return builder
+
+
+class TestPatientResolver:
+    """Test cases for batched `_id` resolution of patients missing from a search"""
+
+    def test_missing_ids(self):
+        builder = condition_rows(["p1", "p2"])
+        builder.add_patient("p2", "Test", "", "unknown")
+
+        assert builder.missing_ids() == ["p1"]
+
+    def test_urls_are_chunked_with_one_page_each(self):
+        processor = FHIRQueryProcessor(nlp=Mock())
+        urls = PatientResolver(processor, chunk_size=2).urls(["p1", "p2", "p3"])
+
+        assert len(urls) == 2
+        assert "_id=p1,p2" in urls[0] and "_count=2" in urls[0]
+        assert "_id=p3" in urls[1] and "_count=1" in urls[1]
+
+    @pytest.mark.asyncio
+    async def test_resolves_only_the_given_ids(self):
+        server = FakePatientServer()
+        processor = make_processor(server)
+        builder = condition_rows(["p1", "p2"])
+
+        assert await PatientResolver(processor).resolve(builder, ["p2"]) == 1
+        assert server.requests[0].url.params['_id'] == "p2"
+        assert builder.missing_ids() == ["p1"]
+
+    @pytest.mark.asyncio
+    async def test_resolves_in_bounded_concurrent_chunks(self):
+        server = FakePatientServer(delay=0.01)
+        processor = make_processor(server)
+        builder = condition_rows(["p1", "p2", "p3", "p4", "p9"])
+        metrics.reset()
+
+        resolved = await PatientResolver(processor, chunk_size=1, concurrency=2).resolve(builder)
+
+        assert resolved == 4
+        assert len(server.requests) == 5
+        assert server.max_in_flight == 2
+        patients = {patient['id']: patient for patient in builder.build().to_dicts(range(5))}
+        assert patients["p1"]["birthDate"] == "1940-01-01"
+        assert patients["p1"]["conditions"] == ["Diabetes mellitus"]
+        assert "gender" not in patients["p9"]
+        assert metrics.snapshot()["counters"]["patient_resolver_unresolved"] == 1
+
+    @pytest.mark.asyncio
+    async def test_nothing_missing_makes_no_requests(self):
+        server = FakePatientServer()
+        processor = make_processor(server)
+        builder = condition_rows(["p1"])
+        builder.add_patient("p1", "Test", "1940-01-01", "female")
+
+        assert await PatientResolver(processor).resolve(builder) == 0
+        assert server.requests == []
+
+    @pytest.mark.asyncio
+    async def test_age_filter_applies_to_resolved_patients(self):
+        server = FakePatientServer()
+        processor = make_processor(server)
+        page = bundle([condition_entry("p1"), condition_entry("p2"), patient_entry("p3", BIRTH_DATES["p3"])])
+        query_filters = {'age_filters': [{'operator': 'gt', 'value': 50}]}
+
+        result = await processor.process_fhir_response(page, query_filters)
+
+        assert sorted(p['id'] for p in result['patients']) == ["p1", "p3"]
+        assert len(server.requests) == 1
+        assert server.requests[0].url.params['_id'] == "p1,p2"
@@ -0,0 +1,302 @@
+import pytest
+from datetime import date
+from unittest.mock import Mock, AsyncMock
+
+from app.metrics import metrics
+from app.nlp.fhir_nlp_service import FHIRQueryProcessor
+from app.nlp.query_planner import FilterPlanner, birthdate_search_param, parse_capabilities, years_before
+
+
+TODAY = date(2024, 6, 15)
+
+CAPABILITY_STATEMENT = {
+    "resourceType": "CapabilityStatement",
+    "rest": [{
+        "mode": "server",
+        "resource": [
+            {"type": "Condition", "searchParam": [{"name": "code"}, {"name": "subject"}]},
+            {"type": "Patient", "searchParam": [{"name": "birthdate"}]}
+        ]
+    }]
+}
+
+
+class TestBirthdateConversion:
+    """Test cases for age -> birthdate translation"""
+
+    @pytest.mark.parametrize("operator,age,expected", [
+        ("gt", 50, "birthdate=le1973-06-15"),
+        ("ge", 50, "birthdate=le1974-06-15"),
+        ("lt", 30, "birthdate=gt1994-06-15"),
+        ("le", 30, "birthdate=gt1993-06-15"),
+    ])
+    def test_birthdate_search_param(self, operator, age, expected):
+        assert birthdate_search_param(operator, age, TODAY) == expected
+
+    def test_years_before_leap_day(self):
+        assert years_before(date(2024, 2, 29), 1) == date(2023, 2, 28)
+
+
+class TestFilterPlanner:
+    """Test cases for filter pushdown planning"""
+
+    @pytest.fixture
+    def conditions(self):
+        return [
+            {'search_param': 'code=http://snomed.info/sct|73211009'},
+            {'search_param': 'code=http://snomed.info/sct|38341003'},
+            {'search_param': 'code=http://snomed.info/sct|73211009'},
+        ]
+
+    def test_parse_capabilities(self):
+        capabilities = parse_capabilities(CAPABILITY_STATEMENT)
+
+        assert capabilities == {'Condition': {'code', 'subject'}, 'Patient': {'birthdate'}}
+
+    def test_codes_are_ored_and_deduplicated(self, conditions):
+        params = FilterPlanner().plan('Condition', conditions, [])
+
+        assert params == ['code=http://snomed.info/sct|38341003,http://snomed.info/sct|73211009']
+
+    def test_demographics_chained_on_condition(self):
+        age_filters = [{'search_param': 'birthdate=le1973-06-15'}]
+        gender = {'value': 'female', 'search_param': 'gender=female'}
+
+        params = FilterPlanner().plan('Condition', [], age_filters, gender)
+
+        assert params == ['subject:Patient.birthdate=le1973-06-15', 'subject:Patient.gender=female']
+        assert age_filters[0]['pushed_down'] is True
+        assert gender['pushed_down'] is True
+
+    def test_demographics_direct_on_patient(self):
+        params = FilterPlanner().plan('Patient', [], [{'search_param': 'birthdate=le1973-06-15'}])
+
+        assert params == ['birthdate=le1973-06-15']
+
+    def test_unsupported_params_fall_back_to_client(self):
+        planner = FilterPlanner(parse_capabilities(CAPABILITY_STATEMENT))
+        age_filters = [{'search_param': 'birthdate=le1973-06-15'}]
+        gender = {'value': 'male', 'search_param': 'gender=male'}
+
+        params = planner.plan('Condition', [], age_filters, gender)
+
+        assert params == ['subject:Patient.birthdate=le1973-06-15']
+        assert age_filters[0]['pushed_down'] is True
+        assert gender['pushed_down'] is False
+
+    def test_elements_follow_consumed_fields(self):
+        from app.services.fhir_stream import CONSUMED_FIELDS
+
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setitem(CONSUMED_FIELDS, 'Patient', CONSUMED_FIELDS['Patient'] + ('deceasedBoolean',))
+            elements = FilterPlanner.elements_for(['Condition', 'Patient'])
+
+        assert elements == ['birthDate', 'code', 'deceasedBoolean', 'gender', 'name', 'subject']
+
+    @pytest.mark.parametrize("projection,expected", [
+        ("elements", ['_elements=birthDate,code,gender,name,subject']),
+        ("summary", ['_summary=data']),
+        ("none", []),
+    ])
+    def test_projection_params(self, projection, expected):
+        planner = FilterPlanner(projection=projection)
+
+        assert planner.projection_params('Condition', ['Patient']) == expected
+
+
+class TestProcessorPushdown:
+    """Test cases for pushdown in FHIRQueryProcessor"""
+
+    @pytest.fixture
+    def processor(self):
+        return FHIRQueryProcessor(nlp=Mock())
+
+    def test_build_fhir_query_pushes_age_and_codes(self, processor):
+        result = processor.build_fhir_query("female patients with diabetes or hypertension over 50")
+
+        url = result['fhir_url']
+        assert result['resource_type'] == 'Condition'
+        assert 'code=http://hl7.org/fhir/sid/icd-10|E10-E14,http://snomed.info/sct|38341003,http://snomed.info/sct|73211009' in url
+        assert 'subject:Patient.birthdate=le' in url
+        assert 'subject:Patient.gender=female' in url
+        assert '_elements=birthDate,code,gender,name,subject' in url
+        assert result['filters']['gender']['value'] == 'female'
+
+    def test_build_fhir_query_demographics_only_searches_patient(self, processor):
+        result = processor.build_fhir_query("show male patients over 65")
+
+        assert result['resource_type'] == 'Patient'
+        assert '/Patient?' in result['fhir_url'] and '&birthdate=le' in result['fhir_url']
+        assert 'gender=male' in result['fhir_url']
+        assert '_include' not in result['fhir_url']
+
+    @pytest.mark.parametrize("text,expected", [
+        ("female patients", "female"),
+        ("women over 40", "female"),
+        ("male patients with asthma", "male"),
+        ("how many patients", None),
+    ])
+    def test_extract_gender(self, processor, text, expected):
+        gender = processor.extract_gender(text)
+
+        assert (gender['value'] if gender else None) == expected
+
+    @pytest.mark.asyncio
+    async def test_load_capabilities(self, processor):
+        processor.fhir_client = Mock(get_json=AsyncMock(return_value=CAPABILITY_STATEMENT))
+
+        await processor.load_capabilities()
+
+        processor.fhir_client.get_json.assert_awaited_once_with(f"{processor.fhir_base_url}/metadata")
+        assert processor.planner.supports('Patient', 'birthdate')
+        assert not processor.planner.supports('Patient', 'gender')
+
+    @pytest.mark.asyncio
+    async def test_load_capabilities_failure_assumes_support(self, processor):
+        processor.fhir_client = Mock(get_json=AsyncMock(side_effect=Exception("offline")))
+
+        await processor.load_capabilities()
+
+        assert processor.planner.capabilities is None
+        assert processor.planner.supports('Patient', 'gender')
+
+
+class TestPatientCount:
+    """Test cases for the count execution path"""
+
+    @pytest.fixture
+    def processor(self):
+        return FHIRQueryProcessor(nlp=Mock())
+
+    def test_plan_patient_count(self):
+        params = FilterPlanner().plan_patient_count(
+            [{'search_param': 'code=http://snomed.info/sct|73211009'}],
+            [{'search_param': 'birthdate=le1973-06-15'}],
+            {'value': 'male', 'search_param': 'gender=male'}
+        )
+
+        assert params == [
+            '_has:Condition:subject:code=http://snomed.info/sct|73211009',
+            'birthdate=le1973-06-15',
+            'gender=male',
+            '_summary=count'
+        ]
+
+    def test_plan_patient_count_unsupported_filter(self):
+        planner = FilterPlanner(parse_capabilities(CAPABILITY_STATEMENT))
+
+        params = planner.plan_patient_count([], [], {'value': 'male', 'search_param': 'gender=male'})
+
+        assert params is None
+
+    @pytest.mark.asyncio
+    async def test_count_patients_on_server(self, processor):
+        processor.fhir_client = Mock(get_json=AsyncMock(return_value={"resourceType": "Bundle", "total": 4321}))
+        fhir_query = processor.build_fhir_query("Count diabetic patients")
+
+        result = await processor.count_patients(fhir_query)
+
+        assert result['total_patients'] == 4321
+        assert result['count_method'] == 'server'
+        assert result['patients'] == []
+        url = processor.fhir_client.get_json.call_args[0][0]
+        assert url.startswith(f"{processor.fhir_base_url}/Patient?_has:Condition:subject:code=")
+        assert url.endswith('_summary=count')
+
+    @pytest.mark.asyncio
+    async def test_count_patients_streaming_fallback(self, processor):
+        processor.planner = FilterPlanner(parse_capabilities(CAPABILITY_STATEMENT))
+        processor.fhir_client = Mock(get_json=AsyncMock())
+        fhir_query = processor.build_fhir_query("how many male patients have diabetes")
+
+        async def pages():
+            yield {"resourceType": "Bundle", "entry": [
+                {"resource": {"resourceType": "Condition", "subject": {"reference": "Patient/p1"}}},
+                {"resource": {"resourceType": "Condition", "subject": {"reference": "Patient/p1"}}},
+                {"resource": {"resourceType": "Condition", "subject": {"reference": "Patient/p2"}}},
+                {"resource": {"resourceType": "Patient", "id": "p1", "gender": "male"}},
+                {"resource": {"resourceType": "Patient", "id": "p2", "gender": "female"}},
+            ]}
+
+        processor.search_pages = Mock(return_value=pages())
+
+        result = await processor.count_patients(fhir_query)
+
+        assert result['total_patients'] == 1
+        assert result['count_method'] == 'streaming'
+        processor.fhir_client.get_json.assert_not_called()
+        assert processor.search_pages.call_args.kwargs['streaming'] is True
+
+
+class TestCanonicalPlan:
+    """Test cases for canonical plans and the caches keyed on them"""
+
+    @pytest.fixture
+    def processor(self):
+        return FHIRQueryProcessor(nlp=Mock())
+
+    @pytest.fixture(autouse=True)
+    def reset_metrics(self):
+        metrics.reset()
+        yield
+
+    def test_paraphrases_share_a_plan(self, processor):
+        queries = [
+            "Show me all diabetic patients over 50",
+            "patients with diabetes older than 50",
+            "List diabetic patients above 50",
+            "patients with diabetes 51 and over",
+        ]
+
+        results = [processor.build_fhir_query(query) for query in queries]
+
+        assert len({result['plan_hash'] for result in results}) == 1
+        assert len({result['fhir_url'] for result in results}) == 1
+        assert processor.build_fhir_query("how many diabetic patients over 50")['plan_hash'] != results[0]['plan_hash']
+
+    def test_search_parameters_are_sorted_and_deduplicated(self, processor):
+        result = processor.build_fhir_query("patients with diabetes over 50 older than 50")
+
+        assert result['search_parameters'] == sorted(set(result['search_parameters']))
+        assert result['plan']['birthdate'] == [result['filters']['age_filters'][0]['search_param']]
+
+    def test_plan_cache_hits_on_normalized_text(self, processor):
+        first = processor.build_fhir_query("Patients with  Asthma?")
+        processor.scanner = Mock(side_effect=AssertionError("should not re-parse"))
+
+        second = processor.build_fhir_query("patients with asthma")
+
+        assert second['original_query'] == "patients with asthma"
+        assert second['plan_hash'] == first['plan_hash']
+        assert second is not first
+        counters = metrics.snapshot()['counters']
+        assert counters['plan_cache_hits'] == 1
+        assert counters['plan_cache_misses'] == 1
+
+    def test_cached_plan_keeps_its_own_did_you_mean(self, processor):
+        processor.build_fhir_query("patients with asthama")
+
+        result = processor.build_fhir_query("Patients with Asthama")
+
+        assert result['did_you_mean'] == "Patients with asthma"
+
+    @pytest.mark.asyncio
+    async def test_capabilities_reload_clears_plans(self, processor):
+        processor.build_fhir_query("patients with asthma")
+        processor.fhir_client = Mock(get_json=AsyncMock(return_value=CAPABILITY_STATEMENT))
+
+        await processor.load_capabilities()
+
+        assert len(processor.plan_cache) == 0
+
+    @pytest.mark.asyncio
+    async def test_results_are_memoized_by_plan_hash(self, processor):
+        processor.count_patients = AsyncMock(return_value={'total_patients': 3, 'patients': []})
+
+        first = await processor.execute_query(processor.build_fhir_query("how many patients have asthma"))
+        second = await processor.execute_query(processor.build_fhir_query("count the asthma patients"))
+
+        assert first == second == {'total_patients': 3, 'patients': []}
+        processor.count_patients.assert_awaited_once()
+        snapshot = metrics.snapshot()
+        assert snapshot['hit_rates']['result_cache'] == 0.5
@@ -0,0 +1,213 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from unittest.mock import AsyncMock, Mock
+
+from app.metrics import metrics
+from app.nlp.fhir_nlp_service import FHIRQueryProcessor
+from app.services.query_stream import EVENT_STREAM, NDJSON, QueryStream, stream_media_type
+from app.services.response_shaping import ResponseShape
+from app.tests.helpers import BASE_URL, FakeCohortServer, bundle, condition_entry, make_processor, patient_entry
+
+
+SEARCH_URL = f"{BASE_URL}/Condition?code=http://snomed.info/sct|73211009"
+BIRTH_DATES = {"p1": "1950-01-01", "p2": "1940-01-01", "p3": "2010-01-01", "p4": "1945-01-01"}
+OVER_50 = {'age_filters': [{'operator': 'gt', 'value': 50}]}
+
+
+def patient(patient_id):
+    return patient_entry(patient_id, BIRTH_DATES[patient_id])
+
+
+class FakeSearchServer:
+    """Two linked search pages; p2 is only reachable by `_id`, p1 has conditions on both pages"""
+
+    def __init__(self, fail_page_2=False):
+        self.requests = []
+        self.fail_page_2 = fail_page_2
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        params = request.url.params
+        if '_id' in params:
+            return httpx.Response(200, json=bundle([patient(i) for i in params['_id'].split(',')]))
+        if params.get('page') == '2':
+            if self.fail_page_2:
+                return httpx.Response(500, json={"resourceType": "OperationOutcome"})
+            return httpx.Response(200, json=bundle([
+                condition_entry("p1", "Hypertension"), condition_entry("p3"), condition_entry("p4"), patient("p4")
+            ]))
+        return httpx.Response(200, json=bundle([
+            condition_entry("p1"), patient("p1"), condition_entry("p2"), condition_entry("p3"), patient("p3")
+        ], next_url=f"{BASE_URL}?_getpages=abc&page=2"))
+
+    def pages_requested(self):
+        return [r for r in self.requests if '_id' not in r.url.params]
+
+
+def search_query(filters=OVER_50, **extra):
+    return {'intent': 'search_patients', 'fhir_url': SEARCH_URL, 'filters': filters, **extra}
+
+
+async def collect(stream):
+    return [event async for batch in stream.events() for event in batch]
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+    yield
+
+
+class TestQueryStream:
+    """Test cases for streaming query results page by page"""
+
+    @pytest.mark.asyncio
+    async def test_events_follow_the_pages(self):
+        stream = QueryStream(make_processor(FakeSearchServer()), search_query(), ResponseShape.parse(),
+                             header={'original_query': "patients over 50"})
+
+        events = await collect(stream)
+
+        names = [name for name, _ in events]
+        assert names == ['header', 'patient', 'patient', 'progress', 'patient', 'conditions', 'progress', 'summary']
+        assert events[0][1]['original_query'] == "patients over 50"
+        assert events[0][1]['fhir_query']['fhir_url'] == SEARCH_URL
+        # p3 is too young; p2 was resolved by `_id` before filtering
+        assert [data['id'] for name, data in events if name == 'patient'] == ["p1", "p2", "p4"]
+        assert events[2][1]['birthDate'] == "1940-01-01"
+        assert events[5][1] == {'id': "p1", 'conditions': ["Hypertension"]}
+        assert events[3][1]['pages'] == 1 and events[3][1]['patients'] == 2
+        summary = events[-1][1]
+        assert summary['total_patients'] == 3
+        assert summary['paging']['pages_fetched'] == 2
+        assert summary['timing']['first_result_ms'] <= summary['timing']['total_ms']
+
+    @pytest.mark.asyncio
+    async def test_matches_the_buffered_query(self):
+        server = FakeSearchServer()
+        processor = make_processor(server)
+        streamed = await collect(QueryStream(processor, search_query(), ResponseShape.parse()))
+        buffered = await processor.execute_query(search_query())
+
+        assert [data['id'] for name, data in streamed if name == 'patient'] == [p['id'] for p in buffered['patients']]
+
+    @pytest.mark.asyncio
+    async def test_pages_are_fetched_as_events_are_consumed(self):
+        server = FakeSearchServer()
+        batches = QueryStream(make_processor(server), search_query(), ResponseShape.parse()).events()
+
+        await batches.__anext__()  # header
+        first_page = await batches.__anext__()
+
+        assert [name for name, _ in first_page][:2] == ['patient', 'patient']
+        assert len(server.pages_requested()) == 1
+        await batches.aclose()
+
+    @pytest.mark.asyncio
+    async def test_disconnect_stops_upstream_fetches(self):
+        server = FakeSearchServer()
+        stream = QueryStream(make_processor(server), search_query(), ResponseShape.parse(),
+                             is_disconnected=AsyncMock(return_value=True))
+
+        events = await collect(stream)
+
+        assert [name for name, _ in events][-1] == 'progress'
+        assert len(server.pages_requested()) == 1
+        assert metrics.snapshot()['counters']['query_streams_disconnected'] == 1
+
+    @pytest.mark.asyncio
+    async def test_closing_the_stream_cancels_page_fetches_in_flight(self):
+        cancelled = []
+        release = asyncio.Event()
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            offset = request.url.params.get('_getpagesoffset')
+            if offset is None:
+                return httpx.Response(200, json=bundle([condition_entry("p1"), patient("p1")], total=4,
+                                                       next_url=f"{BASE_URL}?_getpages=abc&_getpagesoffset=1&_count=1"))
+            try:
+                await release.wait()
+            except asyncio.CancelledError:
+                cancelled.append(offset)
+                raise
+            return httpx.Response(200, json=bundle([]))
+
+        batches = QueryStream(make_processor(handler), search_query({}), ResponseShape.parse()).events()
+        await batches.__anext__()
+        await batches.__anext__()
+        # The pager is now reading ahead; the client leaves before those pages land
+        next_batch = asyncio.ensure_future(batches.__anext__())
+        await asyncio.sleep(0.01)
+        next_batch.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await next_batch
+        await asyncio.sleep(0)  # let the cancelled fetches unwind
+
+        assert sorted(cancelled) == ["1", "2", "3"]
+        assert metrics.snapshot()['counters']['query_streams_cancelled'] == 1
+
+    @pytest.mark.asyncio
+    async def test_upstream_failure_ends_with_an_error_event(self):
+        stream = QueryStream(make_processor(FakeSearchServer(fail_page_2=True)), search_query(), ResponseShape.parse())
+
+        events = await collect(stream)
+
+        assert events[-1][0] == 'error'
+        assert events[-1][1]['patients_sent'] == 2
+
+    @pytest.mark.asyncio
+    async def test_fields_select_patient_attributes(self):
+        stream = QueryStream(make_processor(FakeSearchServer()), search_query(), ResponseShape.parse("age"))
+
+        events = await collect(stream)
+
+        assert {tuple(data) for name, data in events if name == 'patient'} == {('id', 'age')}
+        assert 'conditions' not in [name for name, _ in events]
+
+    @pytest.mark.asyncio
+    async def test_cohort_plans_stream_the_result_set(self):
+        server = FakeCohortServer()
+        processor = make_processor(server)
+        fhir_query = processor.build_fhir_query("patients with diabetes and hypertension")
+
+        events = await collect(QueryStream(processor, fhir_query, ResponseShape.parse()))
+
+        assert [name for name, _ in events] == ['header', 'patient', 'patient', 'progress', 'summary']
+        patients = [data for name, data in events if name == 'patient']
+        assert [p['id'] for p in patients] == ["p2", "p3"]
+        assert all({'name', 'birthDate', 'age', 'gender'} <= set(p) for p in patients)
+        assert events[-1][1]['total_patients'] == 2
+        assert server.searched('Patient')
+
+    @pytest.mark.asyncio
+    async def test_counts_send_only_a_summary(self):
+        processor = FHIRQueryProcessor(nlp=Mock())
+        processor.execute_query = AsyncMock(return_value={'total_patients': 42, 'patients': [], 'count_method': 'server'})
+
+        events = await collect(QueryStream(processor, search_query(intent='count_patients'), ResponseShape.parse()))
+
+        assert [name for name, _ in events] == ['header', 'summary']
+        assert events[-1][1]['total_patients'] == 42
+        assert events[-1][1]['count_method'] == 'server'
+
+    @pytest.mark.asyncio
+    async def test_encodings(self):
+        processor = FHIRQueryProcessor(nlp=Mock())
+        processor.execute_query = AsyncMock(return_value={'total_patients': 1, 'patients': []})
+        fhir_query = search_query(intent='count_patients')
+
+        ndjson = b''.join([chunk async for chunk in QueryStream(processor, fhir_query, ResponseShape.parse()).encode(NDJSON)])
+        sse = b''.join([chunk async for chunk in QueryStream(processor, fhir_query, ResponseShape.parse()).encode(EVENT_STREAM)])
+
+        lines = [json.loads(line) for line in ndjson.decode().splitlines()]
+        assert [line['event'] for line in lines] == ['header', 'summary']
+        assert sse.decode().startswith("event: header\ndata: {")
+        assert sse.decode().endswith("\n\n") and "event: summary\n" in sse.decode()
+
+    def test_media_type_follows_accept(self):
+        assert stream_media_type("text/event-stream") == EVENT_STREAM
+        assert stream_media_type("application/json") == NDJSON
+        assert stream_media_type(None) == NDJSON
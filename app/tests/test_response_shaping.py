@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from app.services import response_shaping
+from app.services.response_shaping import ResponseShape, ResponseShapeError, json_response
+
+
+RESULTS = {
+    'total_patients': 2,
+    'patients': [
+        {'id': 'p1', 'name': 'Ann Lee', 'birthDate': '1950-01-01', 'age': 76, 'gender': 'female', 'conditions': ['Asthma']},
+        {'id': 'p2', 'conditions': ['Asthma']},
+    ],
+    'raw_fhir_response': {'resourceType': 'Bundle', 'entry': []},
+}
+
+
+class TestResponseShape:
+    """Test cases for /query response shaping"""
+
+    def test_default_drops_raw_and_keeps_patients(self):
+        shaped = ResponseShape.parse().apply(RESULTS)
+
+        assert 'raw_fhir_response' not in shaped
+        assert shaped['patients'] == RESULTS['patients']
+        assert 'raw_fhir_response' in RESULTS  # shared cached results are left untouched
+
+    def test_include_raw(self):
+        assert ResponseShape.parse(include_raw=True).apply(RESULTS)['raw_fhir_response'] == RESULTS['raw_fhir_response']
+
+    def test_fields_projection_always_keeps_id(self):
+        shape = ResponseShape.parse("age, name")
+
+        assert shape.fields == ('id', 'name', 'age')
+        assert shape.apply(RESULTS)['patients'] == [{'id': 'p1', 'name': 'Ann Lee', 'age': 76}, {'id': 'p2'}]
+
+    def test_compact_encoding(self):
+        patients = ResponseShape.parse("gender", encoding="compact").apply(RESULTS)['patients']
+
+        assert patients == {'columns': ['id', 'gender'], 'rows': [['p1', 'female'], ['p2', None]]}
+
+    def test_aggregates_only(self):
+        shape = ResponseShape.parse("aggregates")
+
+        assert shape.execute_options() == {'aggregates': True, 'materialize': False}
+        assert ResponseShape.parse("aggregates,age").execute_options() == {'aggregates': True, 'materialize': True}
+
+    @pytest.mark.parametrize("fields,encoding", [("ssn", "objects"), (None, "xml")])
+    def test_invalid(self, fields, encoding):
+        with pytest.raises(ResponseShapeError):
+            ResponseShape.parse(fields, encoding=encoding)
+
+    @pytest.mark.parametrize("orjson_available", [True, False])
+    def test_json_response(self, monkeypatch, orjson_available):
+        if orjson_available and not response_shaping.ORJSON_AVAILABLE:
+            pytest.skip("orjson not installed")
+        monkeypatch.setattr(response_shaping, 'ORJSON_AVAILABLE', orjson_available)
+
+        response = json_response({'name': 'Zoë', 'n': [1, 2.5, None]})
+
+        assert response.media_type == 'application/json'
+        assert json.loads(response.body) == {'name': 'Zoë', 'n': [1, 2.5, None]}
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from app.services.cohort_frame import CohortFrameBuilder
+from app.services.result_store import InvalidCursor, ResultSet, ResultStore, decode_cursor, encode_cursor
+from app.tests.helpers import FakeClock
+
+
+@pytest.fixture
+def result_set():
+    builder = CohortFrameBuilder()
+    for number in range(5):
+        builder.add_patient(f"p{number}", f"Test p{number}", "1980-01-01", "female")
+        builder.add_condition(f"p{number}", "Asthma")
+    # Every other row matched
+    return ResultSet(builder.build(), np.array([0, 2, 4], dtype=np.int64))
+
+
+class TestResultSet:
+    """Test cases for paging over a materialized result set"""
+
+    def test_cursor_round_trip(self):
+        assert decode_cursor(None) == 0
+        assert decode_cursor(encode_cursor(250)) == 250
+
+    @pytest.mark.parametrize("cursor", ["not a cursor", encode_cursor(1)[:-1] + "!", "bzotMQ"])
+    def test_invalid_cursor(self, cursor):
+        with pytest.raises(InvalidCursor):
+            decode_cursor(cursor)
+
+    def test_pages_cover_the_rows_once(self, result_set):
+        first, cursor = result_set.page(limit=2)
+        second, last = result_set.page(cursor, limit=2)
+
+        assert [p['id'] for p in first] == ["p0", "p2"]
+        assert [p['id'] for p in second] == ["p4"]
+        assert second[0]['conditions'] == ["Asthma"]
+        assert last is None
+
+    def test_cursor_past_the_end(self, result_set):
+        assert result_set.page(encode_cursor(3)) == ([], None)
+        with pytest.raises(InvalidCursor):
+            result_set.page(encode_cursor(4))
+
+
+class TestResultStore:
+    """Test cases for the handle -> result set store"""
+
+    def test_handles_are_distinct(self, result_set):
+        store = ResultStore(max_entries=4, ttl=60)
+        first, second = store.put(result_set), store.put(result_set)
+
+        assert first != second
+        assert store.get(first) is result_set
+        assert store.get("unknown") is None
+
+    def test_entries_expire_and_are_bounded(self, result_set):
+        store = ResultStore(max_entries=2, ttl=60)
+        store.result_sets.clock = clock = FakeClock()
+        handles = [store.put(result_set) for _ in range(3)]
+
+        assert store.get(handles[0]) is None
+        assert store.get(handles[2]) is result_set
+        clock.now += 61
+        assert store.get(handles[2]) is None
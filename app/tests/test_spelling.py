@@ -0,0 +1,44 @@
+import pytest
+
+from app.nlp.spelling import SymSpell, deletes, edit_distance
+
+
+class TestSymSpell:
+    """Test cases for symmetric-delete spelling correction"""
+
+    @pytest.mark.parametrize("a,b,expected", [
+        ("asthma", "asthma", 0),
+        ("asthama", "asthma", 1),
+        ("diabtees", "diabetes", 1),
+        ("hypertention", "hypertension", 1),
+        ("gout", "goiter", 3),
+    ])
+    def test_edit_distance(self, a, b, expected):
+        assert edit_distance(a, b, limit=2) == min(expected, 3)
+
+    def test_deletes(self):
+        assert deletes("abc", 1) == {"abc", "bc", "ac", "ab"}
+
+    def test_lookup_corrects_within_distance(self):
+        speller = SymSpell(["diabetes", "hypertension", "asthma"])
+
+        assert speller.lookup("diabetis") == ("diabetes", 1)
+        assert speller.lookup("hypertention") == ("hypertension", 1)
+        assert speller.lookup("asthma") == ("asthma", 0)
+        assert speller.lookup("patients") is None
+
+    def test_lookup_respects_requested_distance(self):
+        speller = SymSpell(["asthma"])
+
+        assert speller.lookup("azthmaa", max_distance=1) is None
+        assert speller.lookup("azthmaa") == ("asthma", 2)
+
+    def test_ties_prefer_the_more_frequent_word(self):
+        speller = SymSpell(["diabetic", "diabetes", "diabetes"])
+
+        assert speller.lookup("diabetis") == ("diabetes", 1)
+
+    def test_words_longer_than_prefix(self):
+        speller = SymSpell(["schizophrenia"], prefix_length=7)
+
+        assert speller.lookup("schizofrenia") == ("schizophrenia", 2)
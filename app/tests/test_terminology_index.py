@@ -0,0 +1,102 @@
+import json
+import pickle
+import pytest
+
+from app.nlp.condition_matcher import load_matcher
+from app.nlp.terminology_index import TerminologyIndex, build_index, is_index, main, read_source
+
+
+SCT = "http://snomed.info/sct"
+ICD = "http://hl7.org/fhir/sid/icd-10"
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    path = str(tmp_path / "conditions.idx")
+    build_index([
+        ("Diabetes", (SCT, "73211009", "Diabetes mellitus")),
+        ("diabetes", (ICD, "E10-E14", "Diabetes mellitus")),
+        ("diabetes", (SCT, "73211009", "Diabetes mellitus")),
+        ("High blood pressure", (SCT, "38341003", "Hypertensive disorder")),
+        ("asthma", (SCT, "195967001", "Asthma")),
+    ], path)
+    return path
+
+
+class TestTerminologyIndex:
+    """Test cases for the memory-mapped terminology index"""
+
+    def test_lookup(self, index_path):
+        index = TerminologyIndex(index_path)
+
+        assert index['diabetes'] == [
+            {'system': SCT, 'code': '73211009', 'display': 'Diabetes mellitus'},
+            {'system': ICD, 'code': 'E10-E14', 'display': 'Diabetes mellitus'}
+        ]
+        assert index['high blood pressure'][0]['code'] == '38341003'
+        assert 'hypertension' not in index
+        with pytest.raises(KeyError):
+            index['hypertension']
+
+    def test_terms_are_sorted(self, index_path):
+        index = TerminologyIndex(index_path)
+
+        assert list(index) == ['asthma', 'diabetes', 'high blood pressure']
+        assert len(index) == 3
+
+    def test_rejects_other_files(self, tmp_path):
+        path = tmp_path / "conditions.tsv"
+        path.write_text("diabetes\tsystem\tcode\tdisplay\n")
+
+        assert not is_index(str(path))
+        with pytest.raises(ValueError, match="not a version"):
+            TerminologyIndex(str(path))
+
+    def test_pickles_by_path(self, index_path):
+        index = pickle.loads(pickle.dumps(TerminologyIndex(index_path)))
+
+        assert index['asthma'][0]['code'] == '195967001'
+
+
+class TestIndexSources:
+    """Test cases for compiling the index from code system exports"""
+
+    def test_csv_with_synonyms(self, tmp_path):
+        path = tmp_path / "snomed.csv"
+        path.write_text("code,display,synonyms\n"
+                        "84114007,Heart failure,cardiac failure|CHF\n")
+
+        pairs = list(read_source(str(path), default_system=SCT))
+
+        assert [term for term, _ in pairs] == ['Heart failure', 'cardiac failure', 'CHF']
+        assert pairs[0][1] == (SCT, '84114007', 'Heart failure')
+
+    def test_ndjson_with_designations(self, tmp_path):
+        path = tmp_path / "icd10.ndjson"
+        path.write_text(json.dumps({"system": ICD, "code": "J45", "display": "Asthma",
+                                    "designation": [{"value": "asthmatic bronchitis"}]}) + "\n")
+
+        assert [term for term, _ in read_source(str(path))] == ['Asthma', 'asthmatic bronchitis']
+
+    def test_rows_without_system_are_rejected(self, tmp_path):
+        path = tmp_path / "codes.csv"
+        path.write_text("code,display\nJ45,Asthma\n")
+
+        with pytest.raises(ValueError, match="system"):
+            list(read_source(str(path)))
+
+    def test_build_command(self, tmp_path, capsys):
+        source = tmp_path / "snomed.csv"
+        source.write_text("code,display,synonyms\n84114007,Heart failure,CHF\n")
+        output = str(tmp_path / "snomed.idx")
+
+        main([str(source), "-o", output, "--system", SCT])
+
+        assert "2 terms, 2 codings" in capsys.readouterr().out
+        assert TerminologyIndex(output)['chf'][0]['code'] == '84114007'
+
+    def test_matcher_loads_a_prebuilt_index(self, index_path, tmp_path):
+        matcher = load_matcher(index_path, str(tmp_path / "cache"))
+
+        assert isinstance(matcher.terms, TerminologyIndex)
+        assert [c['code'] for c in matcher.match(['high', 'blood', 'pressure'])] == ['38341003']
@@ -0,0 +1,111 @@
+"""Cost of merging and filtering a cohort: per-patient dicts vs the columnar frame.
+
+The dict path is the processor as it was before CohortFrame: a dict per
+patient, then a Python loop over patients x age filters. The frame path
+merges the same pages into columns, evaluates the filters as vectorized
+masks and materializes dicts only for the first page of results.
+
+    python -m benchmarks.bench_cohort_frame [sizes]   # default 1000,100000,1000000
+"""
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List
+
+from app.services.cohort_frame import CohortFrameBuilder
+
+PAGE_PATIENTS = 500
+RESULT_PAGE = 50
+DISPLAYS = ["Diabetes mellitus", "Hypertension", "Asthma", "Obesity", "Depression"]
+GENDERS = ["male", "female", "other", "unknown"]
+FILTERS = {
+    'age_filters': [{'operator': 'ge', 'value': 40}, {'operator': 'le', 'value': 65}],
+    'gender': {'value': 'female'}
+}
+
+
+def synthetic_pages(patients: int, seed: int = 7) -> Iterator[Dict[str, Any]]:
+    """Searchset pages of Conditions with their included Patients"""
+    rng = random.Random(seed)
+    for start in range(0, patients, PAGE_PATIENTS):
+        entries = []
+        for number in range(start, min(start + PAGE_PATIENTS, patients)):
+            patient_id = f"p{number}"
+            entries.append({"resource": {
+                "resourceType": "Condition", "subject": {"reference": f"Patient/{patient_id}"},
+                "code": {"coding": [{"display": rng.choice(DISPLAYS)}]}
+            }})
+            entries.append({"resource": {
+                "resourceType": "Patient", "id": patient_id,
+                "name": [{"given": ["Test"], "family": patient_id}],
+                "birthDate": f"{rng.randint(1930, 2020)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                "gender": rng.choice(GENDERS)
+            }})
+        yield {"resourceType": "Bundle", "type": "searchset", "entry": entries}
+
+
+def dict_path(pages: Iterator[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    patients: Dict[str, Dict[str, Any]] = {}
+    current_year = datetime.now().year
+    for page in pages:
+        for entry in page['entry']:
+            resource = entry['resource']
+            if resource['resourceType'] == 'Condition':
+                patient_id = resource['subject']['reference'].replace('Patient/', '')
+                patients.setdefault(patient_id, {'id': patient_id, 'conditions': []})
+                patients[patient_id]['conditions'].append(resource['code']['coding'][0]['display'])
+            else:
+                names = resource.get('name', [])
+                name = f"{names[0]['given'][0]} {names[0]['family']}".strip() if names else "Unknown"
+                birth_date = resource.get('birthDate', '')
+                age = current_year - int(birth_date[:4]) if birth_date else None
+                patient = {'id': resource['id'], 'name': name, 'birthDate': birth_date, 'age': age,
+                           'gender': resource.get('gender', 'unknown'),
+                           'conditions': patients.get(resource['id'], {}).get('conditions', [])}
+                patients.setdefault(resource['id'], patient).update(patient)
+
+    matched = []
+    for patient in patients.values():
+        include = patient.get('gender') in (None, FILTERS['gender']['value'])
+        for age_filter in FILTERS['age_filters']:
+            if patient.get('age') is None:
+                continue
+            if age_filter['operator'] == 'ge' and not patient['age'] >= age_filter['value']:
+                include = False
+            elif age_filter['operator'] == 'le' and not patient['age'] <= age_filter['value']:
+                include = False
+        if include:
+            matched.append(patient)
+    return matched[:RESULT_PAGE]
+
+
+def frame_path(pages: Iterator[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    builder = CohortFrameBuilder()
+    for page in pages:
+        builder.add_bundle(page)
+    frame = builder.build()
+    rows = frame.filter(FILTERS)
+    return frame.to_dicts(rows[:RESULT_PAGE])
+
+
+def timed(fn, pages) -> float:
+    start = time.perf_counter()
+    fn(pages)
+    return time.perf_counter() - start
+
+
+def main(sizes: List[int]):
+    print(f"{'patients':>10} {'dicts':>10} {'frame':>10} {'speedup':>8}")
+    for size in sizes:
+        # Pages are generated outside the timed section, as they arrive from the server
+        pages = list(synthetic_pages(size))
+        assert [p['id'] for p in dict_path(iter(pages))] == [p['id'] for p in frame_path(iter(pages))]
+        dicts = timed(dict_path, iter(pages))
+        frame = timed(frame_path, iter(pages))
+        print(f"{size:>10} {dicts * 1000:>8.1f}ms {frame * 1000:>8.1f}ms {dicts / frame:>7.2f}x")
+        del pages
+
+
+if __name__ == "__main__":
+    main([int(size) for size in (sys.argv[1] if len(sys.argv) > 1 else "1000,100000,1000000").split(',')])
@@ -0,0 +1,106 @@
+"""Payload-size reduction from `_elements` projection.
+
+Compares each Bundle as the server sends it today with the same Bundle
+trimmed to the `_elements` list FilterPlanner derives from what the
+processor consumes (plus the mandatory id/resourceType/meta).
+
+    python -m benchmarks.bench_elements                     # synthetic bundles
+    python -m benchmarks.bench_elements recorded/*.json     # recorded bundles
+"""
+import gzip
+import json
+import random
+import sys
+from typing import Any, Dict, List
+
+from app.nlp.query_planner import FilterPlanner
+
+MANDATORY = ('resourceType', 'id', 'meta')
+
+
+def synthetic_condition(i: int) -> Dict[str, Any]:
+    """Condition shaped like the resources hapi.fhir.org returns for Synthea data"""
+    return {
+        "resourceType": "Condition",
+        "id": f"cond-{i}",
+        "meta": {"versionId": "1", "lastUpdated": "2024-03-01T10:00:00.000+00:00", "source": "#synthea"},
+        "text": {"status": "generated", "div": "<div xmlns=\"http://www.w3.org/1999/xhtml\">" + "Diabetes mellitus type 2 " * 8 + "</div>"},
+        "clinicalStatus": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/condition-clinical", "code": "active"}]},
+        "verificationStatus": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/condition-ver-status", "code": "confirmed"}]},
+        "category": [{"coding": [{"system": "http://terminology.hl7.org/CodeSystem/condition-category", "code": "encounter-diagnosis", "display": "Encounter Diagnosis"}]}],
+        "code": {"coding": [{"system": "http://snomed.info/sct", "code": "44054006", "display": "Diabetes mellitus type 2 (disorder)"}], "text": "Diabetes mellitus type 2 (disorder)"},
+        "subject": {"reference": f"Patient/pat-{i}"},
+        "encounter": {"reference": f"Encounter/enc-{i}"},
+        "onsetDateTime": "2010-05-04T08:00:00+00:00",
+        "recordedDate": "2010-05-04T08:00:00+00:00"
+    }
+
+
+def synthetic_patient(i: int) -> Dict[str, Any]:
+    return {
+        "resourceType": "Patient",
+        "id": f"pat-{i}",
+        "meta": {"versionId": "1", "lastUpdated": "2024-03-01T10:00:00.000+00:00"},
+        "text": {"status": "generated", "div": "<div xmlns=\"http://www.w3.org/1999/xhtml\">Generated by Synthea" + " ." * 60 + "</div>"},
+        "extension": [
+            {"url": "http://hl7.org/fhir/us/core/StructureDefinition/us-core-race", "extension": [{"url": "text", "valueString": "White"}]},
+            {"url": "http://hl7.org/fhir/StructureDefinition/patient-mothersMaidenName", "valueString": "Jane Smith"},
+            {"url": "http://hl7.org/fhir/StructureDefinition/patient-birthPlace", "valueAddress": {"city": "Boston", "state": "MA", "country": "US"}}
+        ],
+        "identifier": [
+            {"system": "https://github.com/synthetichealth/synthea", "value": f"{random.getrandbits(64):x}"},
+            {"type": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/v2-0203", "code": "MR"}]}, "system": "http://hospital.smarthealthit.org", "value": f"MRN-{i}"}
+        ],
+        "name": [{"use": "official", "family": f"Family{i}", "given": [f"Given{i}"], "prefix": ["Mr."]}],
+        "telecom": [{"system": "phone", "value": "555-123-4567", "use": "home"}],
+        "gender": random.choice(["male", "female"]),
+        "birthDate": f"{random.randint(1930, 2010)}-0{random.randint(1, 9)}-1{random.randint(0, 9)}",
+        "address": [{"line": ["123 Main St"], "city": "Boston", "state": "MA", "postalCode": "02101", "country": "US"}],
+        "maritalStatus": {"coding": [{"system": "http://terminology.hl7.org/CodeSystem/v3-MaritalStatus", "code": "M"}]},
+        "communication": [{"language": {"coding": [{"system": "urn:ietf:bcp:47", "code": "en-US"}]}}]
+    }
+
+
+def synthetic_bundle(count: int) -> Dict[str, Any]:
+    entries = []
+    for i in range(count):
+        entries.append({"fullUrl": f"https://hapi.fhir.org/baseR5/Condition/cond-{i}", "resource": synthetic_condition(i), "search": {"mode": "match"}})
+        entries.append({"fullUrl": f"https://hapi.fhir.org/baseR5/Patient/pat-{i}", "resource": synthetic_patient(i), "search": {"mode": "include"}})
+    return {"resourceType": "Bundle", "type": "searchset", "total": count, "entry": entries}
+
+
+def apply_elements(bundle: Dict[str, Any], elements: List[str]) -> Dict[str, Any]:
+    """What a server returns for the same search with `_elements`"""
+    keep = set(elements) | set(MANDATORY)
+    entries = []
+    for entry in bundle.get('entry', []):
+        resource = {k: v for k, v in entry.get('resource', {}).items() if k in keep}
+        entries.append({**entry, 'resource': resource})
+    return {**bundle, 'entry': entries}
+
+
+def report(name: str, bundle: Dict[str, Any], elements: List[str]):
+    full = json.dumps(bundle).encode()
+    projected = json.dumps(apply_elements(bundle, elements)).encode()
+    full_gz, projected_gz = len(gzip.compress(full)), len(gzip.compress(projected))
+    print(f"{name:<28} {len(full):>12,} {len(projected):>12,} {1 - len(projected) / len(full):>7.1%}"
+          f" {full_gz:>12,} {projected_gz:>12,} {1 - projected_gz / full_gz:>7.1%}")
+
+
+def main(paths: List[str]):
+    random.seed(0)
+    elements = FilterPlanner.elements_for(['Condition', 'Patient'])
+    print(f"_elements={','.join(elements)}\n")
+    print(f"{'bundle':<28} {'full B':>12} {'_elements B':>12} {'saved':>7} {'full gz':>12} {'elem gz':>12} {'saved':>7}")
+
+    if paths:
+        for path in paths:
+            with open(path) as f:
+                report(path, json.load(f), elements)
+    else:
+        for count in (50, 500, 5000):
+            report(f"synthetic {count} conditions", synthetic_bundle(count), elements)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
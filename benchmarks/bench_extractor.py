@@ -0,0 +1,52 @@
+"""Per-query cost of extracting age filters and intent.
+
+Compares the previous approach (one `re.finditer` per age pattern plus a
+substring probe per intent keyword, each computing today's date again)
+with the single compiled alternation in QueryScanner.
+
+    python -m benchmarks.bench_extractor [iterations]
+"""
+import re
+import sys
+import timeit
+from datetime import date
+from typing import Any, Dict, List
+
+from app.nlp.query_planner import birthdate_search_param
+from app.nlp.fhir_nlp_service import FHIRQueryProcessor
+
+QUERIES = [
+    "patients with diabetes over 50",
+    "how many female patients between 40 and 60 have hypertension",
+    "list male patients aged 18 to 30 with asthma",
+    "count patients older than 70 with diabetes",
+    "show me patients 65 and under",
+    "patients with heart disease",
+]
+
+
+def per_pattern(processor: FHIRQueryProcessor, text: str) -> Dict[str, Any]:
+    """The extraction as it ran before the scanner: every pattern scans the text"""
+    text_lower = text.lower()
+    age_filters: List[Dict[str, Any]] = []
+    for pattern, operator in processor.age_patterns:
+        for match in re.finditer(pattern, text_lower):
+            age_value = int(match.group(1))
+            age_filters.append({'parameter': 'birthdate', 'operator': operator, 'value': age_value,
+                                'search_param': birthdate_search_param(operator, age_value, date.today())})
+    if any(word in text_lower for word in processor.intent_keywords['count_patients']):
+        intent = 'count_patients'
+    else:
+        intent = 'search_patients'
+    return {'intent': intent, 'age_filters': age_filters}
+
+
+def main(iterations: int):
+    processor = FHIRQueryProcessor(nlp=object())
+    for name, fn in (("per-pattern", per_pattern), ("single-pass", lambda p, t: p.scanner.scan(t))):
+        elapsed = timeit.timeit(lambda: [fn(processor, q) for q in QUERIES], number=iterations)
+        print(f"{name:<12} {elapsed / (iterations * len(QUERIES)) * 1e6:8.2f} us/query")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,67 @@
+"""Bytes sent and encoding time of /query bodies under each response shape.
+
+`legacy` is the body as it was returned before shaping: raw Bundle included,
+encoded by FastAPI (jsonable_encoder, then json.dumps). The shaped variants
+go through ResponseShape.apply and json_response (orjson when installed).
+
+    python -m benchmarks.bench_response [sizes]   # default 1000,10000,100000
+"""
+import json
+import sys
+import time
+from typing import Any, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+
+from app.config import Config
+from app.services.response_shaping import ORJSON_AVAILABLE, ResponseShape, json_response
+
+DISPLAYS = ["Diabetes mellitus", "Hypertension", "Asthma"]
+
+
+def synthetic_body(patients: int) -> Dict[str, Any]:
+    rows = [
+        {'id': f"p{n}", 'name': f"Test Patient{n}", 'birthDate': f"{1930 + n % 90}-01-01", 'age': 96 - n % 90,
+         'gender': ('male', 'female')[n % 2], 'conditions': DISPLAYS[:1 + n % 3]}
+        for n in range(patients)
+    ]
+    # process_fhir_pages keeps the first upstream page as raw_fhir_response
+    raw = {'resourceType': 'Bundle', 'type': 'searchset', 'total': patients, 'entry': [
+        {'fullUrl': f"{Config.FHIR_BASE_URL}/Patient/p{n}", 'resource': {
+            'resourceType': 'Patient', 'id': f"p{n}", 'name': [{'given': ['Test'], 'family': f"Patient{n}"}],
+            'birthDate': row['birthDate'], 'gender': row['gender'],
+            'meta': {'versionId': '1', 'lastUpdated': '2024-01-01T00:00:00Z'},
+            'text': {'status': 'generated', 'div': '<div xmlns="http://www.w3.org/1999/xhtml">narrative</div>'}
+        }} for n, row in enumerate(rows[:Config.FHIR_PAGE_SIZE])
+    ]}
+    return {'total_patients': patients, 'patients': rows, 'raw_fhir_response': raw}
+
+
+def legacy(results: Dict[str, Any]) -> bytes:
+    return json.dumps(jsonable_encoder({'processed_results': results}), separators=(',', ':')).encode('utf-8')
+
+
+def shaped(shape: ResponseShape):
+    return lambda results: json_response({'processed_results': shape.apply(results)}).body
+
+
+def main(sizes: List[int]):
+    variants = [
+        ("legacy", legacy),
+        ("default", shaped(ResponseShape.parse())),
+        ("fields", shaped(ResponseShape.parse("name,age"))),
+        ("compact", shaped(ResponseShape.parse(encoding="compact"))),
+    ]
+    print(f"encoder: {'orjson' if ORJSON_AVAILABLE else 'json'}")
+    print(f"{'patients':>9} {'variant':<8} {'bytes':>12} {'ms':>9}")
+    for size in sizes:
+        results = synthetic_body(size)
+        for name, encode in variants:
+            start = time.perf_counter()
+            body = encode(results)
+            elapsed = time.perf_counter() - start
+            print(f"{size:>9} {name:<8} {len(body):>12,} {elapsed * 1000:>9.1f}")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in (sys.argv[1] if len(sys.argv) > 1 else "1000,10000,100000").split(',')])
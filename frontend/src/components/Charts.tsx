@@ -1,21 +1,47 @@
 import { ResponsiveContainer, BarChart, Bar, XAxis, YAxis, Tooltip, Legend, PieChart, Pie, Cell } from 'recharts';
-import { useMemo, type JSXElementConstructor, type ReactElement, type ReactNode, type ReactPortal } from 'react';
-import type { FhirQueryResponse } from '../schemas/fhirResponse';
+import { useEffect, useMemo, useState, type JSXElementConstructor, type ReactElement, type ReactNode, type ReactPortal } from 'react';
+import type { CohortAggregates, FhirQueryResponse, QueryAggregates, QueryResultsPage } from '../schemas/fhirResponse';
+import Config from '../config';
 
 export function FhirQueryVisualizer({ data }: { data: FhirQueryResponse }) {
-  const patients = data.processed_results.patients;
+  const { handle, total_patients } = data.processed_results;
+  // /query returns the first page of patients; the rest are paged in by handle
+  const [patients, setPatients] = useState(data.processed_results.patients);
+  const [nextCursor, setNextCursor] = useState(data.processed_results.next_cursor ?? null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [aggregates, setAggregates] = useState<CohortAggregates | undefined>(data.processed_results.aggregates);
+
+  // The histogram covers the whole result set, so it is built from its aggregates rather than the loaded page
+  useEffect(() => {
+    if (aggregates || !handle) return;
+    let cancelled = false;
+    fetch(`${Config.baseURL}/query/${handle}/aggregates`)
+      .then((resp) => (resp.ok ? (resp.json() as Promise<QueryAggregates>) : undefined))
+      .then((body) => { if (!cancelled && body) setAggregates(body.aggregates); })
+      .catch((err) => console.error('Aggregates Error:', err));
+    return () => { cancelled = true; };
+  }, [handle, aggregates]);
+
+  const loadMore = async () => {
+    if (!handle || !nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const resp = await fetch(`${Config.baseURL}/query/${handle}/results?cursor=${encodeURIComponent(nextCursor)}`);
+      if (!resp.ok) throw new Error(`Server returned ${resp.status}`);
+      const page: QueryResultsPage = await resp.json();
+      setPatients((prev) => [...prev, ...page.patients]);
+      setNextCursor(page.next_cursor);
+    } catch (err) {
+      console.error('Results Page Error:', err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
-  const ageBuckets = useMemo(() => {
-    const buckets: Record<string, number> = { '0-20': 0, '21-40': 0, '41-60': 0, '61+': 0 };
-    patients.forEach((p) => {
-      const a = p.age ?? 0;
-      if (a <= 20) buckets['0-20']++;
-      else if (a <= 40) buckets['21-40']++;
-      else if (a <= 60) buckets['41-60']++;
-      else buckets['61+']++;
-    });
-    return Object.entries(buckets).map(([name, count]) => ({ name, count }));
-  }, [patients]);
+  const ageBuckets = useMemo(
+    () => (aggregates?.age.buckets ?? []).map(({ range, count }) => ({ name: range, count })),
+    [aggregates]
+  );
 
 
 
@@ -135,6 +161,20 @@ export function FhirQueryVisualizer({ data }: { data: FhirQueryResponse }) {
                 ))}
             </div>
 
+            {nextCursor && (
+              <div className="flex items-center justify-between mt-3 text-sm text-gray-600">
+                <span>Showing {patients.length} of {total_patients} patients</span>
+                <button
+                  type="button"
+                  onClick={loadMore}
+                  disabled={loadingMore}
+                  className="px-3 py-1 rounded-md border border-gray-300 hover:bg-gray-50 disabled:opacity-50"
+                >
+                  {loadingMore ? 'Loading…' : 'Load more'}
+                </button>
+              </div>
+            )}
+
         </div>
         {/* Charts */}
         <div className="space-y-4">
@@ -181,7 +221,7 @@ export function FhirQueryVisualizer({ data }: { data: FhirQueryResponse }) {
               >
                 {/* Dynamically assign color to each bar for visual interest */}
                 {ageBuckets.map((entry, index) => (
-                    <Bar key={`bar-${index}`} dataKey="count" fill={COLORS[index]} name="Patients" />
+                    <Bar key={`bar-${index}`} dataKey="count" fill={COLORS[index % COLORS.length]} name="Patients" />
                 ))}
               </Bar>
 
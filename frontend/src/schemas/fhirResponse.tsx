@@ -50,7 +50,48 @@ export interface ConditionFilter {
 export interface ProcessedResults {
   total_patients: number;
   patients: PatientSummary[];
-  raw_fhir_response: FhirBundle;
+  // Only sent when the query is made with ?include_raw=true
+  raw_fhir_response?: FhirBundle;
+  // /query returns the first page; later pages come from
+  // GET /query/{handle}/results?cursor={next_cursor}
+  handle?: string;
+  next_cursor?: string | null;
+  // Only sent when the query is made with ?aggregates=true; otherwise
+  // GET /query/{handle}/aggregates returns them for the whole result set
+  aggregates?: CohortAggregates;
+}
+
+// GET /query/{handle}/results
+export interface QueryResultsPage {
+  handle: string;
+  total_patients: number;
+  patients: PatientSummary[];
+  next_cursor: string | null;
+}
+
+// GET /query/{handle}/aggregates
+export interface QueryAggregates {
+  handle: string;
+  total_patients: number;
+  aggregates: CohortAggregates;
+}
+
+export interface CohortAggregates {
+  patients: number;
+  age: {
+    buckets: AgeBucket[];
+    unknown: number;
+    mean: number | null;
+    percentiles: Record<string, number> | null;
+  };
+  gender: Record<string, number>;
+  conditions: { condition: string; patients: number }[];
+  co_occurring: { conditions: [string, string]; patients: number }[];
+}
+
+export interface AgeBucket {
+  range: string;
+  count: number;
 }
 
 export interface PatientSummary {